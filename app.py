@@ -1,11 +1,29 @@
-from flask import Flask, render_template, request, jsonify
-import os
+from dotenv import load_dotenv
+
+# Antes de importar los módulos que leen su configuración del entorno (DB, modelos...)
+load_dotenv()
+
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 import json
+import batch
 import database as db
+import ingest
+import jobs
+import llm
+import llm_cache
+import phases
+import pipeline
+import prompt_registry
+import scheduler
+import search
+import warmup
 from datetime import datetime
-from classifier import classify_stimulus_openai, classify_stimulus_local, load_model_definition
 
 app = Flask(__name__)
+db.init_app(app)
+db.init_db()
+# La precarga de los modelos locales la arranca quien sirve la app (gunicorn.conf.py
+# o el bloque __main__), no el import: bench.py, los tests y el CLI de flask no la quieren
 
 # --- DEBUG HANDLER (TEMPORARY) ---
 @app.errorhandler(Exception)
@@ -29,11 +47,87 @@ def context_view():
 
 # --- API Endpoints ---
 
+def _enqueue_phase(phase, case_id):
+    """Encola una fase de análisis y responde 202 con el id del trabajo."""
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'local')
+    use_cache = data.get('cache', True) is not False
+    job_id = jobs.submit(f'analyze_{phase}', case_id, phases.run_phase, phase, case_id, mode, use_cache,
+                         params={'phase': phase, 'mode': mode, 'cache': use_cache})
+    return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/api/jobs/{job_id}'}), 202
+
+@app.route('/api/cases/<int:case_id>/analyze/<phase>/stream', methods=['GET'])
+def stream_phase(case_id, phase):
+    """Server-Sent Events: tokens del modelo y elementos parseados según llegan."""
+    if phase not in phases.PHASES:
+        return jsonify({'error': 'Fase desconocida'}), 404
+    mode = request.args.get('mode', 'local')
+    use_cache = request.args.get('cache', '1') != '0'
+
+    def generate():
+        for event, data in phases.stream_phase(phase, case_id, mode, use_cache):
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Métricas y caché de la capa LLM
+@app.route('/api/llm/metrics', methods=['GET'])
+def llm_metrics():
+    return jsonify(dict(llm.metrics(), warmup=warmup.stats()))
+
+@app.route('/api/llm/warmup', methods=['POST'])
+def llm_warmup():
+    """Precarga (o renueva el keep_alive de) los modelos locales ahora."""
+    try:
+        warmed = warmup.warm(force=True)
+    except scheduler.QueueRejected as e:
+        return jsonify({'error': e.message}), 503
+    except Exception as e:
+        return jsonify({'error': f'No se pudo precargar: {e}'}), 502
+    return jsonify({'warmed': warmed, 'warmup': warmup.stats()})
+
+@app.route('/api/llm/queue', methods=['GET'])
+def llm_queue():
+    """Cola del modelo local: turnos en curso y en espera, y espera estimada para una petición nueva."""
+    return jsonify(scheduler.overview())
+
+@app.route('/api/llm/cache', methods=['GET'])
+def llm_cache_stats():
+    return jsonify(llm_cache.stats())
+
+@app.route('/api/llm/cache', methods=['DELETE'])
+def llm_cache_clear():
+    return jsonify({'removed': llm_cache.clear()})
+
+# Plantillas de prompt (hash para versionar resultados y cachés)
+@app.route('/api/prompts', methods=['GET'])
+def list_prompts():
+    return jsonify(prompt_registry.list_templates())
+
+# Trabajos asíncronos
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = jobs.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    if job['status'] == 'running':
+        # Posición y espera estimada si el trabajo está esperando turno en el modelo local
+        job['queue'] = scheduler.job_status(job_id)
+    return jsonify(job)
+
 # FASE 0: Gestión de Casos
 @app.route('/api/cases', methods=['GET'])
 def list_cases():
-    cases = db.get_all_cases()
-    return jsonify(cases)
+    """Página de casos: ?limit=&cursor=&status=new,pending&identifier=&since=&until=&order=desc|asc."""
+    args = request.args
+    status = [s for s in args.get('status', '').split(',') if s]
+    try:
+        page = db.list_cases_page(args.get('limit'), args.get('cursor'), status, args.get('identifier'),
+                                  args.get('since'), args.get('until'), args.get('order', 'desc'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
 
 @app.route('/api/cases', methods=['POST'])
 def create_case():
@@ -68,8 +162,14 @@ def delete_case_endpoint(case_id):
 # FASE 1: Inputs
 @app.route('/api/cases/<int:case_id>/inputs', methods=['GET'])
 def list_inputs(case_id):
-    inputs = db.get_case_inputs(case_id)
-    return jsonify(inputs)
+    """Página de inputs: ?limit=&cursor=&input_type=&since=&until=&order=desc|asc."""
+    args = request.args
+    try:
+        page = db.list_inputs_page(case_id, args.get('limit'), args.get('cursor'), args.get('input_type'),
+                                   args.get('since'), args.get('until'), args.get('order', 'desc'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
 
 @app.route('/api/cases/<int:case_id>/inputs', methods=['POST'])
 def add_input(case_id):
@@ -84,6 +184,25 @@ def add_input(case_id):
     input_id = db.add_input(case_id, content, input_type, metadata)
     return jsonify({'id': input_id, 'message': 'Input registrado'})
 
+@app.route('/api/cases/<int:case_id>/inputs/batch', methods=['POST'])
+def add_inputs_batch(case_id):
+    """Carga masiva: array JSON o NDJSON (application/x-ndjson), leído en streaming."""
+    if not db.get_case(case_id):
+        return jsonify({'error': 'Caso no encontrado'}), 404
+
+    content_type = request.mimetype or ''
+    if content_type in ('application/x-ndjson', 'application/jsonl') or request.args.get('format') == 'ndjson':
+        records = ingest.iter_ndjson(request.stream)
+    else:
+        records = ingest.iter_json_array(request.stream)
+
+    try:
+        chunk_size = max(1, min(int(request.args.get('chunk_size', ingest.CHUNK_SIZE)), 5000))
+        summary = ingest.ingest_inputs(case_id, records, chunk_size)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(summary)
+
 # FASE 2: Patrones
 @app.route('/api/cases/<int:case_id>/patterns', methods=['GET'])
 def list_patterns(case_id):
@@ -92,102 +211,7 @@ def list_patterns(case_id):
 
 @app.route('/api/cases/<int:case_id>/analyze/patterns', methods=['POST'])
 def analyze_patterns(case_id):
-    try:
-        data = request.json or {}
-        mode = data.get('mode', 'local')
-        
-        # 1. Obtener inputs
-        inputs = db.get_case_inputs(case_id)
-        if not inputs:
-            return jsonify({'error': 'No hay inputs para analizar'}), 400
-        
-        # 2. Formatear inputs
-        inputs_text = "\n".join([f"- [{i['input_type']}] {i['content']} (Fecha: {i.get('created_at', '')})" for i in inputs])
-        
-        # 3. Cargar prompt
-        try:
-            with open('prompts/pattern_detection.md', 'r', encoding='utf-8') as f:
-                prompt_template = f.read()
-        except FileNotFoundError:
-            return jsonify({'error': 'Prompt de patrones no encontrado'}), 500
-
-        # FIX: Usar replace en lugar de format porque el prompt contiene JSON con llaves {}
-        system_prompt = prompt_template.replace('{inputs_text}', inputs_text)
-        
-        patterns = []
-        
-        if mode == 'cloud':
-            # OpenAI Logic
-            from openai import OpenAI
-            api_key = os.getenv("OPENAI_API_KEY")
-            if not api_key:
-                return jsonify({'error': 'Falta OPENAI_API_KEY en .env'}), 400
-                
-            client = OpenAI(api_key=api_key)
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "system", "content": system_prompt}],
-                response_format={"type": "json_object"},
-                temperature=0.2
-            )
-            import json
-            result_json = json.loads(response.choices[0].message.content)
-            # Manejar si devuelve lista o dict
-            if isinstance(result_json, list):
-                patterns = result_json
-            else:
-                patterns = result_json.get('patterns', result_json)
-            
-        else:
-            # Ollama Logic (Local)
-            import ollama
-            local_prompt = system_prompt + "\n\nIMPORTANTE: Responde ÚNICAMENTE con el JSON válido. Sin markdown, sin explicaciones."
-            
-            response = ollama.chat(model='llama3', messages=[
-                {'role': 'user', 'content': local_prompt},
-            ])
-            content = response['message']['content']
-            
-            import json
-            import re
-            match = re.search(r'(\[.*\]|\{.*\})', content, re.DOTALL)
-            if match:
-                json_str = match.group(1)
-                try:
-                    result_json = json.loads(json_str)
-                    # Manejar si devuelve lista o dict
-                    if isinstance(result_json, list):
-                        patterns = result_json
-                    else:
-                        patterns = result_json.get('patterns', result_json)
-                except json.JSONDecodeError:
-                     return jsonify({'error': 'La IA devolvió un JSON malformado.'}), 500
-            else:
-                return jsonify({'error': 'La IA local no devolvió un JSON válido.'}), 500
-
-        # Normalizar lista (asegurar que es lista de dicts)
-        if isinstance(patterns, dict): patterns = [patterns]
-        if not isinstance(patterns, list): patterns = []
-
-        # 5. Guardar en DB
-        saved_patterns = []
-        for p in patterns:
-            db.add_pattern(
-                case_id, 
-                p.get('description', 'Sin descripción'),
-                p.get('recurrence', 'Media'),
-                p.get('persistence', 'Desconocida'),
-                p.get('pressure_context', 'No especificado'),
-                p.get('contradictions', 'Ninguna')
-            )
-            saved_patterns.append(p)
-            
-        return jsonify({'message': 'Análisis completado', 'patterns': saved_patterns})
-
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': f"Error interno: {str(e)}"}), 500
+    return _enqueue_phase('patterns', case_id)
 
 # FASE 3: Vinculación Ejes
 @app.route('/api/cases/<int:case_id>/axis_assignments', methods=['GET'])
@@ -197,86 +221,7 @@ def list_assignments(case_id):
 
 @app.route('/api/cases/<int:case_id>/analyze/link_axes', methods=['POST'])
 def analyze_link_axes(case_id):
-    try:
-        data = request.json
-        mode = data.get('mode', 'local')
-        
-        # 1. Get Patterns
-        patterns = db.get_case_patterns(case_id)
-        if not patterns:
-            return jsonify({'error': 'No hay patrones para analizar'}), 400
-            
-        # 2. Format Input with IDs
-        patterns_text = "\n".join([f"ID {p['id']}: {p['description']} (Recurrencia: {p['recurrence']})" for p in patterns])
-        
-        # 3. Load Prompt
-        with open('prompts/axis_linking.md', 'r') as f:
-            prompt_template = f.read()
-            
-        system_prompt = prompt_template.replace('{patterns_text}', patterns_text)
-        
-        # 4. Call AI
-        content = ""
-        if mode == 'cloud':
-            from openai import OpenAI
-            client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "system", "content": system_prompt}],
-                response_format={"type": "json_object"}
-            )
-            content = response.choices[0].message.content
-        else:
-            import ollama
-            # Force JSON format in system prompt is often better for local models
-            response = ollama.chat(model='llama3', messages=[{'role': 'user', 'content': system_prompt}], format='json')
-            content = response['message']['content']
-            
-        print(f"DEBUG: AI Response Content: {content}") # Debug log
-
-        # 5. Parse and Save
-        try:
-            result_json = json.loads(content)
-            assignments = result_json.get('assignments', result_json) 
-            
-            # Ensure assignments is a list
-            if isinstance(assignments, dict):
-                assignments = [assignments]
-            if not isinstance(assignments, list):
-                # Fallback if structure is completely wrong
-                return jsonify({'error': f'La IA devolvió un formato inesperado: {type(assignments)}'}), 500
-
-            saved_count = 0
-            for a in assignments:
-                # Skip if not a dict (avoids "string indices" error)
-                if not isinstance(a, dict):
-                    print(f"Skipping invalid assignment item: {a}")
-                    continue
-
-                pid = a.get('pattern_id')
-                axis_name = a.get('axis_name')
-                justification = a.get('justification')
-
-                # Validation
-                if not pid or not axis_name:
-                    print(f"Skipping incomplete assignment: {a}")
-                    continue
-                
-                # Verify pattern belongs to case (optional but good safety)
-                # We trust the ID returned matches one of the inputs
-                
-                db.save_axis_assignment(case_id, pid, axis_name, justification)
-                saved_count += 1
-            
-            return jsonify({'status': 'success', 'assignments': assignments, 'saved_count': saved_count})
-            
-        except json.JSONDecodeError:
-            return jsonify({'error': 'Error al procesar respuesta JSON de la IA'}), 500
-            
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+    return _enqueue_phase('link_axes', case_id)
 
 @app.route('/api/cases/<int:case_id>/axis_assignments', methods=['GET'])
 def get_case_axis_assignments(case_id):
@@ -293,80 +238,7 @@ def get_case_axis_assignments(case_id):
 
 @app.route('/api/cases/<int:case_id>/analyze/dimensions', methods=['POST'])
 def analyze_dimensions(case_id):
-    try:
-        data = request.json
-        mode = data.get('mode', 'local')
-        
-        # 1. Get Axis Assignments
-        assigns = db.get_axis_assignments(case_id)
-        if not assigns:
-            return jsonify({'error': 'No hay vinculaciones de ejes para analizar. Completa la Fase 3 primero.'}), 400
-            
-        # Enrich assignments with pattern descriptions
-        patterns = {p['id']: p['description'] for p in db.get_case_patterns(case_id)}
-        assignments_text = ""
-        for a in assigns:
-            p_desc = patterns.get(a['pattern_id'], 'Patrón desconocido')
-            assignments_text += f"- Eje: {a['axis_name']} | Patrón: {p_desc} | Justificación: {a['justification']}\n"
-        
-        # 2. Load Prompt
-        with open('prompts/axis_classification.md', 'r') as f:
-            prompt_template = f.read()
-            
-        system_prompt = prompt_template.replace('{axis_assignments_text}', assignments_text)
-        
-        # 3. Call AI
-        # 3. Call AI
-        content = ""
-        if mode == 'cloud':
-            from openai import OpenAI
-            client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "system", "content": system_prompt}],
-                response_format={"type": "json_object"}
-            )
-            content = response.choices[0].message.content
-        else:
-            import ollama
-            response = ollama.chat(model='llama3', messages=[{'role': 'user', 'content': system_prompt}], format='json')
-            content = response['message']['content']
-            
-        print(f"DEBUG: AI Response Phase 4: {content}")
-
-        # 4. Parse and Save
-        try:
-            result_json = json.loads(content)
-            # Handle if wrapped in a key or direct list
-            states = result_json.get('axis_states', result_json) 
-            
-            if isinstance(states, dict): 
-                states = [states] # Handle single object edge case
-            
-            if not isinstance(states, list):
-                 return jsonify({'error': f'Formato de respuesta inesperado: {type(states)}'}), 500
-            
-            saved_count = 0
-            for s in states:
-                if not isinstance(s, dict): continue
-                
-                axis_name = s.get('axis_name')
-                if not axis_name: 
-                    print(f"Skipping state without axis_name: {s}")
-                    continue
-                    
-                db.save_axis_state(case_id, axis_name, s.get('status', 'No definido'), s.get('value', ''), s.get('justification', ''))
-                saved_count += 1
-            
-            return jsonify({'status': 'success', 'states': states, 'saved_count': saved_count})
-            
-        except json.JSONDecodeError:
-            return jsonify({'error': 'Error al procesar respuesta JSON de la IA'}), 500
-            
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+    return _enqueue_phase('dimensions', case_id)
 
 @app.route('/api/cases/<int:case_id>/axis_states', methods=['GET'])
 def get_case_axis_states(case_id):
@@ -377,62 +249,7 @@ def get_case_axis_states(case_id):
 
 @app.route('/api/cases/<int:case_id>/analyze/tensions', methods=['POST'])
 def analyze_tensions(case_id):
-    try:
-        data = request.json
-        mode = data.get('mode', 'local')
-        
-        # 1. Get Axis States
-        states = db.get_axis_states(case_id)
-        if not states:
-            return jsonify({'error': 'No hay estados de ejes definidos. Completa la Fase 4 primero.'}), 400
-            
-        # Format states for prompt
-        states_text = ""
-        for s in states:
-            states_text += f"- {s['axis_name']}: {s['value']} (Estado: {s['status']})\n  Justificación: {s['justification']}\n"
-        
-        # 2. Load Prompt
-        with open('prompts/tension_detection.md', 'r') as f:
-            prompt_template = f.read()
-            
-        system_prompt = prompt_template.replace('{axis_states_text}', states_text)
-        
-        # 3. Call AI
-        if mode == 'cloud':
-            from openai import OpenAI
-            client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "system", "content": system_prompt}],
-                response_format={"type": "json_object"}
-            )
-            content = response.choices[0].message.content
-        else:
-            import ollama
-            response = ollama.chat(model='llama3', messages=[{'role': 'system', 'content': system_prompt}], format='json')
-            content = response['message']['content']
-            
-        # 4. Parse and Save
-        try:
-            result_json = json.loads(content)
-            tensions = result_json.get('tensions', result_json)
-            if isinstance(tensions, dict): tensions = [tensions]
-            
-            # Clear old tensions? Let's clear to avoid duplicates
-            db.clear_case_tensions(case_id)
-            
-            for t in tensions:
-                db.save_tension(case_id, t['description'], t['type'], t['axes_involved'], t['severity'])
-            
-            return jsonify({'status': 'success', 'tensions': tensions})
-            
-        except json.JSONDecodeError:
-            return jsonify({'error': 'Error al procesar respuesta JSON de la IA'}), 500
-            
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+    return _enqueue_phase('tensions', case_id)
 
 @app.route('/api/cases/<int:case_id>/tensions', methods=['GET'])
 def get_case_tensions_endpoint(case_id):
@@ -449,61 +266,7 @@ def get_case_tensions_endpoint(case_id):
 
 @app.route('/api/cases/<int:case_id>/analyze/threshold', methods=['POST'])
 def analyze_threshold(case_id):
-    try:
-        data = request.json
-        mode = data.get('mode', 'local')
-        
-        # 1. Gather Case Data (Patterns, Axes, Tensions)
-        patterns = db.get_case_patterns(case_id)
-        axis_states = db.get_axis_states(case_id)
-        tensions = db.get_case_tensions(case_id)
-        
-        if not axis_states:
-             return jsonify({'error': 'Faltan datos de ejes. Completa fases anteriores.'}), 400
-             
-        # Format Summary
-        summary_text = "PATRONES:\n" + "\n".join([f"- {p['description']} (Recurrencia: {p['recurrence']})" for p in patterns])
-        summary_text += "\n\nEJES:\n" + "\n".join([f"- {s['axis_name']}: {s['value']} ({s['status']})" for s in axis_states])
-        summary_text += "\n\nTENSIONES:\n" + "\n".join([f"- {t['description']} (Severidad: {t['severity']})" for t in tensions])
-        
-        # 2. Load Prompt
-        with open('prompts/threshold_evaluation.md', 'r') as f:
-            prompt_template = f.read()
-            
-        system_prompt = prompt_template.replace('{case_summary_text}', summary_text)
-        
-        # 3. Call AI
-        if mode == 'cloud':
-            from openai import OpenAI
-            client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "system", "content": system_prompt}],
-                response_format={"type": "json_object"}
-            )
-            content = response.choices[0].message.content
-        else:
-            import ollama
-            response = ollama.chat(model='llama3', messages=[{'role': 'system', 'content': system_prompt}], format='json')
-            content = response['message']['content']
-            
-        # 4. Parse and Save
-        try:
-            result_json = json.loads(content)
-            # Handle potential nesting
-            eval_data = result_json.get('evaluation', result_json)
-            
-            db.save_threshold_evaluation(case_id, eval_data['score'], eval_data['status'], eval_data['reasoning'])
-            
-            return jsonify({'status': 'success', 'evaluation': eval_data})
-            
-        except json.JSONDecodeError:
-            return jsonify({'error': 'Error al procesar respuesta JSON de la IA'}), 500
-            
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+    return _enqueue_phase('threshold', case_id)
 
 @app.route('/api/cases/<int:case_id>/threshold', methods=['GET'])
 def get_threshold_endpoint(case_id):
@@ -514,63 +277,7 @@ def get_threshold_endpoint(case_id):
 
 @app.route('/api/cases/<int:case_id>/analyze/archetype', methods=['POST'])
 def analyze_archetype(case_id):
-    try:
-        data = request.json
-        mode = data.get('mode', 'local')
-        
-        # 1. Gather ALL Case Data
-        patterns = db.get_case_patterns(case_id)
-        axis_states = db.get_axis_states(case_id)
-        tensions = db.get_case_tensions(case_id)
-        threshold = db.get_threshold_evaluation(case_id)
-        
-        if not threshold:
-             return jsonify({'error': 'Falta evaluación de umbral. Completa la Fase 6.'}), 400
-             
-        # Format Summary
-        summary_text = "PATRONES:\n" + "\n".join([f"- {p['description']}" for p in patterns])
-        summary_text += "\n\nEJES:\n" + "\n".join([f"- {s['axis_name']}: {s['value']} ({s['status']})" for s in axis_states])
-        summary_text += "\n\nTENSIONES:\n" + "\n".join([f"- {t['description']}" for t in tensions])
-        summary_text += f"\n\nEVALUACIÓN DE UMBRAL:\nScore: {threshold['score']}\nStatus: {threshold['status']}\nReasoning: {threshold['reasoning']}"
-        
-        # 2. Load Prompt
-        with open('prompts/archetype_assignment.md', 'r') as f:
-            prompt_template = f.read()
-            
-        system_prompt = prompt_template.replace('{case_summary_text}', summary_text)
-        
-        # 3. Call AI
-        if mode == 'cloud':
-            from openai import OpenAI
-            client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "system", "content": system_prompt}],
-                response_format={"type": "json_object"}
-            )
-            content = response.choices[0].message.content
-        else:
-            import ollama
-            response = ollama.chat(model='llama3', messages=[{'role': 'system', 'content': system_prompt}], format='json')
-            content = response['message']['content']
-            
-        # 4. Parse and Save
-        try:
-            result_json = json.loads(content)
-            # Handle potential nesting
-            arch_data = result_json.get('archetype', result_json)
-            
-            db.save_archetype_assignment(case_id, arch_data['archetype_name'], arch_data['description'], arch_data['fit_score'], arch_data['key_traits'])
-            
-            return jsonify({'status': 'success', 'archetype': arch_data})
-            
-        except json.JSONDecodeError:
-            return jsonify({'error': 'Error al procesar respuesta JSON de la IA'}), 500
-            
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+    return _enqueue_phase('archetype', case_id)
 
 @app.route('/api/cases/<int:case_id>/archetype', methods=['GET'])
 def get_archetype_endpoint(case_id):
@@ -582,41 +289,109 @@ def get_archetype_endpoint(case_id):
             arch['key_traits'] = []
     return jsonify(arch)
 
+# --- PIPELINE COMPLETO (Fases 2 → 7) ---
+
+@app.route('/api/cases/<int:case_id>/pipeline', methods=['POST'])
+def run_case_pipeline(case_id):
+    """Encola todas las fases del caso como un único trabajo; el progreso por etapa está en /api/jobs/<id>."""
+    if not db.get_case(case_id):
+        return jsonify({'error': 'Caso no encontrado'}), 404
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'local')
+    start = data.get('from')
+    use_cache = data.get('cache', True) is not False
+    if start is not None and start not in pipeline.STAGES:
+        return jsonify({'error': f'Etapa desconocida: {start}'}), 400
+    job_id = jobs.submit('pipeline', case_id, pipeline.run_pipeline, case_id, mode, start, use_cache,
+                         params={'mode': mode, 'from': start, 'cache': use_cache})
+    return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/api/jobs/{job_id}'}), 202
+
+# --- FASE 9: RE-ANÁLISIS INCREMENTAL ---
+
+@app.route('/api/cases/<int:case_id>/analyze/incremental', methods=['POST'])
+def analyze_incremental(case_id):
+    """Solo los inputs añadidos desde el último análisis; las fases 3-7 se rehacen si cambian los patrones."""
+    if not db.get_case(case_id):
+        return jsonify({'error': 'Caso no encontrado'}), 404
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'local')
+    use_cache = data.get('cache', True) is not False
+    job_id = jobs.submit('analyze_incremental', case_id, pipeline.run_incremental, case_id, mode, use_cache,
+                         params={'mode': mode, 'cache': use_cache})
+    return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/api/jobs/{job_id}'}), 202
+
+@app.route('/api/cases/<int:case_id>/analysis_runs', methods=['GET'])
+def list_analysis_runs(case_id):
+    return jsonify({
+        'analyzed_watermark': db.get_analyzed_watermark(case_id),
+        'pending_inputs': db.count_inputs_since(case_id, db.get_analyzed_watermark(case_id)),
+        'runs': db.get_analysis_runs(case_id),
+    })
+
+# --- LOTES DE CASOS ---
+
+@app.route('/api/batches', methods=['POST'])
+def create_batch():
+    """Crea un lote con los casos del filtro y lo encola; el detalle por caso está en /api/batches/<id>."""
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'local')
+    statuses = data.get('status') or []
+    if isinstance(statuses, str):
+        statuses = [statuses]
+    try:
+        batch_id, total = batch.create_batch(mode, statuses, data.get('since'), data.get('until'),
+                                             data.get('case_ids'), bool(data.get('force')),
+                                             data.get('cache', True) is not False)
+    except phases.PhaseError as e:
+        return jsonify({'error': e.message}), e.status
+    job_id = jobs.submit('batch', None, batch.run_batch, batch_id, params={'batch_id': batch_id})
+    return jsonify({'batch_id': batch_id, 'total': total, 'job_id': job_id, 'status': 'queued',
+                    'status_url': f'/api/batches/{batch_id}'}), 202
+
+@app.route('/api/batches', methods=['GET'])
+def list_batches():
+    return jsonify(db.list_batch_runs(request.args.get('limit', 20, type=int)))
+
+@app.route('/api/batches/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    run = db.get_batch_run(batch_id)
+    if run is None:
+        return jsonify({'error': 'Lote no encontrado'}), 404
+    return jsonify(batch.summarize(run))
+
+@app.route('/api/batches/<batch_id>/resume', methods=['POST'])
+def resume_batch(batch_id):
+    run = db.get_batch_run(batch_id)
+    if run is None:
+        return jsonify({'error': 'Lote no encontrado'}), 404
+    if run['status'] in ('queued', 'running'):
+        return jsonify({'error': 'El lote ya está en curso'}), 409
+    job_id = jobs.submit('batch', None, batch.run_batch, batch_id, params={'batch_id': batch_id})
+    return jsonify({'batch_id': batch_id, 'job_id': job_id, 'status': 'queued',
+                    'status_url': f'/api/batches/{batch_id}'}), 202
+
 # --- PHASE 8 ENDPOINTS ---
 
 @app.route('/api/cases/<int:case_id>/report', methods=['GET'])
 def get_case_report(case_id):
     try:
-        # Gather ALL data
-        case = db.get_case(case_id)
-        inputs = db.get_case_inputs(case_id)
-        patterns = db.get_case_patterns(case_id)
-        axis_states = db.get_axis_states(case_id)
-        tensions = db.get_case_tensions(case_id)
-        threshold = db.get_threshold_evaluation(case_id)
-        archetype = db.get_archetype_assignment(case_id)
-        
-        # Parse JSON fields
-        for t in tensions:
-            try: t['axes_involved'] = json.loads(t['axes_involved'])
-            except: t['axes_involved'] = []
-            
-        if archetype:
-            try: archetype['key_traits'] = json.loads(archetype['key_traits'])
-            except: archetype['key_traits'] = []
+        # Todo el caso en una sola transacción de lectura
+        bundle = db.get_case_bundle(case_id)
+        if not bundle:
+            return jsonify({'error': 'Caso no encontrado'}), 404
 
         report = {
-            "case_info": dict(case) if case else {},
+            "case_info": bundle['case'],
             "stats": {
-                "total_inputs": len(inputs),
-                "total_patterns": len(patterns),
-                "total_tensions": len(tensions)
+                "total_inputs": bundle['input_count'],
+                "total_patterns": len(bundle['patterns']),
+                "total_tensions": len(bundle['tensions'])
             },
-            "patterns": patterns,
-            "axes": axis_states,
-            "tensions": tensions,
-            "threshold": threshold,
-            "archetype": archetype,
+            "patterns": bundle['patterns'],
+            "axes": bundle['axis_states'],
+            "tensions": bundle['tensions'],
+            "threshold": bundle['threshold'],
+            "archetype": bundle['archetype'],
             "generated_at": datetime.now().isoformat()
         }
         
@@ -627,6 +402,44 @@ def get_case_report(case_id):
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/cases/<int:case_id>/bundle', methods=['GET'])
+def get_case_bundle_endpoint(case_id):
+    """Carga inicial de la vista de caso: todas las fases en una sola petición.
+
+    Los inputs llegan paginados; el resto se pide a /api/cases/<id>/inputs con inputs_next_cursor.
+    """
+    bundle = db.get_case_bundle(case_id, inputs_limit=db.PAGE_SIZE)
+    if not bundle:
+        return jsonify({'error': 'Caso no encontrado'}), 404
+    return jsonify(bundle)
+
+# Búsqueda de texto en todos los casos
+@app.route('/api/search', methods=['GET'])
+def search_endpoint():
+    """?q=texto&types=input,pattern,axis_assignment,axis_state&case_id=&limit= (20 por defecto, máx. 100)."""
+    args = request.args
+    kinds = [k for k in args.get('types', '').split(',') if k]
+    try:
+        return jsonify(search.search(args.get('q', ''), kinds, args.get('case_id', type=int), args.get('limit')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+# Casos parecidos a uno dado
+@app.route('/api/cases/<int:case_id>/similar', methods=['GET'])
+def similar_cases(case_id):
+    """?limit= (20 por defecto, máx. 100)."""
+    # NumPy solo se carga cuando alguien pide casos parecidos
+    import similarity
+    if not db.get_case(case_id):
+        return jsonify({'error': 'Caso no encontrado'}), 404
+    try:
+        result = similarity.similar(case_id, request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if result is None:
+        return jsonify({'error': 'El caso aún no tiene ejes, patrones, arquetipo ni umbral con los que compararlo'}), 400
+    return jsonify(result)
+
 # Legacy / Fase 2 (Placeholder para futuro)
 @app.route('/api/classify', methods=['POST'])
 def classify():
@@ -634,4 +447,8 @@ def classify():
     return jsonify({'message': 'Endpoint en migración a Fase 2'})
 
 if __name__ == '__main__':
+    import os
+    # Con debug, el recargador ejecuta este bloque dos veces: el guardián va en el proceso que sirve
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warmup.start()
     app.run(debug=True, port=5001)
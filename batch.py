@@ -0,0 +1,285 @@
+"""Análisis en lote de varios casos (pipeline de fases sobre un filtro de casos).
+
+Uso:
+    python batch.py run [--status S ...] [--since FECHA] [--until FECHA] [--case ID ...] [--mode local|cloud]
+    python batch.py resume BATCH_ID
+    python batch.py show BATCH_ID
+    python batch.py list
+
+Cada lote se guarda en la DB (batch_runs / batch_items) y cada caso se marca
+al terminar, así que un lote interrumpido se reanuda con ``resume`` sin
+repetir los casos ya hechos. Los casos se procesan en paralelo con un tope
+distinto por backend: Ollama atiende una petición a la vez, OpenAI admite
+varias. Los topes son del proceso, compartidos por todos los lotes en curso
+(p.ej. dos lotes lanzados desde la API).
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Antes de importar los módulos que leen su configuración del entorno (DB, modelos...)
+load_dotenv()
+
+import database as db
+import jobs
+import phases
+import pipeline
+import scheduler
+
+CONCURRENCY = {
+    'cloud': int(os.getenv('PHENOMA_BATCH_CLOUD_WORKERS', '4')),
+    'local': int(os.getenv('PHENOMA_BATCH_LOCAL_WORKERS', '1')),
+}
+_slots = {mode: threading.BoundedSemaphore(max(1, n)) for mode, n in CONCURRENCY.items()}
+
+# Estado de análisis de un caso, derivado de lo que hay guardado
+STATUSES = ('empty', 'new', 'pending', 'incomplete', 'complete')
+
+def case_status(row):
+    if not row['inputs']:
+        return 'empty'
+    if not row['has_patterns']:
+        return 'new'
+    if row['pending_inputs']:
+        return 'pending'
+    if not row['has_threshold']:
+        return 'incomplete'
+    return 'complete'
+
+def select_cases(statuses=None, since=None, until=None, case_ids=None):
+    """Casos que cumplen el filtro, con su estado. Los casos sin inputs nunca se incluyen."""
+    selected = []
+    for row in db.select_cases_for_batch(case_ids, since, until):
+        row['analysis_status'] = case_status(row)
+        if row['analysis_status'] == 'empty':
+            continue
+        if statuses and row['analysis_status'] not in statuses:
+            continue
+        selected.append(row)
+    return selected
+
+def create_batch(mode='local', statuses=None, since=None, until=None, case_ids=None, force=False, use_cache=True):
+    """Registra un lote con los casos del filtro y devuelve (batch_id, número de casos)."""
+    if mode not in CONCURRENCY:
+        raise phases.PhaseError(f'Modo desconocido: {mode}', 400)
+    unknown = [s for s in statuses or () if s not in STATUSES]
+    if unknown:
+        raise phases.PhaseError(f"Estado desconocido: {', '.join(unknown)}", 400)
+    cases = select_cases(statuses, since, until, case_ids)
+    params = {'statuses': list(statuses or ()), 'since': since, 'until': until,
+              'case_ids': list(case_ids or ()), 'force': force, 'cache': use_cache}
+    batch_id = uuid.uuid4().hex[:12]
+    db.create_batch_run(batch_id, mode, params, [c['id'] for c in cases])
+    return batch_id, len(cases)
+
+def process_case(case_id, mode='local', use_cache=True, force=False):
+    """Lleva un caso al día: pipeline completo, Fase 9 si hay inputs nuevos, o solo las etapas que faltan.
+
+    Devuelve (acción, resultado); la acción es None si no había nada que hacer.
+    """
+    if force:
+        return 'full', pipeline.run_pipeline(case_id, mode, use_cache=use_cache)
+    bundle = db.get_case_bundle(case_id)
+    if bundle is None:
+        raise phases.PhaseError('Caso no encontrado', 404)
+    if bundle['pending_inputs'] and bundle['patterns']:
+        result = pipeline.run_incremental(case_id, mode, use_cache)
+        if result['downstream'] or result['status'] != 'success':
+            return 'incremental', result
+        # Los patrones no cambiaron: sigue si al caso le faltaban etapas
+        bundle = db.get_case_bundle(case_id)
+    start = pipeline.resume_stage(bundle)
+    if start is None:
+        return None, None
+    action = 'full' if start == 'patterns' else f'from:{start}'
+    return action, pipeline.run_pipeline(case_id, mode, start=None if start == 'patterns' else start,
+                                         use_cache=use_cache)
+
+def _run_item(batch_id, case_id, mode, use_cache, force):
+    with _slots[mode], scheduler.context(priority='batch'):
+        db.start_batch_item(batch_id, case_id)
+        started = time.perf_counter()
+        try:
+            action, result = process_case(case_id, mode, use_cache, force)
+        except phases.PhaseError as e:
+            action, result, error = None, None, e.message
+        except Exception as e:
+            traceback.print_exc()
+            action, result, error = None, None, f'Error interno: {e}'
+        else:
+            error = _first_error(result) if result and result['status'] != 'success' else None
+        seconds = round(time.perf_counter() - started, 2)
+        status = 'error' if error else ('done' if action else 'skipped')
+        db.finish_batch_item(batch_id, case_id, status, action, seconds, result, error)
+        return {'case_id': case_id, 'status': status, 'action': action, 'seconds': seconds, 'error': error}
+
+def _first_error(result):
+    # El pipeline devuelve error por etapa; el de run_incremental va dentro de 'downstream'
+    stages = (result.get('downstream') or result).get('stages') or {}
+    return next((f"{name}: {r['error']}" for name, r in stages.items() if r.get('status') == 'error'),
+                'El pipeline terminó con errores')
+
+def run_batch(batch_id, workers=None, on_case=None):
+    """Procesa los casos pendientes del lote y devuelve el lote con sus casos.
+
+    Los casos que quedaron a medias o con error en una ejecución anterior se
+    vuelven a intentar; los terminados no se tocan.
+    """
+    run = db.get_batch_run(batch_id)
+    if run is None:
+        raise phases.PhaseError('Lote no encontrado', 404)
+    mode = run['mode']
+    params = run['params']
+    use_cache = params.get('cache', True)
+    force = params.get('force', False)
+
+    db.reset_batch_items(batch_id)
+    pending = db.get_pending_batch_cases(batch_id)
+    workers = max(1, min(workers or CONCURRENCY[mode], CONCURRENCY[mode]))
+    db.update_batch_run(batch_id, status='running', started_at=datetime.now().isoformat(), finished_at=None)
+
+    total = len(pending)
+    completed = failed = 0
+    jobs.report_progress(batch_id=batch_id, completed=0, failed=0, total=total)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='phenoma-batch') as pool:
+        in_flight = {pool.submit(_run_item, batch_id, case_id, mode, use_cache, force) for case_id in pending}
+        try:
+            while in_flight:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    outcome = future.result()
+                    completed += 1
+                    failed += outcome['status'] == 'error'
+                    if on_case:
+                        on_case(outcome, completed, total)
+                jobs.report_progress(batch_id=batch_id, completed=completed, failed=failed, total=total)
+        except BaseException:
+            # Los casos en curso terminan y se guardan; los que no empezaron quedan pendientes
+            for future in in_flight:
+                future.cancel()
+            db.update_batch_run(batch_id, status='interrupted', finished_at=datetime.now().isoformat())
+            raise
+    db.update_batch_run(batch_id, status='error' if failed else 'done', finished_at=datetime.now().isoformat())
+    return summarize(db.get_batch_run(batch_id))
+
+def summarize(run):
+    """Duración por caso (de más lenta a más rápida) y totales del lote."""
+    items = sorted(run['items'], key=lambda i: i['seconds'] or 0, reverse=True)
+    durations = [i['seconds'] for i in items if i['seconds'] is not None]
+    return {
+        'batch_id': run['id'],
+        'status': run['status'],
+        'mode': run['mode'],
+        'counts': run['counts'],
+        'total': run['total'],
+        'seconds': round(sum(durations), 2),
+        'cases': [{'case_id': i['case_id'], 'identifier': i['identifier'], 'status': i['status'],
+                   'action': i['action'], 'seconds': i['seconds'],
+                   'error': i['error']} for i in items],
+    }
+
+# --- CLI ---
+
+def _print_summary(summary):
+    print(f"\nLote {summary['batch_id']} ({summary['mode']}): {summary['status']}")
+    print(f"{'caso':>6}  {'identificador':<24} {'estado':<8} {'acción':<18} {'segundos':>9}")
+    for case in summary['cases']:
+        seconds = f"{case['seconds']:.1f}" if case['seconds'] is not None else '-'
+        print(f"{case['case_id']:>6}  {str(case['identifier'] or '')[:24]:<24} {case['status']:<8} "
+              f"{case['action'] or '-':<18} {seconds:>9}")
+        if case['error']:
+            print(f"        {case['error']}")
+    counts = ', '.join(f'{n} {status}' for status, n in sorted(summary['counts'].items()))
+    print(f"Total: {summary['total']} casos ({counts}), {summary['seconds']:.1f}s de análisis")
+
+def _print_progress(outcome, completed, total):
+    print(f"[{completed}/{total}] caso {outcome['case_id']}: {outcome['status']}"
+          f"{' (' + outcome['action'] + ')' if outcome['action'] else ''} en {outcome['seconds']:.1f}s"
+          f"{' — ' + outcome['error'] if outcome['error'] else ''}", file=sys.stderr)
+
+def _execute(batch_id, workers):
+    try:
+        summary = run_batch(batch_id, workers, on_case=_print_progress)
+    except KeyboardInterrupt:
+        print(f"\nInterrumpido. Para continuar: python batch.py resume {batch_id}", file=sys.stderr)
+        return 130
+    _print_summary(summary)
+    return 1 if summary['status'] == 'error' else 0
+
+def cmd_run(args):
+    if args.mode == 'cloud' and not os.getenv('OPENAI_API_KEY'):
+        print("Error: OPENAI_API_KEY no encontrada en variables de entorno.")
+        return 1
+    batch_id, total = create_batch(args.mode, args.status, args.since, args.until, args.case,
+                                   args.force, not args.no_cache)
+    print(f"Lote {batch_id}: {total} casos ({args.mode}, hasta {args.workers or CONCURRENCY[args.mode]} en paralelo)",
+          file=sys.stderr)
+    if args.dry_run:
+        for case in db.get_batch_run(batch_id)['items']:
+            print(f"  {case['case_id']:>6}  {case['identifier']}")
+        return 0
+    return _execute(batch_id, args.workers)
+
+def cmd_resume(args):
+    run = db.get_batch_run(args.batch_id)
+    if run is None:
+        print(f"Error: lote no encontrado: {args.batch_id}")
+        return 1
+    return _execute(args.batch_id, args.workers)
+
+def cmd_show(args):
+    run = db.get_batch_run(args.batch_id)
+    if run is None:
+        print(f"Error: lote no encontrado: {args.batch_id}")
+        return 1
+    _print_summary(summarize(run))
+    return 0
+
+def cmd_list(args):
+    for run in db.list_batch_runs(args.limit):
+        print(f"{run['id']}  {run['created_at'][:19]}  {run['mode']:<5}  {run['status']:<11}  {run['done']}/{run['total']}")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Análisis en lote de casos")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_run = sub.add_parser('run', help="Crea un lote con los casos del filtro y lo ejecuta")
+    p_run.add_argument('--status', action='append', choices=[s for s in STATUSES if s != 'empty'],
+                       help="Estado de análisis (repetible): new, pending, incomplete, complete")
+    p_run.add_argument('--since', help="Casos creados desde esta fecha (YYYY-MM-DD)")
+    p_run.add_argument('--until', help="Casos creados hasta esta fecha (YYYY-MM-DD)")
+    p_run.add_argument('--case', type=int, action='append', help="Id de caso (repetible)")
+    p_run.add_argument('--mode', choices=list(CONCURRENCY), default='local')
+    p_run.add_argument('--workers', type=int, help="Casos en paralelo (como mucho el tope del backend)")
+    p_run.add_argument('--force', action='store_true', help="Rehacer el pipeline completo aunque el caso esté al día")
+    p_run.add_argument('--no-cache', action='store_true', help="Ignorar la caché de respuestas y llamar siempre al modelo")
+    p_run.add_argument('--dry-run', action='store_true', help="Solo registrar el lote y listar sus casos")
+    p_run.set_defaults(func=cmd_run)
+
+    p_resume = sub.add_parser('resume', help="Continúa un lote interrumpido (reintenta los casos con error)")
+    p_resume.add_argument('batch_id')
+    p_resume.add_argument('--workers', type=int)
+    p_resume.set_defaults(func=cmd_resume)
+
+    p_show = sub.add_parser('show', help="Duración y estado por caso de un lote")
+    p_show.add_argument('batch_id')
+    p_show.set_defaults(func=cmd_show)
+
+    p_list = sub.add_parser('list', help="Lotes recientes")
+    p_list.add_argument('--limit', type=int, default=20)
+    p_list.set_defaults(func=cmd_list)
+
+    args = parser.parse_args(argv)
+    db.init_db()
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,515 @@
+"""Benchmarks de la herramienta (base de datos y arranque).
+
+Uso:
+    python bench.py db [--requests N]
+    python bench.py concurrency [--seconds S] [--readers N]
+    python bench.py importtime [--target app|classifier|all] [--runs N]
+    python bench.py ratelimit [--workers N] [--requests N] [--server-rps N]
+    python bench.py search [--rows N] [--runs N]
+
+Cada benchmark trabaja sobre una base de datos temporal (PHENOMA_DB),
+nunca sobre phenoma.db; el de ratelimit usa además un servidor OpenAI falso
+local, sin red ni clave real.
+"""
+import os
+import re
+import sys
+import time
+import sqlite3
+import json
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+
+def _use_temp_db():
+    tmpdir = tempfile.mkdtemp(prefix='phenoma_bench_')
+    os.environ['PHENOMA_DB'] = os.path.join(tmpdir, 'bench.db')
+    os.environ['PHENOMA_WARMUP'] = '0'  # sin precarga de Ollama en los procesos de medida
+    return os.environ['PHENOMA_DB']
+
+def _seed_case(db, n_inputs=50, n_patterns=20):
+    case_id = db.create_case('BENCH', 'Caso sintético para benchmarks')
+    for i in range(n_inputs):
+        db.add_input(case_id, f'Frase de prueba número {i}', 'frase', {'date': '2026-01-01'})
+    for i in range(n_patterns):
+        db.add_pattern(case_id, f'Patrón {i}', 'Media', 'Alta', 'Baja', 'Ninguna')
+    for axis in ['Generación', 'Modelo de masculinidad']:
+        db.save_axis_state(case_id, axis, 'Definido', 'Valor', 'Justificación')
+    db.save_tension(case_id, 'Tensión', 'Desacople', ['Generación'], 'Media')
+    db.save_threshold_evaluation(case_id, 70, 'Umbral alcanzado', 'Razonamiento')
+    db.save_archetype_assignment(case_id, 'Arquetipo', 'Descripción', 80, ['rasgo'])
+    return case_id
+
+def _legacy_report(db_path, case_id):
+    """Reproduce el acceso previo: abrir, consultar y cerrar una conexión por DAO."""
+    queries = [
+        ('SELECT * FROM cases WHERE id = ?', False),
+        ('SELECT * FROM inputs WHERE case_id = ? ORDER BY created_at DESC', True),
+        ('SELECT * FROM patterns WHERE case_id = ?', True),
+        ('SELECT * FROM axis_states WHERE case_id = ?', True),
+        ('SELECT * FROM tensions WHERE case_id = ?', True),
+        ('SELECT * FROM threshold_evaluations WHERE case_id = ?', False),
+        ('SELECT * FROM archetype_assignments WHERE case_id = ?', False),
+    ]
+    opened = 0
+    for sql, many in queries:
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        opened += 1
+        cur = conn.execute(sql, (case_id,))
+        rows = cur.fetchall() if many else cur.fetchone()
+        [dict(r) for r in rows] if many else (dict(rows) if rows else None)
+        conn.close()
+    return opened
+
+def bench_db(args):
+    db_path = _use_temp_db()
+    import database as db
+    from app import app
+
+    case_id = _seed_case(db)
+    client = app.test_client()
+
+    # Antes: una conexión por llamada DAO
+    start = time.perf_counter()
+    legacy_opened = 0
+    for _ in range(args.requests):
+        legacy_opened += _legacy_report(db_path, case_id)
+    legacy_ms = (time.perf_counter() - start) * 1000 / args.requests
+
+    # Después: /report completo (Flask incluido) sobre la conexión persistente del hilo
+    before = db.get_connection_stats()['connections_opened']
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        res = client.get(f'/api/cases/{case_id}/report')
+        assert res.status_code == 200, res.data
+    pooled_ms = (time.perf_counter() - start) * 1000 / args.requests
+    pooled_opened = db.get_connection_stats()['connections_opened'] - before
+
+    print(f"Peticiones /report: {args.requests}")
+    print(f"  Antes   (abrir/cerrar por DAO): {legacy_opened / args.requests:.1f} conexiones/petición, {legacy_ms:.3f} ms/petición (solo SQL)")
+    print(f"  Después (conexión por hilo):    {pooled_opened / args.requests:.1f} conexiones/petición, {pooled_ms:.3f} ms/petición (Flask + SQL)")
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def _run_contention(db, seconds, n_readers):
+    import threading
+    case_id = _seed_case(db, n_inputs=10, n_patterns=5)
+    stop = threading.Event()
+    read_latencies = []
+    counters = {'writes': 0, 'read_errors': 0, 'write_errors': 0}
+    lock = threading.Lock()
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            try:
+                db.save_axis_state(case_id, 'Generación', 'Definido', f'Valor {i}', 'Justificación ' * 50)
+                with lock:
+                    counters['writes'] += 1
+            except sqlite3.OperationalError:
+                with lock:
+                    counters['write_errors'] += 1
+            i += 1
+        db.close_db_connection()
+
+    def reader():
+        local = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                db.get_axis_states(case_id)
+                db.get_all_cases()
+                local.append((time.perf_counter() - start) * 1000)
+            except sqlite3.OperationalError:
+                with lock:
+                    counters['read_errors'] += 1
+        with lock:
+            read_latencies.extend(local)
+        db.close_db_connection()
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(n_readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return read_latencies, counters
+
+def bench_concurrency(args):
+    """Lectores (dashboard) frente a un escritor continuo de save_axis_state (DELETE+INSERT)."""
+    _use_temp_db()
+    import database as db
+
+    scenarios = [
+        ('Rollback journal (anterior)', {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 5000}),
+        ('WAL + perfil interactive', dict(db.PRAGMA_PROFILES['interactive'])),
+    ]
+    for label, pragmas in scenarios:
+        db.close_db_connection()
+        db.DB_NAME = os.path.join(tempfile.mkdtemp(prefix='phenoma_bench_'), 'bench.db')
+        db.configure('interactive')
+        db.configure(**pragmas)
+        db.init_db()
+        latencies, counters = _run_contention(db, args.seconds, args.readers)
+        print(f"{label}:")
+        print(f"  lecturas: {len(latencies)}  p50={_percentile(latencies, 50):.2f} ms  "
+              f"p99={_percentile(latencies, 99):.2f} ms  max={max(latencies or [0]):.2f} ms  errores={counters['read_errors']}")
+        print(f"  escrituras: {counters['writes']}  errores={counters['write_errors']}")
+
+# --- Arranque (python -X importtime) ---
+
+IMPORT_TARGETS = {'app': 'import app', 'classifier': 'import classifier'}
+# Paquetes que no deberían cargarse al arrancar: solo cuando se llama al proveedor
+HEAVY_MODULES = ('openai', 'ollama', 'httpx', 'pydantic', 'tiktoken', 'numpy')
+IMPORTTIME_RE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( +)(\S+)')
+
+def _run_python(args, env):
+    here = os.path.dirname(os.path.abspath(__file__))
+    res = subprocess.run([sys.executable] + args, capture_output=True, text=True, env=env, cwd=here)
+    if res.returncode != 0:
+        raise RuntimeError(res.stderr[-2000:])
+    return res
+
+def _importtime(statement, env):
+    """Devuelve [(self_us, cumulative_us, profundidad, módulo)] de ``python -X importtime``."""
+    rows = []
+    for line in _run_python(['-X', 'importtime', '-c', statement], env).stderr.splitlines():
+        m = IMPORTTIME_RE.match(line)
+        if m:
+            rows.append((int(m.group(1)), int(m.group(2)), (len(m.group(3)) - 1) // 2, m.group(4)))
+    return rows
+
+def _wall_ms(statement, env, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        _run_python(['-c', statement], env)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+def bench_importtime(args):
+    """Coste de importar app (arranque de un worker) y classifier (arranque del CLI)."""
+    env = dict(os.environ, PHENOMA_DB=_use_temp_db())
+    targets = list(IMPORT_TARGETS) if args.target == 'all' else [args.target]
+    baseline = _wall_ms('pass', env, args.runs)
+    print(f"Intérprete vacío: {baseline:.0f} ms (mediana de {args.runs})")
+    for target in targets:
+        statement = IMPORT_TARGETS[target]
+        _run_python(['-c', statement], env)  # primera vez: crea el esquema de la DB temporal
+        rows = _importtime(statement, env)
+        total_ms = sum(cum for _, cum, depth, _ in rows if depth == 0) / 1000
+        wall = _wall_ms(statement, env, args.runs)
+        loaded = sorted({name.split('.')[0] for *_, name in rows} & set(HEAVY_MODULES))
+        print(f"\n{statement}:")
+        print(f"  importtime total: {total_ms:.1f} ms   arranque: {wall:.0f} ms (+{wall - baseline:.0f} ms sobre el intérprete)")
+        print(f"  SDKs cargados: {', '.join(loaded) if loaded else 'ninguno'}")
+        print("  Importaciones directas más costosas:")
+        top = sorted((r for r in rows if r[2] == 1), key=lambda r: r[1], reverse=True)[:args.top]
+        for _, cum, _, name in top:
+            print(f"    {cum / 1000:8.1f} ms  {name}")
+
+# --- Límite de peticiones (servidor OpenAI falso que responde 429) ---
+
+def _fake_openai_server(rps, retry_after):
+    """Servidor local con la forma de /v1/chat/completions que admite ``rps`` peticiones por segundo.
+
+    Por encima devuelve 429 con Retry-After, como OpenAI al superar el límite de la cuenta.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    state = {'ok': 0, 'throttled': 0, 'window': 0, 'count': 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            with lock:
+                window = int(time.time())
+                if window != state['window']:
+                    state['window'], state['count'] = window, 0
+                state['count'] += 1
+                allowed = state['count'] <= rps
+                state['ok' if allowed else 'throttled'] += 1
+            if allowed:
+                body = {'id': 'chatcmpl-bench', 'object': 'chat.completion', 'created': int(time.time()), 'model': 'gpt-4o',
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': '{"ok": true}'}}],
+                        'usage': {'prompt_tokens': 20, 'completion_tokens': 5, 'total_tokens': 25}}
+                status, headers = 200, {}
+            else:
+                body = {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}}
+                status, headers = 429, {'Retry-After': str(retry_after)}
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, lock
+
+RATELIMIT_WORKER = '''
+import json, sys, time
+import database as db, llm
+db.init_db()
+ok = failed = 0
+start = time.perf_counter()
+for i in range({requests}):
+    try:
+        llm.complete('bench', 'Petición ' + str(i), 'cloud', use_cache=False)
+        ok += 1
+    except llm.LLMError as e:
+        failed += 1
+print(json.dumps({{'ok': ok, 'failed': failed, 'seconds': time.perf_counter() - start,
+                  'rate_limit': llm.metrics()['rate_limit']}}))
+'''
+
+def bench_ratelimit(args):
+    """Varios procesos (como workers de gunicorn) contra un servidor que limita a --server-rps."""
+    server, state, lock = _fake_openai_server(args.server_rps, args.retry_after)
+    base_env = dict(os.environ, OPENAI_API_KEY='bench', OPENAI_BASE_URL=f'http://127.0.0.1:{server.server_port}/v1',
+                    PHENOMA_LLM_CACHE='0', PHENOMA_CLOUD_RETRIES='8', PHENOMA_BACKOFF_BASE='0.2')
+    scenarios = [
+        ('Solo reintentos (sin límite compartido)', {'PHENOMA_OPENAI_RPM': '0', 'PHENOMA_OPENAI_TPM': '0'}),
+        (f'Límite compartido a {args.server_rps * 60} RPM', {'PHENOMA_OPENAI_RPM': str(args.server_rps * 60),
+                                                             'PHENOMA_OPENAI_TPM': '0'}),
+    ]
+    statement = RATELIMIT_WORKER.format(requests=args.requests)
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        for label, overrides in scenarios:
+            env = dict(base_env, PHENOMA_DB=_use_temp_db(), **overrides)
+            _run_python(['-c', 'import database; database.init_db()'], env)
+            with lock:
+                state.update(ok=0, throttled=0)
+            start = time.perf_counter()
+            procs = [subprocess.Popen([sys.executable, '-c', statement], env=env, cwd=here,
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                     for _ in range(args.workers)]
+            results = []
+            for proc in procs:
+                out, err = proc.communicate()
+                if proc.returncode != 0:
+                    raise RuntimeError(err[-2000:])
+                results.append(json.loads(out.strip().splitlines()[-1]))
+            elapsed = time.perf_counter() - start
+            total = args.workers * args.requests
+            print(f"{label}: {args.workers} procesos x {args.requests} peticiones")
+            print(f"  servidor: {state['ok']} atendidas, {state['throttled']} respuestas 429")
+            print(f"  clientes: {sum(r['ok'] for r in results)}/{total} correctas, {sum(r['failed'] for r in results)} fallidas, "
+                  f"{sum(r['rate_limit']['retries'] for r in results)} reintentos, "
+                  f"{sum(r['rate_limit']['waited_seconds'] for r in results):.1f}s esperando fichas")
+            print(f"  duración: {elapsed:.1f}s ({total / elapsed:.1f} peticiones/s)")
+    finally:
+        server.shutdown()
+
+# --- Búsqueda de texto (FTS5) ---
+
+SEARCH_WORDS = ('trabajo familia padre hijo pareja amigos fútbol dinero casa cuidado miedo orgullo silencio '
+                'llorar fuerza respeto vergüenza emoción proveedor autoridad violencia ternura compañero calle '
+                'barrio escuela jefe hermano madre control celos deporte cerveza noche bronca tristeza éxito').split()
+# Cola larga de términos poco frecuentes (nombres, lugares...) para las búsquedas selectivas
+SEARCH_TAIL = 20000
+SEARCH_QUERIES = ('trabajo', 'ternura', 'trabajo familia', '"padre hijo"', 'vergüenza silencio llorar', 'prov*',
+                  'termino123', 'termino123 ternura', 'inexistente')
+
+def _seed_search(db, rows, batch=20000):
+    import random
+    rng = random.Random(7)
+    # Frecuencias tipo Zipf: unas pocas palabras aparecen en casi todos los textos
+    weights = [1 / (rank + 1) for rank in range(len(SEARCH_WORDS))]
+    cases = [db.create_case(f'Caso {n}', '') for n in range(max(1, rows // 1000))]
+    with db.use_profile('bulk'):
+        for start in range(0, rows, batch):
+            chunk = [(cases[i % len(cases)],
+                      ' '.join(rng.choices(SEARCH_WORDS, weights, k=rng.randint(8, 40))
+                               + [f'termino{rng.randrange(SEARCH_TAIL)}' for _ in range(rng.randint(1, 4))]), 'frase')
+                     for i in range(start, min(rows, start + batch))]
+            with db.transaction() as conn:
+                conn.executemany("INSERT INTO inputs (case_id, content, input_type, metadata, created_at) "
+                                 "VALUES (?, ?, ?, '{}', datetime('now'))", chunk)
+
+def bench_search(args):
+    """Latencia de /api/search sobre un corpus sintético de --rows inputs."""
+    _use_temp_db()
+    import database as db
+    import search
+    db.init_db()
+    start = time.perf_counter()
+    # La mejor coincidencia bm25 de la palabra más frecuente es la fila más antigua: tiene que
+    # salir primera aunque coincidan casi todas las demás. Un texto que solo contiene la
+    # palabra, más veces de las que cabe en los textos sintéticos (44 palabras como mucho),
+    # puntúa más que cualquiera de ellos
+    best = db.add_input(db.create_case('Mejor coincidencia', ''), ' '.join([SEARCH_WORDS[0]] * 50), 'frase')
+    _seed_search(db, args.rows)
+    db.get_db_connection().execute("INSERT INTO inputs_fts (inputs_fts) VALUES ('optimize')")
+    print(f"Corpus: {args.rows} inputs indexados en {time.perf_counter() - start:.1f}s")
+    for text in SEARCH_QUERIES:
+        latencies = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            result = search.search(text)
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(f"  {text!r:30} {len(result['hits']):3} resultados  "
+              f"p50={_percentile(latencies, 50):.1f} ms  p95={_percentile(latencies, 95):.1f} ms")
+    first = search.search(SEARCH_WORDS[0])['hits'][0]
+    ok = (first['kind'], first['id']) == ('input', best)
+    outcome = 'sale primera' if ok else f"no sale primera (sale {first['kind']} {first['id']})"
+    print(f"{'ok' if ok else 'FALLO'}: la mejor coincidencia bm25 de {SEARCH_WORDS[0]!r} {outcome}")
+    return 0 if ok else 1
+
+# --- Casos parecidos ---
+
+SIMILAR_AXES = {
+    'Generación': ['Boomer', 'Generación X', 'Millennial', 'Centennial'],
+    'Relación con el cambio feminista': ['Aliado', 'Ambivalente', 'Reactivo', 'Indiferente'],
+    'Modelo de masculinidad': ['Tradicional', 'En transición', 'Igualitario', 'Híbrido'],
+    'Apertura a diversidad sexual y familiar': ['Abierta', 'Tolerante', 'Cerrada'],
+    'Manejo emocional y cuidado de sí': ['Expresivo', 'Contenido', 'Reprimido', 'Busca ayuda'],
+    'Presión social / falta de referentes': ['Alta', 'Media', 'Baja'],
+}
+SIMILAR_ARCHETYPES = ('El proveedor', 'El padre presente', 'El deconstruido', 'El guardián', 'El rebelde')
+
+def _seed_similar(db, cases, patterns_per_case=8, batch=2000):
+    import random
+    import embeddings
+    rng = random.Random(11)
+    with db.use_profile('bulk'):
+        for start in range(0, cases, batch):
+            ids = [db.create_case(f'Caso {n}', '') for n in range(start, min(cases, start + batch))]
+            descriptions = [' '.join(rng.sample(SEARCH_WORDS, 6)) for _ in range(len(ids) * patterns_per_case)]
+            vectors = [embeddings.to_blob(v) for v in embeddings.embed(descriptions)]
+            with db.transaction() as conn:
+                conn.executemany("INSERT INTO axis_states (case_id, axis_name, status, value, justification) "
+                                 "VALUES (?, ?, ?, ?, '')",
+                                 [(case_id, axis, rng.choice(['Definido', 'Definido', 'Tensión', 'No definido']),
+                                   rng.choice(values)) for case_id in ids for axis, values in SIMILAR_AXES.items()])
+                for n, (description, vector) in enumerate(zip(descriptions, vectors)):
+                    case_id = ids[n // patterns_per_case]
+                    pattern_id = conn.execute("INSERT INTO patterns (case_id, description) VALUES (?, ?)",
+                                              (case_id, description)).lastrowid
+                    conn.execute("INSERT INTO pattern_embeddings (pattern_id, case_id, model, vector) VALUES (?, ?, ?, ?)",
+                                 (pattern_id, case_id, embeddings.MODEL, vector))
+                conn.executemany("INSERT INTO threshold_evaluations (case_id, score, status, reasoning) VALUES (?, ?, '', '')",
+                                 [(case_id, rng.randint(0, 100)) for case_id in ids])
+                conn.executemany("INSERT INTO archetype_assignments (case_id, archetype_name, fit_score) VALUES (?, ?, ?)",
+                                 [(case_id, rng.choice(SIMILAR_ARCHETYPES), rng.randint(40, 100)) for case_id in ids])
+
+def bench_similar(args):
+    """Construcción del índice de casos parecidos y latencia de /api/cases/<id>/similar con --cases casos."""
+    _use_temp_db()
+    import random
+    import database as db
+    import similarity
+    db.init_db()
+    start = time.perf_counter()
+    _seed_similar(db, args.cases)
+    print(f"Datos: {args.cases} casos con ejes, patrones, umbral y arquetipo en {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    similarity._index.refresh()
+    print(f"Índice: {similarity._index.size} casos x {similarity.DIM} dimensiones "
+          f"({similarity._index.matrix.nbytes / 2**20:.0f} MiB) construido en {time.perf_counter() - start:.2f}s")
+    rng = random.Random(3)
+    for label, write in (('sin cambios', False), ('tras modificar un caso', True)):
+        latencies = []
+        for _ in range(args.runs):
+            case_id = rng.randint(1, args.cases)
+            if write:
+                db.save_threshold_evaluation(rng.randint(1, args.cases), rng.randint(0, 100), '', '')
+            start = time.perf_counter()
+            similarity.similar(case_id, 20)
+            latencies.append((time.perf_counter() - start) * 1000)
+        print(f"  {label:24} p50={_percentile(latencies, 50):.1f} ms  p95={_percentile(latencies, 95):.1f} ms")
+
+# --- Fusión de patrones casi duplicados ---
+
+# (patrón guardado, patrón nuevo, ¿es el mismo?)
+DEDUP_PAIRS = (
+    ('Evita mostrar emociones frente a otros hombres', 'Evita mostrar sus emociones delante de otros hombres', True),
+    ('Evita mostrar emociones frente a otros hombres', 'No evita mostrar emociones frente a otros hombres', False),
+    ('Se siente responsable de proveer económicamente a la familia',
+     'No se siente responsable de proveer económicamente a la familia', False),
+    ('Busca ayuda profesional cuando está mal', 'Nunca busca ayuda profesional cuando está mal', False),
+    ('Evita mostrar emociones frente a otros hombres', 'Evita hablar de dinero con otros hombres', False),
+)
+
+def bench_dedup(args):
+    """Guarda cada par de DEDUP_PAIRS con _merge_patterns y comprueba si se fusiona o no."""
+    _use_temp_db()
+    import database as db
+    import embeddings
+    import phases
+    db.init_db()
+    failures = 0
+    for saved, new, same in DEDUP_PAIRS:
+        case_id = db.create_case('DEDUP', '')
+        phases._merge_patterns(case_id, [{'description': saved}])
+        created, updated = phases._merge_patterns(case_id, [{'description': new}])
+        merged = not created
+        vectors = embeddings.embed([saved, new])
+        ok = merged == same
+        failures += not ok
+        print(f"  {'ok   ' if ok else 'FALLO'} {float(vectors[0] @ vectors[1]):.3f} "
+              f"{'fusionado' if merged else 'separado':9}  {saved!r} / {new!r}")
+    print(f"{len(DEDUP_PAIRS) - failures}/{len(DEDUP_PAIRS)} pares como se esperaba "
+          f"(umbral {embeddings.DEDUP_THRESHOLD})")
+    return 1 if failures else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de Phenoma")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_db = sub.add_parser('db', help="Conexiones y latencia por petición /report")
+    p_db.add_argument('--requests', type=int, default=200)
+    p_db.set_defaults(func=bench_db)
+
+    p_conc = sub.add_parser('concurrency', help="Latencia de lectores con un escritor concurrente")
+    p_conc.add_argument('--seconds', type=float, default=3.0)
+    p_conc.add_argument('--readers', type=int, default=4)
+    p_conc.set_defaults(func=bench_concurrency)
+
+    p_imp = sub.add_parser('importtime', help="Tiempo de arranque de un worker (import app) y del CLI")
+    p_imp.add_argument('--target', choices=list(IMPORT_TARGETS) + ['all'], default='all')
+    p_imp.add_argument('--runs', type=int, default=5)
+    p_imp.add_argument('--top', type=int, default=10)
+    p_imp.set_defaults(func=bench_importtime)
+
+    p_rate = sub.add_parser('ratelimit', help="Límite compartido y reintentos frente a un servidor que devuelve 429")
+    p_rate.add_argument('--workers', type=int, default=4)
+    p_rate.add_argument('--requests', type=int, default=15)
+    p_rate.add_argument('--server-rps', type=int, default=5)
+    p_rate.add_argument('--retry-after', type=int, default=1)
+    p_rate.set_defaults(func=bench_ratelimit)
+
+    p_search = sub.add_parser('search', help="Latencia de la búsqueda de texto completo")
+    p_search.add_argument('--rows', type=int, default=200000)
+    p_search.add_argument('--runs', type=int, default=20)
+    p_search.set_defaults(func=bench_search)
+
+    p_similar = sub.add_parser('similar', help="Índice y latencia de la búsqueda de casos parecidos")
+    p_similar.add_argument('--cases', type=int, default=20000)
+    p_similar.add_argument('--runs', type=int, default=50)
+    p_similar.set_defaults(func=bench_similar)
+
+    p_dedup = sub.add_parser('dedup', help="Comprueba qué pares de patrones se fusionan como duplicados")
+    p_dedup.set_defaults(func=bench_dedup)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
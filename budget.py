@@ -0,0 +1,136 @@
+"""Presupuesto de tokens de los prompts.
+
+El servidor de Ollama corre con un contexto de 4096 tokens (OLLAMA_CONTEXT_LENGTH)
+y recorta en silencio lo que no cabe, así que los prompts grandes se reparten en
+bloques que sí caben, o se recortan empezando por el contenido de menos valor,
+dejando sitio para la respuesta. En modo nube se cuenta con tiktoken si está
+instalado; si no (y siempre en local, cuyo tokenizador no conocemos) la
+estimación es conservadora: pocos caracteres por token, porque los textos
+están en español.
+"""
+import os
+import threading
+
+CHARS_PER_TOKEN = 3
+LOCAL_CONTEXT_TOKENS = int(os.getenv('PHENOMA_LOCAL_CONTEXT', '4096'))
+CLOUD_CONTEXT_TOKENS = int(os.getenv('PHENOMA_CLOUD_CONTEXT', '128000'))
+RESPONSE_TOKENS = int(os.getenv('PHENOMA_RESPONSE_TOKENS', '1024'))
+# Tope por llamada aunque el contexto sea mayor: mantiene acotada la latencia de cada bloque
+MAX_CHUNK_TOKENS = int(os.getenv('PHENOMA_CHUNK_TOKENS', '6000'))
+
+CLOUD_ENCODING = os.getenv('PHENOMA_CLOUD_ENCODING', 'o200k_base')
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def _cloud_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(CLOUD_ENCODING)
+            except Exception:
+                # tiktoken es opcional (y la primera vez descarga el vocabulario)
+                _encoding = False
+    return _encoding or None
+
+def estimate_tokens(text, mode=None):
+    if not text:
+        return 0
+    encoding = _cloud_encoding() if mode == 'cloud' else None
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def context_tokens(mode):
+    return CLOUD_CONTEXT_TOKENS if mode == 'cloud' else LOCAL_CONTEXT_TOKENS
+
+def prompt_budget(mode):
+    """Tokens disponibles para el prompt completo (contexto menos la respuesta)."""
+    return context_tokens(mode) - RESPONSE_TOKENS
+
+def prompt_limit(mode):
+    """Tamaño máximo de un prompt antes de repartirlo en bloques."""
+    return min(prompt_budget(mode), MAX_CHUNK_TOKENS)
+
+def chunk_budget(mode, template_tokens):
+    """Tokens disponibles para el contenido variable de un bloque."""
+    budget = prompt_limit(mode) - template_tokens
+    if budget <= 0:
+        raise ValueError(f'La plantilla ({template_tokens} tokens) no cabe en el contexto de {context_tokens(mode)} tokens')
+    return budget
+
+def truncate_to_tokens(text, max_tokens):
+    limit = max(0, max_tokens - 1) * CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[:max(0, limit - 1)] + '…'
+
+def split_by_budget(lines, max_tokens, mode=None):
+    """Reparte las líneas, en orden, en bloques de como mucho ``max_tokens``.
+
+    Una línea que por sí sola supera el presupuesto se recorta.
+    """
+    chunks, current, used = [], [], 0
+    for line in lines:
+        cost = estimate_tokens(line, mode) + 1  # salto de línea
+        if cost > max_tokens:
+            line = truncate_to_tokens(line, max_tokens - 1)
+            cost = estimate_tokens(line, mode) + 1
+        if current and used + cost > max_tokens:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(line)
+        used += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+class Item:
+    """Línea de un prompt con su valor (lo de menor valor se recorta antes) y,
+    opcionalmente, una versión abreviada que se usa antes de eliminarla."""
+    __slots__ = ('text', 'value', 'short')
+
+    def __init__(self, text, value=0, short=None):
+        self.text = text
+        self.value = value
+        self.short = short
+
+def fit(sections, max_tokens, mode=None):
+    """Compone las secciones ``[(título, [Item, ...]), ...]`` sin pasar de ``max_tokens``.
+
+    Si no caben, primero se abrevian y después se eliminan los elementos de
+    menor valor (a igualdad de valor, los últimos). Devuelve (texto, recortes).
+    """
+    entries = [item for _, items in sections for item in items]
+    costs = [estimate_tokens(item.text, mode) + 1 for item in entries]
+    overhead = sum(estimate_tokens(title, mode) + 2 for title, _ in sections if title)
+    total = overhead + sum(costs)
+    trimmed = 0
+    order = sorted(range(len(entries)), key=lambda i: (entries[i].value, -i))
+
+    if total > max_tokens:
+        for i in order:
+            item = entries[i]
+            if item.short is not None and item.short != item.text:
+                item.text = item.short
+                new_cost = estimate_tokens(item.text, mode) + 1
+                total += new_cost - costs[i]
+                costs[i] = new_cost
+                trimmed += 1
+                if total <= max_tokens:
+                    break
+    dropped = set()
+    if total > max_tokens:
+        for i in order:
+            dropped.add(i)
+            total -= costs[i]
+            trimmed += 1
+            if total <= max_tokens:
+                break
+
+    blocks, index = [], 0
+    for title, items in sections:
+        lines = [item.text for n, item in enumerate(items, start=index) if n not in dropped]
+        index += len(items)
+        blocks.append('\n'.join(([title] if title else []) + (lines or ['(ninguno)'])))
+    return '\n\n'.join(blocks), trimmed
@@ -1,13 +1,21 @@
 import os
 import sys
+import glob
+import json
+import time
 import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
 from dotenv import load_dotenv
-from openai import OpenAI
-import ollama
 
-# Cargar variables de entorno
+# Cargar variables de entorno (antes de llm, que lee su configuración al importarse)
 load_dotenv()
 
+import database as db
+import llm
+import scheduler
+
 def load_model_definition(path):
     try:
         with open(path, 'r', encoding='utf-8') as f:
@@ -16,13 +24,7 @@ def load_model_definition(path):
         print(f"Error: No se encontró el archivo de definición del modelo en {path}")
         sys.exit(1)
 
-def classify_stimulus_openai(stimulus_text, model_definition):
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    
-    if not client.api_key:
-        print("Error: OPENAI_API_KEY no encontrada en variables de entorno.")
-        return None
-
+def _openai_messages(stimulus_text, model_definition):
     system_prompt = f"""
 Eres un experto analista de comportamiento y sociología.
 Tu tarea es clasificar el siguiente estímulo basándote ESTRICTAMENTE en la definición del modelo provista.
@@ -38,23 +40,13 @@ Instrucciones adicionales:
 """
     user_prompt = f"ESTÍMULO A ANALIZAR:\n{stimulus_text}"
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.2
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Error al llamar a la API de OpenAI: {e}"
-
-def classify_stimulus_local(stimulus_text, model_definition, model_name="llama3"):
-    print(f"Usando modelo local: {model_name} (vía Ollama)...")
-    
-    prompt = f"""
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def _local_prompt(stimulus_text, model_definition):
+    return f"""
 [INST]
 Eres un experto analista. Clasifica el siguiente estímulo basándote ESTRICTAMENTE en la definición del modelo provista.
 
@@ -74,22 +66,225 @@ FORMATO DE SALIDA REQUERIDO:
 Responde SOLO con la clasificación.
 [/INST]
 """
+
+def classify(stimulus_text, model_definition, local=False, model_name="llama3", use_cache=True):
+    """Clasifica un estímulo y devuelve el texto del modelo; lanza llm.LLMError si falla."""
+    if local:
+        return llm.complete('classify', _local_prompt(stimulus_text, model_definition), 'local',
+                            {'local_role': 'user', 'local_json': False}, model=model_name, use_cache=use_cache)
+    return llm.complete('classify', _openai_messages(stimulus_text, model_definition), 'cloud',
+                        {'json': False, 'temperature': 0.2}, use_cache=use_cache)
+
+def classify_stimulus_openai(stimulus_text, model_definition, use_cache=True):
+    if not os.getenv("OPENAI_API_KEY"):
+        print("Error: OPENAI_API_KEY no encontrada en variables de entorno.")
+        return None
+    try:
+        return classify(stimulus_text, model_definition, use_cache=use_cache)
+    except llm.LLMError as e:
+        return e.message
+
+def classify_stimulus_local(stimulus_text, model_definition, model_name="llama3", use_cache=True):
+    print(f"Usando modelo local: {model_name} (vía Ollama)...")
+    try:
+        return classify(stimulus_text, model_definition, True, model_name, use_cache)
+    except llm.LLMError as e:
+        return f"{e.message}\n¿Tienes Ollama instalado y corriendo? (https://ollama.com)"
+
+# --- Modo batch ---
+# Los estímulos se leen de forma perezosa (un directorio, un glob o un JSONL) y
+# cada resultado se añade al JSONL de salida en cuanto termina, así que una
+# ejecución interrumpida se reanuda saltando los ids que ya están bien.
+
+TEXT_EXTENSIONS = ('.txt', '.md')
+
+def iter_stimuli(source, id_field='id', text_field='text', read_text=True):
+    """Genera (id, texto) de cada estímulo de ``source``.
+
+    Con ``read_text=False`` el texto es None: no se abren los archivos de un
+    directorio o glob ni se repiten los avisos del JSONL (sirve para contar).
+    """
+    if os.path.isdir(source):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(source)
+                       for name in names if name.lower().endswith(TEXT_EXTENSIONS))
+        base = source
+    elif source.lower().endswith(('.jsonl', '.ndjson')):
+        with open(source, 'r', encoding='utf-8') as f:
+            for lineno, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    if read_text:
+                        print(f"Aviso: línea {lineno} ignorada (JSON inválido: {e.msg})", file=sys.stderr)
+                    continue
+                if isinstance(record, str):
+                    record = {text_field: record}
+                text = record.get(text_field) if isinstance(record, dict) else None
+                if not text:
+                    if read_text:
+                        print(f"Aviso: línea {lineno} ignorada (sin campo '{text_field}')", file=sys.stderr)
+                    continue
+                yield str(record.get(id_field, f'line-{lineno}')), text if read_text else None
+        return
+    else:
+        paths = sorted(glob.glob(source, recursive=True)) if glob.has_magic(source) else [source]
+        base = os.path.commonpath(paths) if len(paths) > 1 else os.path.dirname(source)
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        if not read_text:
+            yield os.path.relpath(path, base or '.'), None
+            continue
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            yield os.path.relpath(path, base or '.'), f.read()
+
+def load_done_ids(output_path):
+    """Ids ya clasificados sin error en un JSONL de salida anterior."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # última línea a medio escribir si se interrumpió
+            if isinstance(record, dict) and record.get('error') is None and 'id' in record:
+                done.add(str(record['id']))
+    return done
+
+def _format_eta(seconds):
+    if seconds is None:
+        return '?'
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m" if seconds >= 3600 else f"{seconds // 60}m{seconds % 60:02d}s"
+
+def run_batch(source, output_path, model_def, local=False, model_name='llama3', workers=4, use_cache=True,
+              id_field='id', text_field='text', limit=None, progress_every=2.0):
+    """Clasifica todos los estímulos pendientes de ``source`` y devuelve (ok, errores)."""
+    done = load_done_ids(output_path)
+    # Una pasada solo por los ids para el total del ETA; los textos se leen a medida que se encolan
+    total = sum(1 for sid, _ in iter_stimuli(source, id_field, text_field, read_text=False) if sid not in done)
+    if limit:
+        total = min(total, limit)
+    pending = ((sid, text) for sid, text in iter_stimuli(source, id_field, text_field) if sid not in done)
+    items = itertools.islice(pending, limit or None)
+    mode = 'local' if local else 'cloud'
+    # Ollama atiende una petición a la vez: en local la cola se procesa en serie
+    workers = 1 if local else max(1, workers)
+    print(f"{len(done)} ya clasificados, {total} pendientes ({mode}, {workers} en paralelo)", file=sys.stderr)
+
+    def work(item):
+        sid, text = item
+        start = time.perf_counter()
+        try:
+            # En local, el lote cede el turno de Ollama a quien esté usando la aplicación
+            with scheduler.context(priority='batch'):
+                result, error = classify(text, model_def, local, model_name, use_cache), None
+        except llm.LLMError as e:
+            result, error = None, e.message
+        return {'id': sid, 'result': result, 'error': error, 'mode': mode,
+                'model': model_name if local else llm.CLOUD_MODEL,
+                'seconds': round(time.perf_counter() - start, 3), 'classified_at': datetime.now().isoformat()}
+
+    ok = failed = 0
+    started = last_report = time.perf_counter()
+    with open(output_path, 'a+', encoding='utf-8') as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        # Si la ejecución anterior se cortó a mitad de línea, se empieza en una línea nueva
+        if out.tell() > 0:
+            out.seek(out.tell() - 1)
+            if out.read(1) != '\n':
+                out.write('\n')
+        # Ventana acotada de trabajos en vuelo: no se encolan decenas de miles de futuros de golpe
+        in_flight = set()
+        try:
+            while True:
+                while len(in_flight) < workers * 2:
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    in_flight.add(pool.submit(work, item))
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record = future.result()
+                    out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    if record['error'] is None:
+                        ok += 1
+                    else:
+                        failed += 1
+                        print(f"Error en {record['id']}: {record['error']}", file=sys.stderr)
+                out.flush()
+
+                now = time.perf_counter()
+                if now - last_report >= progress_every or not in_flight:
+                    last_report = now
+                    processed = ok + failed
+                    rate = processed / (now - started) if now > started else 0
+                    eta = (total - processed) / rate if rate else None
+                    print(f"[{processed}/{total}] {rate:.2f} estímulos/s, ETA {_format_eta(eta)}"
+                          f"{f', {failed} errores' if failed else ''}", file=sys.stderr)
+        except KeyboardInterrupt:
+            for future in in_flight:
+                future.cancel()
+            print(f"\nInterrumpido: {ok + failed}/{total} procesados. Vuelve a ejecutar el mismo comando para continuar.",
+                  file=sys.stderr)
+            raise
+    elapsed = time.perf_counter() - started
+    print(f"Terminado: {ok} clasificados, {failed} errores en {elapsed:.1f}s", file=sys.stderr)
+    return ok, failed
+
+def _resolve_model_path(path):
+    if not os.path.isabs(path) and not os.path.exists(path):
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        path = os.path.join(script_dir, path)
+    return path
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog='classifier.py batch',
+                                     description="Clasifica en lote un directorio, un glob o un JSONL de estímulos")
+    parser.add_argument('source', help="Directorio (archivos .txt/.md), patrón glob o archivo .jsonl")
+    parser.add_argument('-o', '--output', default='classifications.jsonl', help="JSONL de resultados (se reanuda si existe)")
+    parser.add_argument('--model', default='model_definition.md', help="Ruta al archivo de definición del modelo")
+    parser.add_argument('--local', action='store_true', help="Usar modelo local (Ollama) en lugar de OpenAI")
+    parser.add_argument('--local-model-name', default='llama3', help="Nombre del modelo local a usar (default: llama3)")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('PHENOMA_BATCH_WORKERS', '4')),
+                        help="Llamadas simultáneas a OpenAI (en local siempre 1)")
+    parser.add_argument('--id-field', default='id', help="Campo de id en el JSONL de entrada (default: id)")
+    parser.add_argument('--text-field', default='text', help="Campo de texto en el JSONL de entrada (default: text)")
+    parser.add_argument('--limit', type=int, help="Procesar como mucho N estímulos pendientes")
+    parser.add_argument('--no-cache', action='store_true', help="Ignorar la caché de respuestas y llamar siempre al modelo")
+    args = parser.parse_args(argv)
+
+    if not args.local and not os.getenv("OPENAI_API_KEY"):
+        print("Error: OPENAI_API_KEY no encontrada en variables de entorno.")
+        return 1
+    model_def = load_model_definition(_resolve_model_path(args.model))
+    db.init_db()  # la caché de respuestas vive en la DB
     try:
-        response = ollama.chat(model=model_name, messages=[
-            {'role': 'user', 'content': prompt},
-        ])
-        return response['message']['content']
-    except Exception as e:
-        return f"Error al llamar a Ollama: {e}\n¿Tienes Ollama instalado y corriendo? (https://ollama.com)"
-
-def main():
-    parser = argparse.ArgumentParser(description="Clasificador de Masculinidades Provokers")
+        _, failed = run_batch(args.source, args.output, model_def, args.local, args.local_model_name, args.workers,
+                              not args.no_cache, args.id_field, args.text_field, args.limit)
+    except KeyboardInterrupt:
+        return 130
+    return 1 if failed else 0
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == 'batch':
+        return batch_main(argv[1:])
+
+    parser = argparse.ArgumentParser(description="Clasificador de Masculinidades Provokers",
+                                     epilog="Para clasificar en lote: classifier.py batch --help")
     parser.add_argument('input', help="Texto a analizar o ruta a un archivo de texto")
     parser.add_argument('--model', default='model_definition.md', help="Ruta al archivo de definición del modelo")
     parser.add_argument('--local', action='store_true', help="Usar modelo local (Ollama) en lugar de OpenAI")
     parser.add_argument('--local-model-name', default='llama3', help="Nombre del modelo local a usar (default: llama3)")
+    parser.add_argument('--no-cache', action='store_true', help="Ignorar la caché de respuestas y llamar siempre al modelo")
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Determinar si el input es un archivo o texto directo
     if os.path.isfile(args.input):
@@ -99,22 +294,18 @@ def main():
         stimulus = args.input
 
     # Cargar definición
-    model_path = args.model
-    if not os.path.isabs(model_path) and not os.path.exists(model_path):
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        model_path = os.path.join(script_dir, args.model)
-    
-    model_def = load_model_definition(model_path)
+    model_def = load_model_definition(_resolve_model_path(args.model))
+    db.init_db()  # la caché de respuestas vive en la DB
 
     print("Analizando estímulo...")
     
     if args.local:
-        result = classify_stimulus_local(stimulus, model_def, args.local_model_name)
+        result = classify_stimulus_local(stimulus, model_def, args.local_model_name, use_cache=not args.no_cache)
     else:
-        result = classify_stimulus_openai(stimulus, model_def)
+        result = classify_stimulus_openai(stimulus, model_def, use_cache=not args.no_cache)
     
     print("\nRESULTADO DE LA CLASIFICACIÓN:\n")
     print(result)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
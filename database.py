@@ -1,18 +1,421 @@
 import sqlite3
 import json
-from datetime import datetime
+import base64
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
 
-DB_NAME = 'phenoma.db'
+DB_NAME = os.getenv('PHENOMA_DB', 'phenoma.db')
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+# --- Gestor de Conexiones ---
+# Una conexión persistente por hilo (y por proceso: gunicorn hace fork de los
+# workers y una conexión SQLite no debe cruzar un fork). Las escrituras se
+# agrupan con transaction(), que admite anidamiento mediante SAVEPOINTs.
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {'connections_opened': 0, 'transactions': 0}
+
+# --- Perfiles de PRAGMAs ---
+# WAL permite que los lectores (p.ej. el dashboard consultando /api/cases) no
+# esperen a los escritores. journal_mode es persistente en el fichero; el resto
+# se aplica a cada conexión nueva. Tamaños: cache_size negativo = KiB.
+PRAGMA_PROFILES = {
+    'interactive': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -16000,
+        'mmap_size': 128 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    'bulk': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 30000,
+        'cache_size': -128000,
+        'mmap_size': 512 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 10000,
+    },
+}
+
+DB_PROFILE = os.getenv('PHENOMA_DB_PROFILE', 'interactive')
+_pragmas = dict(PRAGMA_PROFILES.get(DB_PROFILE, PRAGMA_PROFILES['interactive']))
+
+def _apply_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+
+def configure(profile=None, **overrides):
+    """Selecciona el perfil de PRAGMAs para las conexiones nuevas.
+
+    Se llama al arrancar la aplicación; ``overrides`` permite ajustar valores
+    sueltos (p.ej. ``configure('interactive', busy_timeout=10000)``). La
+    conexión del hilo actual, si existe, se reconfigura en el acto.
+    """
+    global _pragmas
+    if profile is not None:
+        if profile not in PRAGMA_PROFILES:
+            raise ValueError(f"Perfil de base de datos desconocido: {profile}")
+        _pragmas = dict(PRAGMA_PROFILES[profile])
+    _pragmas.update(overrides)
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        _apply_pragmas(conn, _pragmas)
+    return dict(_pragmas)
+
+@contextmanager
+def use_profile(profile):
+    """Aplica temporalmente un perfil a la conexión del hilo (p.ej. 'bulk' para ingestas)."""
+    conn = get_db_connection()
+    pragmas = {k: v for k, v in PRAGMA_PROFILES[profile].items() if k != 'journal_mode'}
+    # Se restaura lo que había, también los PRAGMAs que el perfil activo no fija
+    previous = {name: conn.execute(f'PRAGMA {name}').fetchone()[0] for name in pragmas}
+    _apply_pragmas(conn, pragmas)
+    try:
+        yield conn
+    finally:
+        _apply_pragmas(conn, previous)
+
+def _open_connection():
+    # isolation_level=None: somos nosotros quienes abrimos y cerramos las transacciones
+    conn = sqlite3.connect(DB_NAME, isolation_level=None, timeout=_pragmas.get('busy_timeout', 5000) / 1000)
     conn.row_factory = sqlite3.Row
+    _apply_pragmas(conn, _pragmas)
+    with _stats_lock:
+        _stats['connections_opened'] += 1
     return conn
 
-def init_db():
+def get_db_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = _open_connection()
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.depth = 0
+    return conn
+
+def close_db_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+    _local.depth = 0
+
+@contextmanager
+def transaction(write=True):
+    """Abre una transacción (o un SAVEPOINT si ya hay una abierta).
+
+    Hace COMMIT al salir del bloque y ROLLBACK si se lanza una excepción.
+    Con ``write=False`` la transacción es diferida: sirve para leer varias
+    tablas sobre una misma instantánea sin tomar el bloqueo de escritura.
+    """
     conn = get_db_connection()
-    c = conn.cursor()
-    
+    depth = _local.depth
+    if depth == 0:
+        conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+        with _stats_lock:
+            _stats['transactions'] += 1
+    else:
+        conn.execute(f'SAVEPOINT sp_{depth}')
+    _local.depth = depth + 1
+    try:
+        yield conn
+    except BaseException:
+        _local.depth = depth
+        if depth == 0:
+            conn.execute('ROLLBACK')
+        else:
+            conn.execute(f'ROLLBACK TO sp_{depth}')
+            conn.execute(f'RELEASE sp_{depth}')
+        raise
+    _local.depth = depth
+    if depth == 0:
+        conn.execute('COMMIT')
+    else:
+        conn.execute(f'RELEASE sp_{depth}')
+
+def get_connection_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+def init_app(app):
+    """Integra el gestor con el contexto de aplicación de Flask.
+
+    La conexión del hilo sobrevive entre peticiones; al cerrar el contexto
+    se deshace cualquier transacción que una excepción haya dejado abierta.
+    """
+    @app.teardown_appcontext
+    def _end_request_transaction(exc):
+        conn = getattr(_local, 'conn', None)
+        if conn is None or _local.pid != os.getpid():
+            return
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        _local.depth = 0
+
+def init_db():
+    """Crea o actualiza el esquema. No se ejecuta al importar el módulo: lo
+    llaman app.py al arrancar, los CLI y check_env.py. Con el esquema al día
+    solo cuesta leer PRAGMA user_version."""
+    if get_schema_version() == len(MIGRATIONS):
+        return len(MIGRATIONS)
+    return migrate()
+
+# --- Migraciones de Esquema ---
+# Versionadas con PRAGMA user_version. Cada migración sube la versión en uno
+# y se aplica en su propia transacción. Las migraciones publicadas no se editan:
+# los cambios de esquema nuevos se añaden al final de MIGRATIONS.
+
+def _migration_1_base_schema(conn):
+    # Las bases de datos anteriores al sistema de migraciones ya tienen estas
+    # tablas y user_version = 0; CREATE TABLE IF NOT EXISTS las deja intactas.
+    _create_tables(conn.cursor())
+
+def _migration_2_case_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cases_created ON cases (created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_inputs_case_created ON inputs (case_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_patterns_case ON patterns (case_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_axis_assignments_case_axis ON axis_assignments (case_id, axis_name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_axis_states_case_axis ON axis_states (case_id, axis_name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tensions_case ON tensions (case_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_threshold_case_created ON threshold_evaluations (case_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_archetype_case_created ON archetype_assignments (case_id, created_at)')
+
+def _migration_3_jobs(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            case_id INTEGER,
+            status TEXT NOT NULL,
+            params TEXT,
+            progress TEXT,
+            result TEXT,
+            error TEXT,
+            error_status INTEGER,
+            created_at TEXT,
+            started_at TEXT,
+            finished_at TEXT
+        )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_case_created ON jobs (case_id, created_at)')
+
+def _migration_4_llm_cache(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            provider TEXT NOT NULL,
+            model TEXT NOT NULL,
+            temperature REAL,
+            prompt_hash TEXT NOT NULL,
+            phase TEXT,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            hits INTEGER DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)')
+
+def _migration_5_analysis_runs(conn):
+    # Marca de agua de inputs: el mayor id de input analizado en cada pasada de patrones
+    conn.execute('''CREATE TABLE IF NOT EXISTS analysis_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            case_id INTEGER NOT NULL,
+            phase TEXT NOT NULL,
+            input_watermark INTEGER NOT NULL,
+            new_inputs INTEGER DEFAULT 0,
+            patterns_created INTEGER DEFAULT 0,
+            patterns_updated INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (case_id) REFERENCES cases (id)
+        )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_analysis_runs_case ON analysis_runs (case_id, input_watermark)')
+
+def _migration_6_batches(conn):
+    # Lotes de casos: una fila por lote y otra por caso (checkpoint para reanudar)
+    conn.execute('''CREATE TABLE IF NOT EXISTS batch_runs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            params TEXT,
+            total INTEGER DEFAULT 0,
+            created_at TEXT,
+            started_at TEXT,
+            finished_at TEXT
+        )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS batch_items (
+            batch_id TEXT NOT NULL,
+            case_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            action TEXT,
+            seconds REAL,
+            result TEXT,
+            error TEXT,
+            started_at TEXT,
+            finished_at TEXT,
+            PRIMARY KEY (batch_id, case_id)
+        )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_batch_items_status ON batch_items (batch_id, status)')
+
+def _migration_7_rate_buckets(conn):
+    # Cubos de fichas del límite de peticiones a OpenAI, compartidos entre procesos
+    conn.execute('''CREATE TABLE IF NOT EXISTS rate_buckets (
+            name TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            blocked_until REAL NOT NULL DEFAULT 0
+        )''')
+
+def _migration_8_local_queue(conn):
+    # Turnos de la cola de llamadas a Ollama (scheduler.py), compartida entre procesos
+    conn.execute('''CREATE TABLE IF NOT EXISTS local_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            priority INTEGER NOT NULL,
+            phase TEXT,
+            job_id TEXT,
+            pid INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            enqueued_at REAL NOT NULL,
+            deadline REAL,
+            heartbeat REAL,
+            started_at REAL,
+            finished_at REAL,
+            seconds REAL,
+            position INTEGER,
+            eta REAL
+        )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_local_queue_status ON local_queue (status, priority, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_local_queue_job ON local_queue (job_id)')
+
+def _migration_9_case_listing(conn):
+    # Paginación por (created_at, id) con filtros. idx_cases_created e
+    # idx_inputs_case_created ya sirven para el orden: en SQLite cada entrada de
+    # índice termina en el rowid, que aquí es el id.
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cases_status_created ON cases (status, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cases_identifier ON cases (identifier COLLATE NOCASE)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_inputs_case_type_created ON inputs (case_id, input_type, created_at)')
+
+    # cases.status pasa a guardar el estado de análisis (el mismo que usa batch.py)
+    # para poder filtrar por él con índice. create_case lo inicia en 'empty' y
+    # los triggers lo actualizan con cada input, patrón, análisis o umbral
+    status = '''CASE
+        WHEN NOT EXISTS (SELECT 1 FROM inputs i WHERE i.case_id = {id}) THEN 'empty'
+        WHEN NOT EXISTS (SELECT 1 FROM patterns p WHERE p.case_id = {id}) THEN 'new'
+        WHEN EXISTS (SELECT 1 FROM inputs i WHERE i.case_id = {id} AND i.id >
+            (SELECT COALESCE(MAX(r.input_watermark), 0) FROM analysis_runs r WHERE r.case_id = {id})) THEN 'pending'
+        WHEN NOT EXISTS (SELECT 1 FROM threshold_evaluations t WHERE t.case_id = {id}) THEN 'incomplete'
+        ELSE 'complete' END'''
+    conn.execute(f"UPDATE cases SET status = {status.format(id='cases.id')}")
+    # Un input recién insertado siempre queda por encima de la marca de agua:
+    # el caso pasa a 'new' o 'pending' sin recorrer sus inputs (cargas masivas)
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS trg_cases_status_input AFTER INSERT ON inputs
+                    BEGIN UPDATE cases SET status = CASE WHEN EXISTS (SELECT 1 FROM patterns p WHERE p.case_id = NEW.case_id)
+                        THEN 'pending' ELSE 'new' END WHERE id = NEW.case_id; END""")
+    for table in ('patterns', 'analysis_runs', 'threshold_evaluations'):
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_cases_status_{table} AFTER INSERT ON {table}
+                         BEGIN UPDATE cases SET status = {status.format(id='NEW.case_id')} WHERE id = NEW.case_id; END""")
+
+def _migration_10_search(conn):
+    # Índices de texto completo (FTS5) con contenido externo: el texto vive solo
+    # en la tabla original y el índice se mantiene con triggers. unicode61 con
+    # remove_diacritics 2 hace que "situacion" encuentre "situación".
+    for table, column in (('inputs', 'content'), ('patterns', 'description'),
+                          ('axis_assignments', 'justification'), ('axis_states', 'justification')):
+        fts = f'{table}_fts'
+        conn.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({column}, content='{table}',
+                         content_rowid='id', tokenize='unicode61 remove_diacritics 2')""")
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {table}
+                         BEGIN INSERT INTO {fts} (rowid, {column}) VALUES (NEW.id, NEW.{column}); END""")
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {table}
+                         BEGIN INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', OLD.id, OLD.{column}); END""")
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {column} ON {table}
+                         BEGIN
+                             INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', OLD.id, OLD.{column});
+                             INSERT INTO {fts} (rowid, {column}) VALUES (NEW.id, NEW.{column});
+                         END""")
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+def _migration_11_pattern_embeddings(conn):
+    # Vector float16 de la descripción de cada patrón (embeddings.py). Un cambio
+    # de descripción o el borrado del patrón invalidan el vector.
+    conn.execute('''CREATE TABLE IF NOT EXISTS pattern_embeddings (
+            pattern_id INTEGER PRIMARY KEY,
+            case_id INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            vector BLOB NOT NULL
+        )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_pattern_embeddings_case ON pattern_embeddings (case_id)')
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS trg_pattern_embeddings_update AFTER UPDATE OF description ON patterns
+                    BEGIN DELETE FROM pattern_embeddings WHERE pattern_id = NEW.id; END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS trg_pattern_embeddings_delete AFTER DELETE ON patterns
+                    BEGIN DELETE FROM pattern_embeddings WHERE pattern_id = OLD.id; END""")
+
+def _migration_12_case_feature_changes(conn):
+    # Última revisión en la que cambió lo que describe a cada caso para la
+    # búsqueda de casos parecidos (ejes, patrones, umbral, arquetipo). Cada proceso
+    # mantiene su índice en memoria y solo recalcula los casos con revisión
+    # posterior a la que ya tiene.
+    conn.execute('''CREATE TABLE IF NOT EXISTS case_feature_changes (
+            case_id INTEGER PRIMARY KEY,
+            revision INTEGER NOT NULL
+        )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_case_feature_changes_revision ON case_feature_changes (revision)')
+    bump = """INSERT OR REPLACE INTO case_feature_changes (case_id, revision)
+              VALUES ({id}, (SELECT COALESCE(MAX(revision), 0) + 1 FROM case_feature_changes))"""
+    for table in ('axis_states', 'patterns', 'pattern_embeddings', 'threshold_evaluations', 'archetype_assignments'):
+        for event, row in (('INSERT', 'NEW'), ('DELETE', 'OLD')):
+            conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_features_{event.lower()} AFTER {event} ON {table}
+                             BEGIN {bump.format(id=f'{row}.case_id')}; END""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_cases_features_delete AFTER DELETE ON cases
+                     BEGIN {bump.format(id='OLD.id')}; END""")
+
+def _migration_13_job_heartbeat(conn):
+    # Proceso que ejecuta cada trabajo y último latido (epoch), para dar por
+    # interrumpidos los que se quedaron sin nadie que los termine
+    conn.execute('ALTER TABLE jobs ADD COLUMN pid INTEGER')
+    conn.execute('ALTER TABLE jobs ADD COLUMN heartbeat REAL')
+
+MIGRATIONS = [
+    _migration_1_base_schema,
+    _migration_2_case_indexes,
+    _migration_3_jobs,
+    _migration_4_llm_cache,
+    _migration_5_analysis_runs,
+    _migration_6_batches,
+    _migration_7_rate_buckets,
+    _migration_8_local_queue,
+    _migration_9_case_listing,
+    _migration_10_search,
+    _migration_11_pattern_embeddings,
+    _migration_12_case_feature_changes,
+    _migration_13_job_heartbeat,
+]
+
+def get_schema_version():
+    return get_db_connection().execute('PRAGMA user_version').fetchone()[0]
+
+def migrate():
+    """Aplica en orden las migraciones pendientes y devuelve la versión final.
+
+    Es seguro llamarla desde varios workers a la vez: la versión se vuelve a
+    comprobar dentro de la transacción de escritura antes de aplicar cada paso.
+    """
+    applied = False
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if get_schema_version() >= version:
+            continue
+        with transaction() as conn:
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= version:
+                continue
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            applied = True
+    if applied:
+        get_db_connection().execute('PRAGMA optimize')
+    return get_schema_version()
+
+def _create_tables(c):
     # 1. Crear Tablas Principales
     c.execute('''CREATE TABLE IF NOT EXISTS cases
                  (id INTEGER PRIMARY KEY AUTOINCREMENT, identifier TEXT, description TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, status TEXT)''')
@@ -69,93 +472,235 @@ def init_db():
             created_at TEXT
         )''')
 
-    conn.commit()
-    conn.close()
 
 # --- Funciones de Acceso a Datos (DAO) ---
 
 def create_case(identifier, description=""):
-    conn = get_db_connection()
-    c = conn.cursor()
     created_at = datetime.now().isoformat()
-    c.execute('INSERT INTO cases (identifier, description, created_at) VALUES (?, ?, ?)',
-              (identifier, description, created_at))
-    case_id = c.lastrowid
-    conn.commit()
-    conn.close()
-    return case_id
+    with transaction() as conn:
+        c = conn.execute("INSERT INTO cases (identifier, description, created_at, status) VALUES (?, ?, ?, 'empty')",
+                         (identifier, description, created_at))
+        return c.lastrowid
 
 def get_all_cases():
     conn = get_db_connection()
-    cases = conn.execute('SELECT * FROM cases ORDER BY created_at DESC').fetchall()
-    conn.close()
+    cases = conn.execute('SELECT * FROM cases ORDER BY created_at DESC, id DESC').fetchall()
     return [dict(ix) for ix in cases]
 
 def get_case(case_id):
     conn = get_db_connection()
     case = conn.execute('SELECT * FROM cases WHERE id = ?', (case_id,)).fetchone()
-    conn.close()
     return dict(case) if case else None
 
 def delete_case(case_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    tables = ['inputs', 'patterns', 'axis_assignments', 'axis_states', 'tensions', 'threshold_evaluations', 'archetype_assignments']
-    for table in tables:
-        try:
-            c.execute(f'DELETE FROM {table} WHERE case_id = ?', (case_id,))
-        except sqlite3.OperationalError:
-            pass # Table might not exist yet
-    c.execute('DELETE FROM cases WHERE id = ?', (case_id,))
-    conn.commit()
-    conn.close()
+    tables = ['inputs', 'patterns', 'axis_assignments', 'axis_states', 'tensions', 'threshold_evaluations', 'archetype_assignments', 'analysis_runs']
+    with transaction() as conn:
+        for table in tables:
+            try:
+                conn.execute(f'DELETE FROM {table} WHERE case_id = ?', (case_id,))
+            except sqlite3.OperationalError:
+                pass # Table might not exist yet
+        conn.execute('DELETE FROM cases WHERE id = ?', (case_id,))
     return True
 
 def add_input(case_id, content, input_type, metadata=None):
-    conn = get_db_connection()
-    c = conn.cursor()
     created_at = datetime.now().isoformat()
     meta_json = json.dumps(metadata) if metadata else "{}"
-    c.execute('INSERT INTO inputs (case_id, content, input_type, metadata, created_at) VALUES (?, ?, ?, ?, ?)',
-              (case_id, content, input_type, meta_json, created_at))
-    input_id = c.lastrowid
-    conn.commit()
-    conn.close()
-    return input_id
+    with transaction() as conn:
+        c = conn.execute('INSERT INTO inputs (case_id, content, input_type, metadata, created_at) VALUES (?, ?, ?, ?, ?)',
+                         (case_id, content, input_type, meta_json, created_at))
+        return c.lastrowid
+
+def add_inputs_bulk(case_id, inputs):
+    """Inserta un bloque de inputs ({content, input_type, metadata}) en una transacción."""
+    created_at = datetime.now().isoformat()
+    rows = [(case_id, i['content'], i['input_type'], json.dumps(i['metadata']) if i.get('metadata') else "{}", created_at)
+            for i in inputs]
+    with transaction() as conn:
+        conn.executemany('INSERT INTO inputs (case_id, content, input_type, metadata, created_at) VALUES (?, ?, ?, ?, ?)',
+                         rows)
+    return len(rows)
 
 def get_case_inputs(case_id):
     conn = get_db_connection()
-    inputs = conn.execute('SELECT * FROM inputs WHERE case_id = ? ORDER BY created_at DESC', (case_id,)).fetchall()
-    conn.close()
+    inputs = conn.execute('SELECT * FROM inputs WHERE case_id = ? ORDER BY created_at DESC, id DESC', (case_id,)).fetchall()
     return [dict(ix) for ix in inputs]
 
+# --- LISTADOS PAGINADOS ---
+# Paginación por clave (keyset) sobre (created_at, id): cada página continúa
+# donde terminó la anterior con un WHERE sobre el índice, sin OFFSET, así que
+# cuesta lo mismo la primera página que la milésima. El cursor es opaco para
+# el cliente: la clave de la última fila en base64.
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+CASE_STATUSES = ('empty', 'new', 'pending', 'incomplete', 'complete')
+
+def encode_cursor(row):
+    raw = json.dumps([row['created_at'], row['id']], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(created_at, str) or not isinstance(row_id, int):
+            raise ValueError
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError('Cursor no válido')
+    return created_at, row_id
+
+def page_size(limit):
+    if limit is None or limit == '':
+        return PAGE_SIZE
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError('limit debe ser un entero')
+    if limit < 1:
+        raise ValueError('limit debe ser mayor que 0')
+    return min(limit, MAX_PAGE_SIZE)
+
+def _date_bounds(since, until):
+    """Condiciones sobre created_at para un rango de fechas (YYYY-MM-DD, ambos días incluidos).
+
+    Se compara el texto tal cual para que SQLite use el índice; date(created_at) no podría.
+    """
+    where, args = [], []
+    try:
+        if since:
+            where.append('created_at >= ?')
+            args.append(date.fromisoformat(since).isoformat())
+        if until:
+            where.append('created_at < ?')
+            args.append((date.fromisoformat(until) + timedelta(days=1)).isoformat())
+    except ValueError:
+        raise ValueError('Las fechas deben tener el formato YYYY-MM-DD')
+    return where, args
+
+def _keyset_page(table, where, args, limit, cursor, order):
+    limit = page_size(limit)
+    if order not in ('asc', 'desc'):
+        raise ValueError("order debe ser 'asc' o 'desc'")
+    if cursor:
+        where.append(f"(created_at, id) {'<' if order == 'desc' else '>'} (?, ?)")
+        args.extend(decode_cursor(cursor))
+    sql = f'SELECT * FROM {table}'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += f' ORDER BY created_at {order.upper()}, id {order.upper()} LIMIT ?'
+    rows = get_db_connection().execute(sql, args + [limit + 1]).fetchall()
+    items = [dict(row) for row in rows[:limit]]
+    return {'items': items, 'next_cursor': encode_cursor(items[-1]) if len(rows) > limit else None}
+
+def list_cases_page(limit=None, cursor=None, status=None, identifier_prefix=None, since=None, until=None, order='desc'):
+    """Una página de casos y el cursor de la siguiente (None si es la última).
+
+    ``status`` admite uno o varios estados de análisis (ver CASE_STATUSES).
+    """
+    where, args = _date_bounds(since, until)
+    if status:
+        statuses = [status] if isinstance(status, str) else list(status)
+        unknown = [s for s in statuses if s not in CASE_STATUSES]
+        if unknown:
+            raise ValueError(f"Estado desconocido: {', '.join(unknown)}")
+        where.append(f"status IN ({', '.join('?' * len(statuses))})")
+        args.extend(statuses)
+    if identifier_prefix:
+        # LIKE sin distinguir mayúsculas usa idx_cases_identifier (COLLATE NOCASE)
+        escaped = identifier_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        where.append("identifier LIKE ? ESCAPE '\\'")
+        args.append(escaped + '%')
+    return _keyset_page('cases', where, args, limit, cursor, order)
+
+def list_inputs_page(case_id, limit=None, cursor=None, input_type=None, since=None, until=None, order='desc'):
+    """Una página de inputs del caso y el cursor de la siguiente (None si es la última)."""
+    where, args = _date_bounds(since, until)
+    where.insert(0, 'case_id = ?')
+    args.insert(0, case_id)
+    if input_type:
+        where.append('input_type = ?')
+        args.append(input_type)
+    return _keyset_page('inputs', where, args, limit, cursor, order)
+
 def add_pattern(case_id, description, recurrence, persistence, pressure_context, contradictions):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''INSERT INTO patterns 
-                 (case_id, description, recurrence, persistence, pressure_context, contradictions) 
-                 VALUES (?, ?, ?, ?, ?, ?)''',
-              (case_id, description, recurrence, persistence, pressure_context, contradictions))
-    pattern_id = c.lastrowid
-    conn.commit()
-    conn.close()
-    return pattern_id
+    with transaction() as conn:
+        c = conn.execute('''INSERT INTO patterns 
+                            (case_id, description, recurrence, persistence, pressure_context, contradictions) 
+                            VALUES (?, ?, ?, ?, ?, ?)''',
+                         (case_id, description, recurrence, persistence, pressure_context, contradictions))
+        return c.lastrowid
+
+def _save_embedding(conn, pattern_id, p):
+    if p.get('embedding') is not None:
+        conn.execute('''INSERT OR REPLACE INTO pattern_embeddings (pattern_id, case_id, model, vector)
+                        SELECT id, case_id, ?, ? FROM patterns WHERE id = ?''',
+                     (p['embedding_model'], p['embedding'], pattern_id))
+
+def add_patterns_bulk(case_id, patterns):
+    """Inserta todos los patrones de un análisis en una única transacción.
+
+    Si un patrón trae ``embedding`` (y ``embedding_model``) se guarda también su vector.
+    """
+    with transaction() as conn:
+        for p in patterns:
+            c = conn.execute('''INSERT INTO patterns
+                                (case_id, description, recurrence, persistence, pressure_context, contradictions)
+                                VALUES (?, ?, ?, ?, ?, ?)''',
+                             (case_id, p['description'], p['recurrence'], p['persistence'], p['pressure_context'],
+                              p['contradictions']))
+            _save_embedding(conn, c.lastrowid, p)
+    return len(patterns)
+
+def update_patterns_bulk(patterns):
+    """Actualiza en una transacción los patrones recibidos (dicts con ``id`` y, opcionalmente, ``embedding``)."""
+    rows = [(p['description'], p['recurrence'], p['persistence'], p['pressure_context'], p['contradictions'], p['id'])
+            for p in patterns]
+    with transaction() as conn:
+        conn.executemany('''UPDATE patterns SET description = ?, recurrence = ?, persistence = ?,
+                            pressure_context = ?, contradictions = ? WHERE id = ?''', rows)
+        # Después del UPDATE: el trigger borra el vector si la descripción cambió
+        for p in patterns:
+            _save_embedding(conn, p['id'], p)
+    return len(rows)
+
+def get_pattern_embeddings(case_id, model):
+    """{pattern_id: vector} de los patrones del caso con vector calculado por ``model``."""
+    rows = get_db_connection().execute('SELECT pattern_id, vector FROM pattern_embeddings WHERE case_id = ? AND model = ?',
+                                       (case_id, model)).fetchall()
+    return {row['pattern_id']: row['vector'] for row in rows}
+
+def save_pattern_embeddings(case_id, model, vectors):
+    """Guarda [(pattern_id, vector)] en una transacción."""
+    with transaction() as conn:
+        conn.executemany('INSERT OR REPLACE INTO pattern_embeddings (pattern_id, case_id, model, vector) VALUES (?, ?, ?, ?)',
+                         [(pattern_id, case_id, model, vector) for pattern_id, vector in vectors])
 
 def get_case_patterns(case_id):
     conn = get_db_connection()
     patterns = conn.execute('SELECT * FROM patterns WHERE case_id = ?', (case_id,)).fetchall()
-    conn.close()
     return [dict(ix) for ix in patterns]
 
 def save_axis_assignment(case_id, pattern_id, axis_name, justification):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''INSERT INTO axis_assignments (case_id, pattern_id, axis_name, justification)
-                 VALUES (?, ?, ?, ?)''', (case_id, pattern_id, axis_name, justification))
-    aid = c.lastrowid
-    conn.commit()
-    conn.close()
-    return aid
+    with transaction() as conn:
+        c = conn.execute('''INSERT INTO axis_assignments (case_id, pattern_id, axis_name, justification)
+                            VALUES (?, ?, ?, ?)''', (case_id, pattern_id, axis_name, justification))
+        return c.lastrowid
+
+def save_axis_assignments_bulk(case_id, assignments):
+    rows = [(case_id, a['pattern_id'], a['axis_name'], a.get('justification')) for a in assignments]
+    with transaction() as conn:
+        conn.executemany('''INSERT INTO axis_assignments (case_id, pattern_id, axis_name, justification)
+                            VALUES (?, ?, ?, ?)''', rows)
+    return len(rows)
+
+def replace_axis_assignments(case_id, assignments):
+    """Sustituye todas las vinculaciones del caso en una sola transacción."""
+    rows = [(case_id, a['pattern_id'], a['axis_name'], a.get('justification')) for a in assignments]
+    with transaction() as conn:
+        conn.execute('DELETE FROM axis_assignments WHERE case_id = ?', (case_id,))
+        conn.executemany('''INSERT INTO axis_assignments (case_id, pattern_id, axis_name, justification)
+                            VALUES (?, ?, ?, ?)''', rows)
+    return len(rows)
 
 def get_axis_assignments(case_id):
     conn = get_db_connection()
@@ -165,92 +710,461 @@ def get_axis_assignments(case_id):
         JOIN patterns p ON a.pattern_id = p.id
         WHERE a.case_id = ?
     ''', (case_id,)).fetchall()
-    conn.close()
     return [dict(ix) for ix in assigns]
 
 # --- PHASE 4: AXIS STATES ---
 
 def save_axis_state(case_id, axis_name, status, value, justification):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('DELETE FROM axis_states WHERE case_id = ? AND axis_name = ?', (case_id, axis_name))
-    c.execute('INSERT INTO axis_states (case_id, axis_name, status, value, justification) VALUES (?, ?, ?, ?, ?)',
-              (case_id, axis_name, status, value, justification))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('DELETE FROM axis_states WHERE case_id = ? AND axis_name = ?', (case_id, axis_name))
+        conn.execute('INSERT INTO axis_states (case_id, axis_name, status, value, justification) VALUES (?, ?, ?, ?, ?)',
+                     (case_id, axis_name, status, value, justification))
+
+def replace_axis_states(case_id, states):
+    """Sustituye el estado de cada eje recibido (DELETE+INSERT) de forma atómica."""
+    rows = [(case_id, s['axis_name'], s['status'], s['value'], s['justification']) for s in states]
+    with transaction() as conn:
+        conn.executemany('DELETE FROM axis_states WHERE case_id = ? AND axis_name = ?',
+                         [(case_id, r[1]) for r in rows])
+        conn.executemany('INSERT INTO axis_states (case_id, axis_name, status, value, justification) VALUES (?, ?, ?, ?, ?)',
+                         rows)
+    return len(rows)
 
 def get_axis_states(case_id):
     conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT * FROM axis_states WHERE case_id = ?', (case_id,))
-    rows = c.fetchall()
-    conn.close()
+    rows = conn.execute('SELECT * FROM axis_states WHERE case_id = ?', (case_id,)).fetchall()
     return [dict(row) for row in rows]
 
 # --- PHASE 5: TENSIONS ---
 
 def save_tension(case_id, description, tension_type, axes_involved, severity):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('INSERT INTO tensions (case_id, description, type, axes_involved, severity) VALUES (?, ?, ?, ?, ?)',
-              (case_id, description, tension_type, json.dumps(axes_involved), severity))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('INSERT INTO tensions (case_id, description, type, axes_involved, severity) VALUES (?, ?, ?, ?, ?)',
+                     (case_id, description, tension_type, json.dumps(axes_involved), severity))
+
+def replace_tensions(case_id, tensions):
+    """Borra las tensiones del caso e inserta las nuevas en la misma transacción."""
+    rows = [(case_id, t['description'], t['type'], json.dumps(t['axes_involved']), t['severity']) for t in tensions]
+    with transaction() as conn:
+        conn.execute('DELETE FROM tensions WHERE case_id = ?', (case_id,))
+        conn.executemany('INSERT INTO tensions (case_id, description, type, axes_involved, severity) VALUES (?, ?, ?, ?, ?)',
+                         rows)
+    return len(rows)
 
 def get_case_tensions(case_id):
     conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT * FROM tensions WHERE case_id = ?', (case_id,))
-    rows = c.fetchall()
-    conn.close()
+    rows = conn.execute('SELECT * FROM tensions WHERE case_id = ?', (case_id,)).fetchall()
     return [dict(row) for row in rows]
 
 def clear_case_tensions(case_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('DELETE FROM tensions WHERE case_id = ?', (case_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('DELETE FROM tensions WHERE case_id = ?', (case_id,))
 
 # --- PHASE 6: THRESHOLD EVALUATION ---
 
 def save_threshold_evaluation(case_id, score, status, reasoning):
-    conn = get_db_connection()
-    c = conn.cursor()
     created_at = datetime.now().isoformat()
-    c.execute('DELETE FROM threshold_evaluations WHERE case_id = ?', (case_id,))
-    c.execute('INSERT INTO threshold_evaluations (case_id, score, status, reasoning, created_at) VALUES (?, ?, ?, ?, ?)',
-              (case_id, score, status, reasoning, created_at))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('DELETE FROM threshold_evaluations WHERE case_id = ?', (case_id,))
+        conn.execute('INSERT INTO threshold_evaluations (case_id, score, status, reasoning, created_at) VALUES (?, ?, ?, ?, ?)',
+                     (case_id, score, status, reasoning, created_at))
 
 def get_threshold_evaluation(case_id):
     conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT * FROM threshold_evaluations WHERE case_id = ?', (case_id,))
-    row = c.fetchone()
-    conn.close()
+    row = conn.execute('SELECT * FROM threshold_evaluations WHERE case_id = ?', (case_id,)).fetchone()
     return dict(row) if row else None
 
 # --- PHASE 7: ARCHETYPE ASSIGNMENT ---
 
 def save_archetype_assignment(case_id, name, description, fit_score, key_traits):
-    conn = get_db_connection()
-    c = conn.cursor()
     created_at = datetime.now().isoformat()
-    c.execute('DELETE FROM archetype_assignments WHERE case_id = ?', (case_id,))
-    c.execute('INSERT INTO archetype_assignments (case_id, archetype_name, description, fit_score, key_traits, created_at) VALUES (?, ?, ?, ?, ?, ?)',
-              (case_id, name, description, fit_score, json.dumps(key_traits), created_at))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute('DELETE FROM archetype_assignments WHERE case_id = ?', (case_id,))
+        conn.execute('INSERT INTO archetype_assignments (case_id, archetype_name, description, fit_score, key_traits, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                     (case_id, name, description, fit_score, json.dumps(key_traits), created_at))
 
 def get_archetype_assignment(case_id):
     conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT * FROM archetype_assignments WHERE case_id = ?', (case_id,))
-    row = c.fetchone()
-    conn.close()
+    row = conn.execute('SELECT * FROM archetype_assignments WHERE case_id = ?', (case_id,)).fetchone()
     return dict(row) if row else None
 
-# Inicializar DB al importar si no existe
-init_db()
+# --- PHASE 8: CASE BUNDLE ---
+
+def _parse_json_list(value):
+    try:
+        parsed = json.loads(value) if value else []
+    except (TypeError, ValueError):
+        return []
+    return parsed if isinstance(parsed, list) else []
+
+def get_case_bundle(case_id, inputs_limit=None):
+    """Todo el caso (inputs, patrones, ejes, tensiones, umbral, arquetipo) en una sola lectura.
+
+    Las consultas comparten una transacción de lectura, así que el resultado es
+    una instantánea coherente aunque otra fase esté escribiendo. Los campos JSON
+    (axes_involved, key_traits) se devuelven ya decodificados. Con
+    ``inputs_limit`` solo incluye la primera página de inputs y el cursor de la
+    siguiente en ``inputs_next_cursor``.
+    """
+    with transaction(write=False) as conn:
+        case = conn.execute('SELECT * FROM cases WHERE id = ?', (case_id,)).fetchone()
+        if not case:
+            return None
+        if inputs_limit is None:
+            inputs = conn.execute('SELECT * FROM inputs WHERE case_id = ? ORDER BY created_at DESC, id DESC',
+                                  (case_id,)).fetchall()
+            inputs_page = {'items': [dict(i) for i in inputs], 'next_cursor': None}
+        else:
+            inputs_page = list_inputs_page(case_id, inputs_limit)
+        input_count = conn.execute('SELECT COUNT(*) FROM inputs WHERE case_id = ?', (case_id,)).fetchone()[0]
+        patterns = conn.execute('SELECT * FROM patterns WHERE case_id = ?', (case_id,)).fetchall()
+        assigns = conn.execute('''
+            SELECT a.*, p.description as pattern_description 
+            FROM axis_assignments a
+            JOIN patterns p ON a.pattern_id = p.id
+            WHERE a.case_id = ?
+        ''', (case_id,)).fetchall()
+        axis_states = conn.execute('SELECT * FROM axis_states WHERE case_id = ?', (case_id,)).fetchall()
+        tensions = conn.execute('SELECT * FROM tensions WHERE case_id = ?', (case_id,)).fetchall()
+        threshold = conn.execute('SELECT * FROM threshold_evaluations WHERE case_id = ?', (case_id,)).fetchone()
+        archetype = conn.execute('SELECT * FROM archetype_assignments WHERE case_id = ?', (case_id,)).fetchone()
+        pending_inputs = conn.execute('''SELECT COUNT(*) FROM inputs WHERE case_id = ? AND id >
+                                         (SELECT COALESCE(MAX(input_watermark), 0) FROM analysis_runs WHERE case_id = ?)''',
+                                      (case_id, case_id)).fetchone()[0]
+
+    tensions = [dict(t) for t in tensions]
+    for t in tensions:
+        t['axes_involved'] = _parse_json_list(t['axes_involved'])
+    archetype = dict(archetype) if archetype else None
+    if archetype:
+        archetype['key_traits'] = _parse_json_list(archetype['key_traits'])
+
+    return {
+        'case': dict(case),
+        'inputs': inputs_page['items'],
+        'inputs_next_cursor': inputs_page['next_cursor'],
+        'input_count': input_count,
+        'patterns': [dict(p) for p in patterns],
+        'axis_assignments': [dict(a) for a in assigns],
+        'axis_states': [dict(s) for s in axis_states],
+        'tensions': tensions,
+        'threshold': dict(threshold) if threshold else None,
+        'archetype': archetype,
+        'pending_inputs': pending_inputs,
+    }
+
+# --- TRABAJOS ASÍNCRONOS ---
+
+_JOB_FIELDS = {'status', 'progress', 'result', 'error', 'error_status', 'started_at', 'finished_at', 'heartbeat'}
+_JOB_JSON_FIELDS = ('params', 'progress', 'result')
+
+def create_job(job_id, kind, case_id, params=None, pid=None, heartbeat=None):
+    created_at = datetime.now().isoformat()
+    with transaction() as conn:
+        conn.execute('''INSERT INTO jobs (id, kind, case_id, status, params, created_at, pid, heartbeat)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                     (job_id, kind, case_id, 'queued', json.dumps(params or {}), created_at, pid, heartbeat))
+    return job_id
+
+def touch_jobs(job_ids, heartbeat):
+    if not job_ids:
+        return
+    with transaction() as conn:
+        for chunk in _chunks(list(job_ids)):
+            conn.execute(f"UPDATE jobs SET heartbeat = ? WHERE id IN ({', '.join('?' * len(chunk))})",
+                         (heartbeat, *chunk))
+
+def interrupt_job(job_id, error):
+    """Marca el trabajo como error si sigue sin terminar; devuelve si lo ha marcado."""
+    with transaction() as conn:
+        cur = conn.execute('''UPDATE jobs SET status = 'error', error = ?, error_status = 500, finished_at = ?
+                              WHERE id = ? AND status IN ('queued', 'running')''',
+                           (error, datetime.now().isoformat(), job_id))
+    return cur.rowcount > 0
+
+def update_job(job_id, **fields):
+    unknown = set(fields) - _JOB_FIELDS
+    if unknown:
+        raise ValueError(f"Campos de trabajo desconocidos: {sorted(unknown)}")
+    values = [json.dumps(v) if k in _JOB_JSON_FIELDS else v for k, v in fields.items()]
+    assignments = ', '.join(f'{k} = ?' for k in fields)
+    with transaction() as conn:
+        conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*values, job_id))
+
+def get_job(job_id):
+    conn = get_db_connection()
+    row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if not row:
+        return None
+    job = dict(row)
+    for field in _JOB_JSON_FIELDS:
+        job[field] = json.loads(job[field]) if job[field] else None
+    return job
+
+# --- CACHÉ DE RESPUESTAS LLM ---
+
+def get_llm_cache_entry(key, now, expired_before):
+    """Respuesta guardada para ``key``; las creadas antes de ``expired_before`` cuentan como fallo."""
+    with transaction() as conn:
+        row = conn.execute('SELECT response FROM llm_cache WHERE key = ? AND created_at >= ?',
+                           (key, expired_before)).fetchone()
+        if not row:
+            return None
+        conn.execute('UPDATE llm_cache SET hits = hits + 1, last_access = ? WHERE key = ?', (now, key))
+        return row['response']
+
+def put_llm_cache_entry(key, provider, model, temperature, prompt_hash, phase, response, now):
+    with transaction() as conn:
+        conn.execute('''INSERT OR REPLACE INTO llm_cache
+                        (key, provider, model, temperature, prompt_hash, phase, response, size, hits, created_at, last_access)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?)''',
+                     (key, provider, model, temperature, prompt_hash, phase, response, len(response.encode('utf-8')), now, now))
+
+def evict_llm_cache(expired_before, max_bytes):
+    """Borra entradas caducadas y, si se supera max_bytes, las menos usadas recientemente."""
+    with transaction() as conn:
+        removed = conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (expired_before,)).rowcount
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+        if total > max_bytes:
+            excess = total - max_bytes
+            rows = conn.execute('SELECT key, size FROM llm_cache ORDER BY last_access').fetchall()
+            victims = []
+            for row in rows:
+                if excess <= 0:
+                    break
+                victims.append((row['key'],))
+                excess -= row['size']
+            conn.executemany('DELETE FROM llm_cache WHERE key = ?', victims)
+            removed += len(victims)
+    return removed
+
+def get_llm_cache_stats():
+    conn = get_db_connection()
+    row = conn.execute('SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes, COALESCE(SUM(hits), 0) AS hits FROM llm_cache').fetchone()
+    return dict(row)
+
+def clear_llm_cache():
+    with transaction() as conn:
+        return conn.execute('DELETE FROM llm_cache').rowcount
+
+# --- FASE 9: ANÁLISIS INCREMENTAL ---
+
+def get_input_watermark(case_id):
+    """Mayor id de input del caso (0 si no tiene)."""
+    conn = get_db_connection()
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM inputs WHERE case_id = ?', (case_id,)).fetchone()[0]
+
+def get_analyzed_watermark(case_id):
+    """Mayor id de input ya incluido en un análisis de patrones (0 si nunca se analizó)."""
+    conn = get_db_connection()
+    return conn.execute('SELECT COALESCE(MAX(input_watermark), 0) FROM analysis_runs WHERE case_id = ?',
+                        (case_id,)).fetchone()[0]
+
+def get_inputs_since(case_id, after_id):
+    conn = get_db_connection()
+    rows = conn.execute('SELECT * FROM inputs WHERE case_id = ? AND id > ? ORDER BY id', (case_id, after_id)).fetchall()
+    return [dict(row) for row in rows]
+
+def count_inputs_since(case_id, after_id):
+    conn = get_db_connection()
+    return conn.execute('SELECT COUNT(*) FROM inputs WHERE case_id = ? AND id > ?', (case_id, after_id)).fetchone()[0]
+
+def record_analysis_run(case_id, phase, input_watermark, new_inputs=0, patterns_created=0, patterns_updated=0):
+    with transaction() as conn:
+        c = conn.execute('''INSERT INTO analysis_runs
+                            (case_id, phase, input_watermark, new_inputs, patterns_created, patterns_updated)
+                            VALUES (?, ?, ?, ?, ?, ?)''',
+                         (case_id, phase, input_watermark, new_inputs, patterns_created, patterns_updated))
+        return c.lastrowid
+
+def get_analysis_runs(case_id, limit=20):
+    conn = get_db_connection()
+    rows = conn.execute('SELECT * FROM analysis_runs WHERE case_id = ? ORDER BY id DESC LIMIT ?', (case_id, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+# --- LOTES DE CASOS ---
+
+def select_cases_for_batch(case_ids=None, since=None, until=None):
+    """Casos candidatos con los datos necesarios para decidir su estado de análisis.
+
+    ``since``/``until`` son fechas (YYYY-MM-DD) sobre la fecha de creación del caso.
+    """
+    where, args = [], []
+    if case_ids:
+        where.append(f"c.id IN ({', '.join('?' * len(case_ids))})")
+        args.extend(case_ids)
+    if since:
+        where.append('date(c.created_at) >= date(?)')
+        args.append(since)
+    if until:
+        where.append('date(c.created_at) <= date(?)')
+        args.append(until)
+    sql = '''
+        SELECT c.id, c.identifier, c.created_at,
+               (SELECT COUNT(*) FROM inputs i WHERE i.case_id = c.id) AS inputs,
+               (SELECT COUNT(*) FROM inputs i WHERE i.case_id = c.id AND i.id >
+                   (SELECT COALESCE(MAX(r.input_watermark), 0) FROM analysis_runs r WHERE r.case_id = c.id)) AS pending_inputs,
+               EXISTS (SELECT 1 FROM patterns p WHERE p.case_id = c.id) AS has_patterns,
+               EXISTS (SELECT 1 FROM threshold_evaluations t WHERE t.case_id = c.id) AS has_threshold,
+               EXISTS (SELECT 1 FROM archetype_assignments a WHERE a.case_id = c.id) AS has_archetype
+        FROM cases c'''
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    rows = get_db_connection().execute(sql + ' ORDER BY c.id', args).fetchall()
+    return [dict(row) for row in rows]
+
+def create_batch_run(batch_id, mode, params, case_ids):
+    """Crea el lote y sus casos pendientes en una sola transacción."""
+    now = datetime.now().isoformat()
+    with transaction() as conn:
+        conn.execute('INSERT INTO batch_runs (id, status, mode, params, total, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                     (batch_id, 'queued', mode, json.dumps(params or {}), len(case_ids), now))
+        conn.executemany("INSERT INTO batch_items (batch_id, case_id, status) VALUES (?, ?, 'pending')",
+                         [(batch_id, case_id) for case_id in case_ids])
+    return batch_id
+
+def update_batch_run(batch_id, **fields):
+    assignments = ', '.join(f'{k} = ?' for k in fields)
+    with transaction() as conn:
+        conn.execute(f'UPDATE batch_runs SET {assignments} WHERE id = ?', (*fields.values(), batch_id))
+
+def reset_batch_items(batch_id):
+    """Devuelve a 'pending' los casos que quedaron 'running' (proceso interrumpido) o con error."""
+    with transaction() as conn:
+        return conn.execute("UPDATE batch_items SET status = 'pending', error = NULL WHERE batch_id = ? AND status IN ('running', 'error')",
+                            (batch_id,)).rowcount
+
+def get_pending_batch_cases(batch_id):
+    conn = get_db_connection()
+    rows = conn.execute("SELECT case_id FROM batch_items WHERE batch_id = ? AND status = 'pending' ORDER BY case_id",
+                        (batch_id,)).fetchall()
+    return [row['case_id'] for row in rows]
+
+def start_batch_item(batch_id, case_id):
+    with transaction() as conn:
+        conn.execute("UPDATE batch_items SET status = 'running', started_at = ? WHERE batch_id = ? AND case_id = ?",
+                     (datetime.now().isoformat(), batch_id, case_id))
+
+def finish_batch_item(batch_id, case_id, status, action, seconds, result=None, error=None):
+    with transaction() as conn:
+        conn.execute('''UPDATE batch_items SET status = ?, action = ?, seconds = ?, result = ?, error = ?, finished_at = ?
+                        WHERE batch_id = ? AND case_id = ?''',
+                     (status, action, seconds, json.dumps(result) if result is not None else None, error,
+                      datetime.now().isoformat(), batch_id, case_id))
+
+def get_batch_run(batch_id):
+    """El lote con sus casos y el recuento por estado (una lectura coherente)."""
+    with transaction(write=False) as conn:
+        run = conn.execute('SELECT * FROM batch_runs WHERE id = ?', (batch_id,)).fetchone()
+        if not run:
+            return None
+        items = conn.execute('''SELECT b.*, c.identifier FROM batch_items b LEFT JOIN cases c ON c.id = b.case_id
+                                WHERE b.batch_id = ? ORDER BY b.case_id''', (batch_id,)).fetchall()
+    run = dict(run)
+    run['params'] = json.loads(run['params']) if run['params'] else {}
+    run['items'] = []
+    run['counts'] = {}
+    for row in items:
+        item = dict(row)
+        item['result'] = json.loads(item['result']) if item['result'] else None
+        run['items'].append(item)
+        run['counts'][item['status']] = run['counts'].get(item['status'], 0) + 1
+    return run
+
+def list_batch_runs(limit=20):
+    conn = get_db_connection()
+    rows = conn.execute('''SELECT r.*, (SELECT COUNT(*) FROM batch_items b WHERE b.batch_id = r.id AND b.status = 'done') AS done
+                           FROM batch_runs r ORDER BY r.created_at DESC LIMIT ?''', (limit,)).fetchall()
+    return [dict(row) for row in rows]
+
+# --- BÚSQUEDA DE TEXTO COMPLETO ---
+
+SEARCH_SOURCES = {
+    # tipo: (tabla, columna indexada, columna de detalle)
+    'input': ('inputs', 'content', 'input_type'),
+    'pattern': ('patterns', 'description', None),
+    'axis_assignment': ('axis_assignments', 'justification', 'axis_name'),
+    'axis_state': ('axis_states', 'justification', 'axis_name'),
+}
+
+def search_text(match, kinds=None, case_id=None, limit=20, marks=('[', ']')):
+    """Mejores coincidencias de la consulta FTS5 ``match``, de mejor a peor (bm25).
+
+    Cada tabla aporta como mucho ``limit`` filas con ORDER BY rank LIMIT: FTS5
+    puntúa todas las coincidencias pero solo conserva las mejores, sin ordenar
+    el resto. El fragmento (``snippet``, con el texto encontrado entre
+    ``marks``) se calcula después, solo para las que se devuelven.
+    """
+    hits = []
+    with transaction(write=False) as conn:
+        for kind in kinds or SEARCH_SOURCES:
+            table, column, detail = SEARCH_SOURCES[kind]
+            fts = f'{table}_fts'
+            where, args = f'{fts} MATCH ?', [match]
+            if case_id is not None:
+                where += f' AND rowid IN (SELECT id FROM {table} WHERE case_id = ?)'
+                args.append(case_id)
+            rows = conn.execute(f'''
+                SELECT f.rowid AS id, f.rank, t.case_id, c.identifier AS case_identifier,
+                       {f't.{detail}' if detail else 'NULL'} AS detail
+                FROM (SELECT rowid, rank FROM {fts} WHERE {where} ORDER BY rank LIMIT ?) f
+                JOIN {table} t ON t.id = f.rowid
+                LEFT JOIN cases c ON c.id = t.case_id''', [*args, limit]).fetchall()
+            hits.extend(dict(row, kind=kind) for row in rows)
+        hits.sort(key=lambda hit: hit['rank'])
+        hits = hits[:limit]
+        for hit in hits:
+            fts = f'{SEARCH_SOURCES[hit["kind"]][0]}_fts'
+            hit['snippet'] = conn.execute(f"SELECT snippet({fts}, 0, ?, ?, '…', 16) FROM {fts} WHERE {fts} MATCH ? AND rowid = ?",
+                                          (marks[0], marks[1], match, hit['id'])).fetchone()[0]
+    return hits
+
+# --- CASOS PARECIDOS ---
+
+def _chunks(values, size=500):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def get_case_features(case_ids, model):
+    """Lo que describe a los casos (todos si ``case_ids`` es None) para compararlos, en una lectura coherente.
+
+    Devuelve (revisión, ids de los casos que existen, {ejes, patrones, umbrales, arquetipos}).
+    Cada patrón trae su vector de ``model`` en ``vector`` (None si no está calculado).
+    """
+    queries = {
+        'cases': 'SELECT id FROM cases',
+        'axes': 'SELECT case_id, axis_name, status, value FROM axis_states',
+        'patterns': '''SELECT p.case_id, p.description, e.vector FROM patterns p
+                       LEFT JOIN pattern_embeddings e ON e.pattern_id = p.id AND e.model = ?''',
+        'thresholds': 'SELECT case_id, score FROM threshold_evaluations',
+        'archetypes': 'SELECT case_id, archetype_name, fit_score FROM archetype_assignments',
+    }
+    result = {name: [] for name in queries}
+    with transaction(write=False) as conn:
+        revision = conn.execute('SELECT COALESCE(MAX(revision), 0) FROM case_feature_changes').fetchone()[0]
+        for name, sql in queries.items():
+            args = [model] if name == 'patterns' else []
+            column = 'id' if name == 'cases' else ('p.case_id' if name == 'patterns' else 'case_id')
+            if case_ids is None:
+                result[name].extend(conn.execute(sql, args).fetchall())
+                continue
+            for chunk in _chunks(list(case_ids)):
+                result[name].extend(conn.execute(f"{sql} WHERE {column} IN ({', '.join('?' * len(chunk))})",
+                                                 args + chunk).fetchall())
+    case_rows = result.pop('cases')
+    return revision, [row['id'] for row in case_rows], result
+
+def get_changed_cases(since_revision):
+    """(revisión actual, ids de los casos que cambiaron después de ``since_revision``)."""
+    with transaction(write=False) as conn:
+        rows = conn.execute('SELECT case_id, revision FROM case_feature_changes WHERE revision > ?',
+                            (since_revision,)).fetchall()
+    return max((row['revision'] for row in rows), default=since_revision), [row['case_id'] for row in rows]
+
+def get_case_identifiers(case_ids):
+    conn = get_db_connection()
+    out = {}
+    for chunk in _chunks(list(case_ids)):
+        rows = conn.execute(f"SELECT id, identifier FROM cases WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+        out.update((row['id'], row['identifier']) for row in rows)
+    return out
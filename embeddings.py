@@ -0,0 +1,139 @@
+"""Embeddings locales de los patrones y detección de casi-duplicados.
+
+Cada análisis de patrones devuelve descripciones que se parecen mucho a las
+de la vez anterior ("Evita mostrar emociones frente a otros hombres" / "Evita
+mostrar sus emociones delante de otros hombres"); sin fusionarlas, los
+patrones se acumulan y engordan todos los prompts posteriores. Aquí cada
+descripción se convierte en un vector con un vectorizador de hashing:
+palabras y trigramas de caracteres, sin tildes ni mayúsculas, repartidos con
+signo en DIM posiciones. No hay modelo que descargar, corre en CPU y da el
+mismo vector en todos los procesos (no usa hash(), que cambia por proceso).
+Los vectores se guardan en float16 (1 KiB por patrón con DIM=512).
+"""
+import os
+import re
+import zlib
+import unicodedata
+import numpy as np
+import database as db
+
+DIM = int(os.getenv('PHENOMA_EMBEDDING_DIM', '512'))
+# Identifica cómo se calcularon los vectores guardados: si cambia, se recalculan
+MODEL = f'hashing-v1-{DIM}'
+# Similitud coseno a partir de la cual dos patrones se consideran el mismo
+DEDUP_THRESHOLD = float(os.getenv('PHENOMA_PATTERN_DEDUP_THRESHOLD', '0.8'))
+
+WORD_WEIGHT = 1.0
+TRIGRAM_WEIGHT = 0.4
+# Palabras vacías: sin ellas "de la familia" y "del hogar" no suman parecido.
+# "no" y "sin" se quedan: "Evita..." y "No evita..." no son el mismo patrón
+STOPWORDS = frozenset('''a al algo ante como con de del e el ella ellos en entre es esta este la las le les lo
+    los mas me mi muy o para pero por que se sea ser si sobre su sus te tu un una uno unos unas y ya'''.split())
+
+# Negaciones: dos descripciones solo son el mismo patrón si niegan lo mismo
+NEGATIONS = frozenset('no ni nunca jamas tampoco sin nadie nada ningun ninguno ninguna'.split())
+# Además del coseno, parte mínima de palabras con contenido en común (Jaccard).
+# Los trigramas acercan palabras distintas con la misma raíz; esto exige que
+# la frase diga lo mismo con casi las mismas palabras
+WORD_OVERLAP = 0.5
+
+_WORD = re.compile(r'\w+')
+
+def _fold(text):
+    text = unicodedata.normalize('NFKD', str(text or '').lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+def _features(text):
+    for word in _WORD.findall(_fold(text)):
+        if word in STOPWORDS:
+            continue
+        yield 'w:' + word, WORD_WEIGHT
+        padded = f'<{word}>'
+        for i in range(len(padded) - 2):
+            yield 't:' + padded[i:i + 3], TRIGRAM_WEIGHT
+
+def embed(texts, dim=None):
+    """Matriz (len(texts), dim) en float32 con las filas normalizadas (norma 1, o 0 si no hay texto)."""
+    dim = dim or DIM
+    rows, cols, values = [], [], []
+    for n, text in enumerate(texts):
+        for feature, weight in _features(text):
+            h = zlib.crc32(feature.encode())
+            rows.append(n)
+            cols.append(h % dim)
+            values.append(weight if (h // dim) & 1 else -weight)
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    np.add.at(matrix, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), np.array(values, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=matrix, where=norms > 0)
+
+def to_blob(vector):
+    return np.asarray(vector, dtype=np.float16).tobytes()
+
+def from_blobs(blobs):
+    if not blobs:
+        return np.zeros((0, DIM), dtype=np.float32)
+    return np.frombuffer(b''.join(blobs), dtype=np.float16).reshape(len(blobs), DIM).astype(np.float32)
+
+def pattern_vectors(case_id, patterns):
+    """Vectores de ``patterns`` (filas de la tabla patterns del caso), en el mismo orden.
+
+    Los que faltan, o se calcularon con otro MODEL, se calculan y se guardan.
+    """
+    stored = db.get_pattern_embeddings(case_id, MODEL)
+    missing = [p for p in patterns if p['id'] not in stored]
+    if missing:
+        blobs = [to_blob(v) for v in embed([p['description'] for p in missing])]
+        db.save_pattern_embeddings(case_id, MODEL, [(p['id'], blob) for p, blob in zip(missing, blobs)])
+        stored.update((p['id'], blob) for p, blob in zip(missing, blobs))
+    return from_blobs([stored[p['id']] for p in patterns])
+
+def _signature(text):
+    words = {w for w in _WORD.findall(_fold(text)) if w not in STOPWORDS}
+    return words & NEGATIONS, words - NEGATIONS
+
+def same_finding(a, b):
+    """Comprobación por palabras de dos descripciones parecidas: mismas negaciones y bastante vocabulario común."""
+    (neg_a, words_a), (neg_b, words_b) = _signature(a), _signature(b)
+    if neg_a != neg_b:
+        return False
+    union = words_a | words_b
+    return not union or len(words_a & words_b) / len(union) >= WORD_OVERLAP
+
+def near_duplicates(vectors, existing, texts, existing_texts, threshold=None):
+    """Para cada vector nuevo, el índice del patrón que duplica, o None.
+
+    ``texts`` y ``existing_texts`` son las descripciones de ``vectors`` y
+    ``existing``: por encima del umbral, solo cuentan los pares que pasan
+    same_finding() ("Evita..." y "No evita..." se parecen mucho, pero se
+    contradicen). Los índices menores que len(existing) son patrones
+    existentes; los demás, len(existing) + j, el nuevo j de este mismo lote
+    (siempre uno anterior). Un duplicado de un nuevo que a su vez duplica a un
+    existente apunta al existente.
+    """
+    threshold = DEDUP_THRESHOLD if threshold is None else threshold
+    n_existing, n_new = len(existing), len(vectors)
+    if not n_new:
+        return []
+    # Todas las similitudes de una vez: nuevos contra existentes y nuevos entre sí
+    similarity = vectors @ np.vstack([existing, vectors]).T
+    # Un nuevo solo puede fusionarse con un existente o con un nuevo anterior a él
+    later = np.arange(n_existing + n_new)[None, :] >= n_existing + np.arange(n_new)[:, None]
+    similarity[later] = -np.inf
+    # La comprobación por palabras solo se hace con los candidatos que superan el umbral
+    candidates = list(existing_texts) + list(texts)
+    for j, k in zip(*np.nonzero(similarity >= threshold)):
+        if not same_finding(texts[j], candidates[k]):
+            similarity[j, k] = -np.inf
+    best = similarity.argmax(axis=1)
+    matched = similarity[np.arange(n_new), best] >= threshold
+    targets = []
+    for j in range(n_new):
+        if not matched[j]:
+            targets.append(None)
+            continue
+        target = int(best[j])
+        if target >= n_existing and targets[target - n_existing] is not None:
+            target = targets[target - n_existing]
+        targets.append(target)
+    return targets
@@ -0,0 +1,8 @@
+"""Configuración de gunicorn (se carga sola al lanzar ``gunicorn app:app`` desde este directorio)."""
+
+def post_worker_init(worker):
+    # Tras cargar la app (y el .env) en el worker: uno de ellos se queda con el
+    # cerrojo y hace de guardián de la precarga; si muere, el worker que lo
+    # sustituye vuelve a intentarlo
+    import warmup
+    warmup.start()
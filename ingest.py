@@ -0,0 +1,147 @@
+"""Ingesta masiva de inputs (Fase 1).
+
+Lee un cuerpo JSON (array) o NDJSON de forma incremental, sin cargarlo entero
+en memoria, y lo inserta en transacciones por bloques.
+"""
+import json
+import time
+import database as db
+
+CHUNK_SIZE = 500
+READ_SIZE = 64 * 1024
+MAX_REPORTED_ERRORS = 100
+
+def iter_ndjson(stream):
+    """Genera (línea, objeto) o (línea, ValueError) por cada línea no vacía."""
+    for lineno, raw in enumerate(stream, start=1):
+        line = raw.decode('utf-8', errors='replace') if isinstance(raw, bytes) else raw
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield lineno, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield lineno, ValueError(f"JSON inválido: {e.msg}")
+
+def iter_json_array(stream):
+    """Genera (posición, objeto) para cada elemento de un array JSON leído por bloques.
+
+    Un error de sintaxis se entrega como ValueError y termina la lectura: a
+    diferencia de NDJSON, en un array no hay forma segura de resincronizar.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    pending = b''
+    eof = False
+    state = 'start'  # start -> first -> (item <-> after)
+    index = 0
+
+    while True:
+        need_more = False
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+
+        if pos == len(buf):
+            need_more = True
+        else:
+            ch = buf[pos]
+            if state == 'start':
+                if ch != '[':
+                    raise ValueError("El cuerpo debe ser un array JSON o NDJSON")
+                pos += 1
+                state = 'first'
+            elif ch == ']' and state in ('first', 'after'):
+                return
+            elif state == 'after':
+                if ch != ',':
+                    yield index + 1, ValueError("Se esperaba ',' o ']' entre elementos")
+                    return
+                pos += 1
+                state = 'item'
+            else:
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                    # Un número al final del bloque puede estar cortado ("12" de "1234")
+                    need_more = end == len(buf) and not eof
+                except json.JSONDecodeError as e:
+                    if eof:
+                        yield index + 1, ValueError(f"JSON inválido: {e.msg}")
+                        return
+                    need_more = True
+                if not need_more:
+                    index += 1
+                    yield index, obj
+                    pos = end
+                    state = 'after'
+
+        if need_more:
+            if eof:
+                if state == 'start':
+                    raise ValueError("Cuerpo vacío")
+                yield index + 1, ValueError("Array JSON sin cerrar")
+                return
+            chunk = stream.read(READ_SIZE)
+            eof = not chunk
+            data = pending + chunk
+            try:
+                text = data.decode('utf-8')
+                pending = b''
+            except UnicodeDecodeError as e:
+                # Carácter multibyte partido entre dos bloques
+                text = data[:e.start].decode('utf-8')
+                pending = data[e.start:]
+                if eof:
+                    text += pending.decode('utf-8', errors='replace')
+                    pending = b''
+            buf = buf[pos:] + text
+            pos = 0
+
+def _validate(item):
+    if not isinstance(item, dict):
+        raise ValueError("Cada input debe ser un objeto JSON")
+    content = item.get('content')
+    if not content or not isinstance(content, str):
+        raise ValueError("Contenido es requerido")
+    metadata = item.get('metadata', {})
+    if not isinstance(metadata, dict):
+        raise ValueError("metadata debe ser un objeto")
+    return {'content': content, 'input_type': item.get('input_type', 'frase'), 'metadata': metadata}
+
+def ingest_inputs(case_id, records, chunk_size=CHUNK_SIZE):
+    """Valida e inserta los inputs de ``records`` (pares (línea, objeto|error)).
+
+    Devuelve un resumen con conteos, errores por línea y throughput.
+    """
+    start = time.perf_counter()
+    inserted = 0
+    failed = 0
+    errors = []
+    chunk = []
+
+    with db.use_profile('bulk'):
+        for lineno, item in records:
+            try:
+                if isinstance(item, Exception):
+                    raise item
+                chunk.append(_validate(item))
+            except ValueError as e:
+                failed += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'line': lineno, 'error': str(e)})
+                continue
+            if len(chunk) >= chunk_size:
+                inserted += db.add_inputs_bulk(case_id, chunk)
+                chunk = []
+        if chunk:
+            inserted += db.add_inputs_bulk(case_id, chunk)
+
+    elapsed = time.perf_counter() - start
+    return {
+        'inserted': inserted,
+        'failed': failed,
+        'errors': errors,
+        'errors_truncated': failed > len(errors),
+        'elapsed_ms': round(elapsed * 1000, 1),
+        'inputs_per_second': round(inserted / elapsed, 1) if elapsed > 0 else None,
+    }
@@ -0,0 +1,109 @@
+"""Trabajos asíncronos: las llamadas a la IA no retienen a los workers HTTP.
+
+submit() registra el trabajo en la tabla ``jobs`` y lo ejecuta en un pool de
+hilos del proceso. El estado vive en la DB, así que cualquier worker de
+gunicorn puede responder a GET /api/jobs/<id>.
+
+Cada trabajo guarda el pid del proceso que lo ejecuta y un latido que un hilo
+de ese proceso renueva mientras esté en cola o en curso. Si el proceso muere
+(reinicio, timeout de gunicorn), get_job() lo ve sin latido o con el pid muerto
+y lo da por interrumpido en vez de dejarlo ``running`` para siempre.
+"""
+import os
+import time
+import uuid
+import threading
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import database as db
+import scheduler
+from phases import PhaseError
+
+MAX_WORKERS = int(os.getenv('PHENOMA_JOB_WORKERS', '4'))
+HEARTBEAT_SECONDS = 10
+STALE_SECONDS = float(os.getenv('PHENOMA_JOB_STALE_SECONDS', '60'))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_current = threading.local()
+# Trabajos de este proceso aún sin terminar, a los que el hilo de latido mantiene vivos
+_active = set()
+_active_lock = threading.Lock()
+
+def _get_executor():
+    # El pool se crea en el primer uso de cada proceso (los hilos no sobreviven al fork)
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='phenoma-job')
+            _executor_pid = os.getpid()
+            with _active_lock:
+                _active.clear()
+            threading.Thread(target=_heartbeat_loop, name='phenoma-job-heartbeat', daemon=True).start()
+        return _executor
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(HEARTBEAT_SECONDS)
+        with _active_lock:
+            job_ids = list(_active)
+        try:
+            db.touch_jobs(job_ids, time.time())
+        except Exception:
+            traceback.print_exc()
+
+def submit(kind, case_id, fn, *args, params=None, **kwargs):
+    """Encola ``fn(*args, **kwargs)`` y devuelve el id del trabajo."""
+    job_id = uuid.uuid4().hex
+    executor = _get_executor()
+    with _active_lock:
+        _active.add(job_id)
+    db.create_job(job_id, kind, case_id, params, pid=os.getpid(), heartbeat=time.time())
+    executor.submit(_run, job_id, fn, args, kwargs)
+    return job_id
+
+def _run(job_id, fn, args, kwargs):
+    _current.job_id = job_id
+    db.update_job(job_id, status='running', started_at=datetime.now().isoformat())
+    try:
+        # Las llamadas locales del trabajo ceden el turno a las interactivas
+        with scheduler.context(priority='job', job_id=job_id):
+            result = fn(*args, **kwargs)
+        db.update_job(job_id, status='done', result=result, finished_at=datetime.now().isoformat())
+    except PhaseError as e:
+        db.update_job(job_id, status='error', error=e.message, error_status=e.status,
+                      finished_at=datetime.now().isoformat())
+    except Exception as e:
+        traceback.print_exc()
+        db.update_job(job_id, status='error', error=f"Error interno: {str(e)}", error_status=500,
+                      finished_at=datetime.now().isoformat())
+    finally:
+        _current.job_id = None
+        with _active_lock:
+            _active.discard(job_id)
+
+def current_job_id():
+    return getattr(_current, 'job_id', None)
+
+def report_progress(**progress):
+    """Publica el progreso del trabajo en curso (no hace nada fuera de un trabajo)."""
+    job_id = current_job_id()
+    if job_id:
+        db.update_job(job_id, progress=progress, heartbeat=time.time())
+
+def _interrupted(job, now):
+    if job['status'] not in ('queued', 'running'):
+        return False
+    # Los trabajos anteriores a la migración 13 no tienen pid: nadie los va a terminar
+    if job['pid'] is None or job['heartbeat'] is None:
+        return True
+    return not scheduler._alive(job['pid']) or now - job['heartbeat'] > STALE_SECONDS
+
+def get_job(job_id):
+    job = db.get_job(job_id)
+    if job and _interrupted(job, time.time()):
+        db.interrupt_job(job_id, 'Trabajo interrumpido: el proceso que lo ejecutaba terminó')
+        job = db.get_job(job_id)
+    return job
@@ -0,0 +1,261 @@
+"""Capa única de acceso a los modelos: OpenAI (modo 'cloud') y Ollama (modo 'local').
+
+Los clientes se crean una vez por proceso y se comparten entre hilos, de modo
+que las conexiones HTTP (y el handshake TLS con OpenAI) se reutilizan entre
+llamadas. Todas las fases y el CLI pasan por complete()/stream(), que es
+también el único punto de timeouts, métricas y caché.
+"""
+import os
+import time
+import threading
+import llm_cache
+import ratelimit
+import scheduler
+
+CLOUD_MODEL = os.getenv('PHENOMA_CLOUD_MODEL', 'gpt-4o')
+LOCAL_MODEL = os.getenv('PHENOMA_LOCAL_MODEL', 'llama3')
+OLLAMA_HOST = os.getenv('OLLAMA_HOST') or None
+CLOUD_TIMEOUT = float(os.getenv('PHENOMA_CLOUD_TIMEOUT', '120'))
+LOCAL_TIMEOUT = float(os.getenv('PHENOMA_LOCAL_TIMEOUT', '300'))
+# Tiempo que Ollama mantiene el modelo cargado tras cada llamada (su OLLAMA_KEEP_ALIVE es 5m)
+KEEP_ALIVE = os.getenv('PHENOMA_LOCAL_KEEP_ALIVE', '30m')
+# Una llamada cuya carga del modelo supera este tiempo cuenta como arranque en frío
+COLD_LOAD_SECONDS = float(os.getenv('PHENOMA_COLD_LOAD_SECONDS', '1'))
+
+class QueueStatus(dict):
+    """Posición y espera estimada en la cola de Ollama, generada por stream(queue_events=True)."""
+
+class LLMError(Exception):
+    """Error de configuración o de llamada al modelo, con su código HTTP."""
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+# --- Clientes compartidos ---
+
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+def _client(provider, factory):
+    global _clients_pid
+    with _clients_lock:
+        # Tras un fork (workers de gunicorn) los pools de conexiones no se heredan
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        if provider not in _clients:
+            _clients[provider] = factory()
+        return _clients[provider]
+
+def get_openai_client():
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise LLMError('Falta OPENAI_API_KEY en .env', 400)
+    def factory():
+        from openai import OpenAI
+        # Los reintentos los hace ratelimit, coordinados entre procesos
+        return OpenAI(api_key=api_key, timeout=CLOUD_TIMEOUT, max_retries=0)
+    return _client('openai', factory)
+
+def get_ollama_client():
+    def factory():
+        import ollama
+        return ollama.Client(host=OLLAMA_HOST, timeout=LOCAL_TIMEOUT)
+    return _client('ollama', factory)
+
+# --- Métricas ---
+
+_metrics_lock = threading.Lock()
+_metrics = {}
+
+def _record(provider, phase, seconds, error=False, cached=False, load_seconds=None):
+    """Registra una llamada; ``load_seconds`` (solo Ollama) separa arranques en frío y en caliente."""
+    with _metrics_lock:
+        m = _metrics.setdefault(f'{provider}:{phase or "-"}', {
+            'calls': 0, 'errors': 0, 'cache_hits': 0, 'total_seconds': 0.0, 'last_seconds': None,
+            'cold_calls': 0, 'cold_seconds': 0.0, 'warm_calls': 0, 'warm_seconds': 0.0, 'load_seconds': 0.0,
+        })
+        m['calls'] += 1
+        if error:
+            m['errors'] += 1
+        if cached:
+            m['cache_hits'] += 1
+        else:
+            m['total_seconds'] += seconds
+            m['last_seconds'] = round(seconds, 3)
+        if load_seconds is not None:
+            kind = 'cold' if load_seconds >= COLD_LOAD_SECONDS else 'warm'
+            m[f'{kind}_calls'] += 1
+            m[f'{kind}_seconds'] += seconds
+            m['load_seconds'] += load_seconds
+
+def _load_seconds(response):
+    """Segundos que Ollama dedicó a cargar el modelo (load_duration viene en nanosegundos)."""
+    value = response.get('load_duration') if response is not None else None
+    return value / 1e9 if value is not None else None
+
+def metrics():
+    with _metrics_lock:
+        snapshot = {k: dict(v) for k, v in _metrics.items()}
+    for m in snapshot.values():
+        model_calls = m['calls'] - m['cache_hits']
+        m['avg_seconds'] = round(m['total_seconds'] / model_calls, 3) if model_calls else None
+        m['total_seconds'] = round(m['total_seconds'], 3)
+        for kind in ('cold', 'warm'):
+            m[f'avg_{kind}_seconds'] = round(m[f'{kind}_seconds'] / m[f'{kind}_calls'], 3) if m[f'{kind}_calls'] else None
+            m[f'{kind}_seconds'] = round(m[f'{kind}_seconds'], 3)
+        m['load_seconds'] = round(m['load_seconds'], 3)
+    return {'calls': snapshot, 'cache': llm_cache.stats(), 'rate_limit': ratelimit.stats('openai')}
+
+# --- Peticiones ---
+# ``options`` describe cómo se llama al modelo en cada fase:
+#   temperature  (solo nube)      json        response_format JSON en la nube (por defecto True)
+#   local_role   rol del mensaje en Ollama     local_json  format='json' en Ollama (por defecto True)
+#   local_suffix texto añadido al prompt en Ollama
+
+def _messages(prompt, role):
+    if isinstance(prompt, list):
+        return prompt
+    return [{'role': role, 'content': prompt}]
+
+def build_params(prompt, mode, options=None, model=None):
+    options = options or {}
+    if mode == 'cloud':
+        params = {'model': model or CLOUD_MODEL, 'messages': _messages(prompt, 'system')}
+        if options.get('json', True):
+            params['response_format'] = {"type": "json_object"}
+        if options.get('temperature') is not None:
+            params['temperature'] = options['temperature']
+        return params
+
+    if isinstance(prompt, str):
+        prompt = prompt + options.get('local_suffix', '')
+    params = {'model': model or LOCAL_MODEL, 'messages': _messages(prompt, options.get('local_role', 'system')),
+              'keep_alive': KEEP_ALIVE}
+    if options.get('local_json', True):
+        params['format'] = 'json'
+    return params
+
+def _call_error(provider, error):
+    name = 'OpenAI' if provider == 'openai' else 'Ollama'
+    if isinstance(error, scheduler.QueueRejected):
+        return LLMError(error.message, 503)
+    if isinstance(error, ratelimit.RateLimitExceeded):
+        return LLMError(f'Límite de peticiones a {name} alcanzado; inténtalo de nuevo en {error.wait:.0f}s', 429)
+    if ratelimit.status_code(error) == 429:
+        return LLMError(f'{name} está limitando las peticiones; inténtalo de nuevo en unos segundos', 429)
+    return LLMError(f"Error al llamar a {name}: {error}", 502)
+
+def complete(phase, prompt, mode='local', options=None, model=None, use_cache=True):
+    """Devuelve el texto completo de la respuesta del modelo."""
+    provider = 'openai' if mode == 'cloud' else 'ollama'
+    params = build_params(prompt, mode, options, model)
+    called = []
+    loaded = []
+
+    def call():
+        called.append(True)
+        if provider == 'openai':
+            client = get_openai_client()
+            response, reserved = ratelimit.call_with_retries(
+                provider, params, lambda: client.chat.completions.create(**params))
+            used = 0
+            try:
+                used = getattr(getattr(response, 'usage', None), 'total_tokens', None)
+                return response.choices[0].message.content
+            finally:
+                # Si la respuesta no se puede leer se devuelve toda la reserva
+                ratelimit.settle(provider, reserved, used)
+        with scheduler.slot(phase):
+            response = get_ollama_client().chat(**params)
+        loaded.append(_load_seconds(response))
+        return response['message']['content']
+
+    start = time.perf_counter()
+    try:
+        content = llm_cache.cached_call(provider, params, call, phase, use_cache)
+    except LLMError:
+        raise
+    except Exception as e:
+        _record(provider, phase, time.perf_counter() - start, error=True)
+        raise _call_error(provider, e)
+    _record(provider, phase, time.perf_counter() - start, cached=not called, load_seconds=loaded[0] if loaded else None)
+    return content
+
+def _wait_local(phase, queue_events):
+    turn = scheduler.wait_turn(phase)
+    try:
+        while True:
+            status = next(turn)
+            if queue_events:
+                yield QueueStatus(status)
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        turn.close()
+
+def stream(phase, prompt, mode='local', options=None, model=None, use_cache=True, queue_events=False):
+    """Como complete(), pero genera los fragmentos de texto según llegan.
+
+    Un acierto de caché se entrega como un único fragmento; la respuesta
+    completa se guarda en caché al terminar. Con ``queue_events``, mientras la
+    llamada local espera turno se generan también QueueStatus.
+    """
+    provider = 'openai' if mode == 'cloud' else 'ollama'
+    params = build_params(prompt, mode, options, model)
+    request = llm_cache.request_key(params)
+    if use_cache and llm_cache.ENABLED:
+        cached = llm_cache.get(provider, params['model'], params.get('temperature'), request)
+        if cached is not None:
+            _record(provider, phase, 0, cached=True)
+            yield cached
+            return
+    elif llm_cache.ENABLED:
+        llm_cache.count_bypass()
+
+    start = time.perf_counter()
+    parts = []
+    loaded = None
+    try:
+        if provider == 'openai':
+            client = get_openai_client()
+            # Los 429 llegan al abrir el stream, antes del primer fragmento: se reintenta solo eso
+            response, reserved = ratelimit.call_with_retries(
+                provider, params, lambda: client.chat.completions.create(
+                    stream=True, stream_options={'include_usage': True}, **params))
+            used = None
+            try:
+                for chunk in response:
+                    if getattr(chunk, 'usage', None):
+                        used = chunk.usage.total_tokens
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        yield parts[-1]
+            finally:
+                # También si el stream se corta: se devuelve al cubo lo reservado de más
+                ratelimit.settle(provider, reserved, used if used is not None
+                                 else ratelimit.response_tokens(params, ''.join(parts)))
+        else:
+            ticket = yield from _wait_local(phase, queue_events)
+            slot_start = time.perf_counter()
+            try:
+                for chunk in get_ollama_client().chat(stream=True, **params):
+                    text = chunk['message']['content']
+                    if text:
+                        parts.append(text)
+                        yield text
+                    if chunk.get('done'):
+                        loaded = _load_seconds(chunk)
+            finally:
+                scheduler.release(ticket, time.perf_counter() - slot_start)
+    except LLMError:
+        raise
+    except Exception as e:
+        _record(provider, phase, time.perf_counter() - start, error=True)
+        raise _call_error(provider, e)
+    _record(provider, phase, time.perf_counter() - start, load_seconds=loaded)
+
+    if llm_cache.ENABLED:
+        llm_cache.put(provider, params['model'], params.get('temperature'), request, ''.join(parts), phase)
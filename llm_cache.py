@@ -0,0 +1,98 @@
+"""Caché persistente de respuestas de los modelos (OpenAI y Ollama).
+
+La clave es (proveedor, modelo, temperatura, sha256 de la petición renderizada:
+mensajes y formato de salida). Las entradas caducan por TTL y, si la caché
+supera su tamaño máximo, se expulsan las menos usadas recientemente.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+import database as db
+
+# Parámetros de la llamada que no cambian la respuesta y no forman parte de la clave
+NON_KEY_PARAMS = ('model', 'temperature', 'stream', 'keep_alive')
+
+TTL_SECONDS = int(os.getenv('PHENOMA_LLM_CACHE_TTL', str(30 * 24 * 3600)))
+MAX_BYTES = int(os.getenv('PHENOMA_LLM_CACHE_MAX_MB', '64')) * 1024 * 1024
+ENABLED = os.getenv('PHENOMA_LLM_CACHE', '1') != '0'
+EVICT_EVERY = 50  # escrituras entre pasadas de expulsión
+
+_counters_lock = threading.Lock()
+_counters = {'hits': 0, 'misses': 0, 'bypassed': 0, 'writes': 0}
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+        return _counters[name]
+
+def prompt_hash(request):
+    """sha256 de la petición sin modelo ni temperatura (mensajes, formato...)."""
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def make_key(provider, model, temperature, request):
+    raw = json.dumps([provider, model, temperature, prompt_hash(request)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def get(provider, model, temperature, request):
+    now = time.time()
+    # Una entrada caducada es un fallo aunque la expulsión aún no la haya borrado
+    response = db.get_llm_cache_entry(make_key(provider, model, temperature, request), now, now - TTL_SECONDS)
+    _count('hits' if response is not None else 'misses')
+    return response
+
+def count_bypass():
+    """Anota una llamada que se salta la caché a propósito (``use_cache=False``)."""
+    _count('bypassed')
+
+def put(provider, model, temperature, request, response, phase=None):
+    if not response:
+        return
+    now = time.time()
+    db.put_llm_cache_entry(make_key(provider, model, temperature, request), provider, model, temperature,
+                           prompt_hash(request), phase, response, now)
+    if _count('writes') % EVICT_EVERY == 0:
+        db.evict_llm_cache(now - TTL_SECONDS, MAX_BYTES)
+
+def request_key(params):
+    return {k: v for k, v in params.items() if k not in NON_KEY_PARAMS}
+
+def cached_call(provider, params, fn, phase=None, use_cache=True):
+    """Devuelve la respuesta cacheada para ``params`` o llama a ``fn()`` y la guarda.
+
+    ``params`` son los argumentos de la llamada al proveedor (model,
+    temperature, messages, formato...). ``use_cache=False`` fuerza la llamada
+    y refresca la entrada con la respuesta nueva.
+    """
+    if not ENABLED:
+        return fn()
+    model = params.get('model')
+    temperature = params.get('temperature')
+    request = request_key(params)
+    if use_cache:
+        cached = get(provider, model, temperature, request)
+        if cached is not None:
+            return cached
+    else:
+        count_bypass()
+    response = fn()
+    put(provider, model, temperature, request, response, phase)
+    return response
+
+def stats():
+    with _counters_lock:
+        counters = dict(_counters)
+    lookups = counters['hits'] + counters['misses']
+    return {
+        'enabled': ENABLED,
+        'process': counters,
+        'hit_rate': round(counters['hits'] / lookups, 3) if lookups else None,
+        'store': db.get_llm_cache_stats(),
+        'ttl_seconds': TTL_SECONDS,
+        'max_bytes': MAX_BYTES,
+    }
+
+def clear():
+    return db.clear_llm_cache()
@@ -0,0 +1,740 @@
+"""Fases de análisis con IA (Fases 2 a 7).
+
+Cada fase se define en tres pasos: preparar el prompt a partir de la DB,
+interpretar la respuesta del modelo y guardar el resultado. run_phase() los
+encadena con la llamada al modelo; los endpoints y los trabajos asíncronos
+solo necesitan el nombre de la fase.
+"""
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import budget
+import database as db
+import llm
+import prompt_registry
+
+class PhaseError(Exception):
+    """Error de una fase con el código HTTP que debe devolver el endpoint."""
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def _render_prompt(name, **values):
+    try:
+        return prompt_registry.render(name, **values)
+    except prompt_registry.PromptError as e:
+        raise PhaseError(str(e), 500)
+
+def _call_model(system_prompt, mode, spec, phase=None, use_cache=True):
+    try:
+        return llm.complete(phase, system_prompt, mode, spec, use_cache=use_cache)
+    except llm.LLMError as e:
+        raise PhaseError(e.message, e.status)
+
+def _stream_model(system_prompt, mode, spec, phase=None, use_cache=True):
+    try:
+        yield from llm.stream(phase, system_prompt, mode, spec, use_cache=use_cache, queue_events=True)
+    except llm.LLMError as e:
+        raise PhaseError(e.message, e.status)
+
+class JsonItemScanner:
+    """Detecta, sobre un JSON que llega por fragmentos, cada objeto completo de la
+    primera lista (raíz ``[...]`` o valor de la raíz ``{"patterns": [...]}``).
+
+    feed() devuelve los objetos que se han cerrado con el fragmento recibido.
+    """
+    def __init__(self):
+        self.buf = []
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.list_depth = None
+        self.item_start = None
+
+    def feed(self, text):
+        items = []
+        for ch in text:
+            self.buf.append(ch)
+            index = self.pos
+            self.pos += 1
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if ch == '"':
+                self.in_string = True
+            elif ch in '[{':
+                self.depth += 1
+                if ch == '[' and self.list_depth is None and self.depth <= 2:
+                    self.list_depth = self.depth
+                elif ch == '{' and self.list_depth is not None and self.depth == self.list_depth + 1:
+                    self.item_start = index
+            elif ch in ']}':
+                if ch == '}' and self.item_start is not None and self.depth == self.list_depth + 1:
+                    try:
+                        items.append(json.loads(''.join(self.buf[self.item_start:index + 1])))
+                    except json.JSONDecodeError:
+                        pass
+                    self.item_start = None
+                self.depth -= 1
+        return items
+
+# --- Serialización compacta y presupuesto de tokens ---
+# Los prompts usan ids cortos (posición del patrón en el caso, no su id en la
+# DB), fechas al día y justificaciones sin repetir. Lo que no cabe en el
+# contexto del modo se abrevia o se omite empezando por lo de menor valor.
+
+LEVELS = {'baja': 1, 'media': 2, 'alta': 3}
+
+def _day(timestamp):
+    return str(timestamp or '')[:10]
+
+def _level(text):
+    """Alta/Media/Baja (también "Recurrencia Alta") -> 3/2/1; 0 si no se reconoce."""
+    words = str(text or '').lower().split()
+    return next((LEVELS[w] for w in reversed(words) if w in LEVELS), 0)
+
+def _ordered_patterns(case_id):
+    """Patrones del caso por id: su posición (desde 1) es el id corto de los prompts."""
+    return sorted(db.get_case_patterns(case_id), key=lambda p: p['id'])
+
+def _pattern_by_ref(refs, ref, current):
+    """Patrón de ``current`` (por id) al que remite el id corto ``ref``.
+
+    ``refs`` son los patrones con los que se construyó el prompt (el orden de
+    prepare, no el de ahora); None si el id no existe o el patrón ya se borró.
+    """
+    try:
+        n = int(str(ref).strip().lstrip('IDP# '))
+    except (TypeError, ValueError):
+        return None
+    return current.get(refs[n - 1]['id']) if 0 < n <= len(refs) else None
+
+def _unique(text, seen):
+    """Devuelve el texto la primera vez que aparece y None las siguientes."""
+    key = ' '.join(str(text or '').lower().split())
+    if not key or key in seen:
+        return None
+    seen.add(key)
+    return text
+
+def _fit_prompt(name, placeholder, sections, mode, **values):
+    """Renderiza la plantilla con las secciones recortadas al presupuesto del modo."""
+    template_tokens = budget.estimate_tokens(_render_prompt(name, **{placeholder: ''}, **values), mode)
+    text, trimmed = budget.fit(sections, budget.prompt_budget(mode) - template_tokens, mode)
+    return _render_prompt(name, **{placeholder: text}, **values), trimmed
+
+def _load_json(content):
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        raise PhaseError('Error al procesar respuesta JSON de la IA', 500)
+
+# --- FASE 2: Patrones ---
+
+def _input_line(i):
+    return f"- [{i['input_type']}, {_day(i.get('created_at'))}] {i['content']}"
+
+def _prepare_patterns(case_id, mode):
+    # Sin recortes: si los inputs no caben, la fase se hace por bloques (map-reduce)
+    inputs = db.get_case_inputs(case_id)
+    if not inputs:
+        raise PhaseError('No hay inputs para analizar', 400)
+    inputs_text = "\n".join([_input_line(i) for i in reversed(inputs)])
+    return _render_prompt('pattern_detection.md', inputs_text=inputs_text), 0
+
+def _parse_patterns(content):
+    match = re.search(r'(\[.*\]|\{.*\})', content or '', re.DOTALL)
+    if not match:
+        raise PhaseError('La IA no devolvió un JSON válido.', 500)
+    try:
+        result_json = json.loads(match.group(1))
+    except json.JSONDecodeError:
+        raise PhaseError('La IA devolvió un JSON malformado.', 500)
+    # Manejar si devuelve lista o dict
+    patterns = result_json if isinstance(result_json, list) else result_json.get('patterns', result_json)
+    # Normalizar lista (asegurar que es lista de dicts)
+    if isinstance(patterns, dict): patterns = [patterns]
+    if not isinstance(patterns, list): patterns = []
+    return [p for p in patterns if isinstance(p, dict)]
+
+PATTERN_FIELDS = ('description', 'recurrence', 'persistence', 'pressure_context', 'contradictions')
+
+def _pattern_row(p):
+    return {
+        'description': p.get('description', 'Sin descripción'),
+        'recurrence': p.get('recurrence', 'Media'),
+        'persistence': p.get('persistence', 'Desconocida'),
+        'pressure_context': p.get('pressure_context', 'No especificado'),
+        'contradictions': p.get('contradictions', 'Ninguna'),
+    }
+
+def _plan_patterns(case_id, patterns, refs=None):
+    """Decide qué patrones del modelo se crean y cuáles se fusionan con uno existente: (a_crear, a_actualizar).
+
+    Un patrón se fusiona con el existente al que remite su id (solo en el
+    re-análisis incremental, con los ``refs`` del prompt) o con el existente más parecido si la
+    similitud de las descripciones supera embeddings.DEDUP_THRESHOLD y dicen lo
+    mismo palabra a palabra (mismas negaciones, vocabulario común). Los
+    casi-duplicados dentro de la misma respuesta se descartan. Solo lee: los
+    vectores y las decisiones se calculan antes de abrir la transacción de
+    escritura (_apply_patterns).
+    """
+    import embeddings  # numpy solo se carga al guardar patrones, no al arrancar la app
+    ordered = _ordered_patterns(case_id)
+    current = {p['id']: p for p in ordered}
+    matches = [_pattern_by_ref(refs, p.get('id'), current) if refs is not None else None for p in patterns]
+    pending = [n for n, current in enumerate(matches) if current is None]
+    if pending:
+        texts = [str(patterns[n].get('description') or '') for n in pending]
+        targets = embeddings.near_duplicates(embeddings.embed(texts), embeddings.pattern_vectors(case_id, ordered),
+                                             texts, [p['description'] for p in ordered])
+        for n, target in zip(pending, targets):
+            if target is not None:
+                # False: duplica a otro patrón nuevo de esta respuesta
+                matches[n] = ordered[target] if target < len(ordered) else False
+
+    to_update, to_create = {}, []
+    for p, current in zip(patterns, matches):
+        if current is False:
+            continue
+        if current is None:
+            to_create.append(_pattern_row(p))
+            continue
+        base = to_update.get(current['id'], current)
+        row = {f: p.get(f) or base[f] for f in PATTERN_FIELDS}
+        if any(row[f] != current[f] for f in PATTERN_FIELDS):
+            to_update[current['id']] = dict(row, id=current['id'])
+
+    rows = to_create + list(to_update.values())
+    for row, vector in zip(rows, embeddings.embed([row['description'] for row in rows])):
+        row.update(embedding=embeddings.to_blob(vector), embedding_model=embeddings.MODEL)
+    return to_create, list(to_update.values())
+
+def _apply_patterns(case_id, plan):
+    """Escribe el plan de _plan_patterns en una transacción; devuelve (creados, actualizados)."""
+    to_create, to_update = plan
+    with db.transaction():
+        updated = db.update_patterns_bulk(to_update)
+        created = db.add_patterns_bulk(case_id, to_create)
+    return created, updated
+
+def _merge_patterns(case_id, patterns, refs=None):
+    """Guarda los patrones del modelo fusionando los que ya existen; devuelve (creados, actualizados)."""
+    return _apply_patterns(case_id, _plan_patterns(case_id, patterns, refs))
+
+def _save_patterns(case_id, patterns, plan):
+    # Guardar en DB (una sola transacción), sin duplicar los patrones de análisis anteriores
+    created, updated = _apply_patterns(case_id, plan)
+    return {'message': 'Análisis completado', 'patterns': patterns, 'created': created, 'updated': updated,
+            'changed': bool(created or updated)}
+
+# --- FASE 2 por bloques (map-reduce) ---
+# Cuando los inputs no caben en el contexto del modelo se reparten en bloques
+# (map: patrones por bloque) y después se consolidan (reduce). En la nube los
+# bloques se procesan en paralelo; en local, uno tras otro (Ollama atiende
+# una petición a la vez).
+
+MAP_WORKERS = int(os.getenv('PHENOMA_MAP_WORKERS', '4'))
+REDUCE_ROUNDS = 3
+
+def _run_chunks(fn, chunks, mode):
+    """Genera (índice, resultado) por bloque, en orden de finalización."""
+    if mode != 'cloud' or len(chunks) < 2:
+        for n, chunk in enumerate(chunks):
+            yield n, fn(chunk)
+        return
+    with ThreadPoolExecutor(max_workers=min(MAP_WORKERS, len(chunks))) as pool:
+        futures = {pool.submit(fn, chunk): n for n, chunk in enumerate(chunks)}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+def _normalize(text):
+    return ' '.join(re.sub(r'[^\w\s]', ' ', str(text).lower()).split())
+
+def _similar(a, b):
+    wa, wb = set(a.split()), set(b.split())
+    return bool(wa and wb) and len(wa & wb) / len(wa | wb) >= 0.8
+
+def _merge_duplicates(found):
+    """Fusiona patrones de distintos bloques con la misma descripción (o casi).
+
+    ``found`` son pares (bloque, patrón); cada patrón resultante lleva en
+    ``chunks`` los bloques en los que apareció.
+    """
+    merged = []
+    for n, p in found:
+        row = _pattern_row(p)
+        key = _normalize(row['description'])
+        target = next((m for m in merged if m['_key'] == key or _similar(m['_key'], key)), None)
+        if target is None:
+            merged.append(dict(row, _key=key, chunks={n}))
+            continue
+        target['chunks'].add(n)
+        for field in ('recurrence', 'persistence', 'pressure_context'):
+            if _level(row[field]) > _level(target[field]):
+                target[field] = row[field]
+        if _normalize(row['contradictions']) not in ('ninguna', _normalize(target['contradictions'])):
+            if _normalize(target['contradictions']) == 'ninguna':
+                target['contradictions'] = row['contradictions']
+            else:
+                target['contradictions'] += f"; {row['contradictions']}"
+    for m in merged:
+        del m['_key']
+    return merged
+
+def _candidate_line(p):
+    seen = f"{len(p['chunks'])} bloques" if p.get('chunks') else '-'
+    return f"- {p['description']} | {p['recurrence']} | {p['persistence']} | {p['pressure_context']} | {p['contradictions']} | {seen}"
+
+def _map_reduce_patterns(case_id, mode, use_cache):
+    """Generador: produce ('map'|'reduce', progreso) y devuelve los patrones
+    consolidados junto con los tokens enviados en todas las llamadas."""
+    spec = PHASES['patterns']
+    inputs = db.get_case_inputs(case_id)
+    if not inputs:
+        raise PhaseError('No hay inputs para analizar', 400)
+    try:
+        map_budget = budget.chunk_budget(mode, budget.estimate_tokens(_render_prompt('pattern_detection.md', inputs_text=''), mode))
+        reduce_budget = budget.chunk_budget(mode, budget.estimate_tokens(_render_prompt('pattern_reduce.md', patterns_text=''), mode))
+    except ValueError as e:
+        raise PhaseError(str(e), 500)
+    chunks = budget.split_by_budget([_input_line(i) for i in reversed(inputs)], map_budget, mode)
+    usage = {'prompt': 0, 'calls': 0}
+
+    def send(prompt, phase):
+        # Los bloques pueden ir en paralelo; el GIL hace atómicas estas sumas de enteros pequeñas
+        usage['prompt'] += budget.estimate_tokens(prompt, mode)
+        usage['calls'] += 1
+        return _parse_patterns(_call_model(prompt, mode, spec, phase, use_cache))
+
+    def extract(lines):
+        return send(_render_prompt('pattern_detection.md', inputs_text="\n".join(lines)), 'patterns_map')
+
+    found = []
+    for done, (n, patterns) in enumerate(_run_chunks(extract, chunks, mode), start=1):
+        found.extend((n, p) for p in patterns)
+        yield 'map', {'completed': done, 'total': len(chunks), 'inputs': len(inputs)}
+    candidates = _merge_duplicates(sorted(found, key=lambda item: item[0]))
+    if len(chunks) < 2 or len(candidates) < 2:
+        return [_pattern_row(p) for p in candidates], usage
+
+    def consolidate(lines):
+        return send(_render_prompt('pattern_reduce.md', patterns_text="\n".join(lines)), 'patterns_reduce')
+
+    # Si la lista de candidatos no cabe en un prompt se consolida por grupos, en varias rondas
+    for round_no in range(1, REDUCE_ROUNDS + 1):
+        groups = budget.split_by_budget([_candidate_line(p) for p in candidates], reduce_budget, mode)
+        yield 'reduce', {'round': round_no, 'candidates': len(candidates), 'groups': len(groups)}
+        merged = []
+        for _, patterns in sorted(_run_chunks(consolidate, groups, mode), key=lambda item: item[0]):
+            merged.extend(_pattern_row(p) for p in patterns)
+        if not merged:
+            break
+        shrunk = len(merged) < len(candidates)
+        candidates = merged
+        if len(groups) == 1 or not shrunk:
+            break
+    return [_pattern_row(p) for p in candidates], usage
+
+def _needs_chunks(phase, system_prompt, mode):
+    return 'map_reduce' in PHASES[phase] and budget.estimate_tokens(system_prompt, mode) > budget.prompt_limit(mode)
+
+# --- FASE 9: Re-análisis incremental de patrones ---
+# Solo se envían los inputs posteriores a la marca de agua del último análisis,
+# junto con un resumen de una línea por patrón existente. Los patrones tienen
+# al menos la mitad del presupuesto; si los inputs nuevos no caben en el
+# resto, se reparten en bloques como en la detección completa.
+
+def _update_inputs(case_id):
+    inputs = db.get_inputs_since(case_id, db.get_analyzed_watermark(case_id))
+    if not inputs:
+        raise PhaseError('No hay inputs nuevos desde el último análisis', 400)
+    return [_input_line(i) for i in inputs]
+
+def _update_available(mode):
+    """Tokens para patrones existentes más inputs nuevos en un prompt de pattern_update.md."""
+    template = _render_prompt('pattern_update.md', existing_patterns_text='', new_inputs_text='')
+    try:
+        return budget.chunk_budget(mode, budget.estimate_tokens(template, mode))
+    except ValueError as e:
+        raise PhaseError(str(e), 500)
+
+def _existing_patterns_text(refs, max_tokens, mode):
+    """Un resumen por patrón existente, recortado a ``max_tokens``: (texto, recortes)."""
+    items = []
+    for n, p in enumerate(refs, start=1):
+        contradictions = '' if str(p['contradictions'] or '').strip().lower() in ('', 'ninguna') else f" | {p['contradictions']}"
+        items.append(budget.Item(f"ID {n}: {p['description']} | {p['recurrence']} | {p['persistence']} | {p['pressure_context']}{contradictions}",
+                                 _level(p['recurrence']), short=f"ID {n}: {p['description']} | {p['recurrence']}"))
+    return budget.fit([(None, items)], max_tokens, mode)
+
+def _prepare_patterns_update(case_id, mode, refs):
+    lines = _update_inputs(case_id)
+    available = _update_available(mode)
+    inputs_tokens = sum(budget.estimate_tokens(line, mode) + 1 for line in lines)
+    # Si los inputs no caben junto a los patrones, el prompt supera el límite y la fase va por bloques
+    existing_text, trimmed = _existing_patterns_text(refs, max(available - inputs_tokens, available // 2), mode)
+    return _render_prompt('pattern_update.md', existing_patterns_text=existing_text,
+                          new_inputs_text="\n".join(lines)), trimmed
+
+def _map_patterns_update(case_id, mode, use_cache, refs):
+    """Generador: produce ('map', progreso) por bloque de inputs nuevos y devuelve
+    los patrones de todos los bloques junto con los tokens enviados.
+
+    Cada bloque lleva los mismos patrones existentes, así que un patrón que
+    cambia en varios bloques se fusiona al guardar por su id.
+    """
+    spec = PHASES['patterns_update']
+    lines = _update_inputs(case_id)
+    available = _update_available(mode)
+    existing_text, _ = _existing_patterns_text(refs, available // 2, mode)
+    chunks = budget.split_by_budget(lines, available - budget.estimate_tokens(existing_text, mode), mode)
+    usage = {'prompt': 0, 'calls': 0}
+
+    def extract(chunk):
+        prompt = _render_prompt('pattern_update.md', existing_patterns_text=existing_text, new_inputs_text="\n".join(chunk))
+        usage['prompt'] += budget.estimate_tokens(prompt, mode)
+        usage['calls'] += 1
+        return _parse_patterns(_call_model(prompt, mode, spec, 'patterns_update_map', use_cache))
+
+    found = []
+    for done, (n, patterns) in enumerate(_run_chunks(extract, chunks, mode), start=1):
+        found.extend((n, p) for p in patterns)
+        yield 'map', {'completed': done, 'total': len(chunks), 'inputs': len(lines)}
+    return [p for _, p in sorted(found, key=lambda item: item[0])], usage
+
+def _save_patterns_update(case_id, patterns, plan):
+    created, updated = _apply_patterns(case_id, plan)
+    return {'message': 'Análisis incremental completado', 'patterns': patterns,
+            'created': created, 'updated': updated, 'changed': bool(created or updated)}
+
+# --- FASE 3: Vinculación Ejes ---
+
+def _prepare_link_axes(case_id, mode, refs):
+    if not refs:
+        raise PhaseError('No hay patrones para analizar', 400)
+    items = [budget.Item(f"ID {n}: {p['description']} (Recurrencia: {p['recurrence']})", _level(p['recurrence']),
+                         short=f"ID {n}: {budget.truncate_to_tokens(p['description'], 30)}")
+             for n, p in enumerate(refs, start=1)]
+    return _fit_prompt('axis_linking.md', 'patterns_text', [(None, items)], mode)
+
+def _parse_link_axes(content):
+    result_json = _load_json(content)
+    assignments = result_json.get('assignments', result_json) if isinstance(result_json, dict) else result_json
+    # Ensure assignments is a list
+    if isinstance(assignments, dict):
+        assignments = [assignments]
+    if not isinstance(assignments, list):
+        raise PhaseError(f'La IA devolvió un formato inesperado: {type(assignments)}', 500)
+    return assignments
+
+def _save_link_axes(case_id, assignments, refs):
+    current = {p['id']: p for p in db.get_case_patterns(case_id)}
+    valid = []
+    for a in assignments:
+        # Skip if not a dict (avoids "string indices" error)
+        if not isinstance(a, dict):
+            print(f"Skipping invalid assignment item: {a}")
+            continue
+        pattern = _pattern_by_ref(refs, a.get('pattern_id'), current)  # id corto del prompt -> patrón
+        axis_name = a.get('axis_name')
+        if not pattern or not axis_name:
+            print(f"Skipping incomplete assignment: {a}")
+            continue
+        valid.append({'pattern_id': pattern['id'], 'axis_name': axis_name, 'justification': a.get('justification')})
+
+    # Se vinculan todos los patrones del caso: la nueva vinculación sustituye a la anterior
+    saved_count = db.replace_axis_assignments(case_id, valid)
+    return {'status': 'success', 'assignments': assignments, 'saved_count': saved_count}
+
+# --- FASE 4: Dimensiones ---
+
+def _prepare_dimensions(case_id, mode):
+    assigns = db.get_axis_assignments(case_id)
+    if not assigns:
+        raise PhaseError('No hay vinculaciones de ejes para analizar. Completa la Fase 3 primero.', 400)
+    # get_axis_assignments ya incluye la descripción del patrón (JOIN); se agrupan por eje
+    recurrence = {p['id']: _level(p['recurrence']) for p in db.get_case_patterns(case_id)}
+    by_axis = {}
+    seen = set()
+    for a in assigns:
+        p_desc = a.get('pattern_description') or 'Patrón desconocido'
+        justification = _unique(a['justification'], seen)
+        line = f"- {p_desc}" + (f" | {justification}" if justification else '')
+        by_axis.setdefault(a['axis_name'], []).append(
+            budget.Item(line, recurrence.get(a['pattern_id'], 0), short=f"- {p_desc}"))
+    sections = [(f"Eje: {axis}", items) for axis, items in by_axis.items()]
+    return _fit_prompt('axis_classification.md', 'axis_assignments_text', sections, mode)
+
+def _parse_dimensions(content):
+    result_json = _load_json(content)
+    # Handle if wrapped in a key or direct list
+    states = result_json.get('axis_states', result_json) if isinstance(result_json, dict) else result_json
+    if isinstance(states, dict):
+        states = [states] # Handle single object edge case
+    if not isinstance(states, list):
+        raise PhaseError(f'Formato de respuesta inesperado: {type(states)}', 500)
+    return states
+
+def _save_dimensions(case_id, states):
+    valid = []
+    for s in states:
+        if not isinstance(s, dict): continue
+        axis_name = s.get('axis_name')
+        if not axis_name:
+            print(f"Skipping state without axis_name: {s}")
+            continue
+        valid.append({'axis_name': axis_name, 'status': s.get('status', 'No definido'), 'value': s.get('value', ''), 'justification': s.get('justification', '')})
+
+    saved_count = db.replace_axis_states(case_id, valid)
+    return {'status': 'success', 'states': states, 'saved_count': saved_count}
+
+# --- FASE 5: Tensiones ---
+
+def _prepare_tensions(case_id, mode):
+    states = db.get_axis_states(case_id)
+    if not states:
+        raise PhaseError('No hay estados de ejes definidos. Completa la Fase 4 primero.', 400)
+    seen = set()
+    items = []
+    for s in states:
+        justification = _unique(s['justification'], seen)
+        line = f"- {s['axis_name']}: {s['value']} (Estado: {s['status']})"
+        # Los ejes sin definir aportan menos a las tensiones y se abrevian antes
+        items.append(budget.Item(line + (f" | {justification}" if justification else ''),
+                                 0 if s['status'] == 'No definido' else 1, short=line))
+    return _fit_prompt('tension_detection.md', 'axis_states_text', [(None, items)], mode)
+
+def _parse_tensions(content):
+    result_json = _load_json(content)
+    tensions = result_json.get('tensions', result_json) if isinstance(result_json, dict) else result_json
+    if isinstance(tensions, dict): tensions = [tensions]
+    return tensions
+
+def _save_tensions(case_id, tensions):
+    try:
+        # Sustituir las tensiones anteriores en una sola transacción (evita duplicados)
+        db.replace_tensions(case_id, tensions)
+    except (KeyError, TypeError) as e:
+        raise PhaseError(f'La IA devolvió tensiones incompletas: {e}', 500)
+    return {'status': 'success', 'tensions': tensions}
+
+# --- FASE 6: Umbral ---
+
+def _summary_sections(patterns, axis_states, tensions, with_levels=True):
+    """Secciones del resumen del caso para las Fases 6 y 7 (sin justificaciones)."""
+    pattern_items = [budget.Item(f"- {p['description']}" + (f" (Recurrencia: {p['recurrence']})" if with_levels else ''),
+                                 _level(p['recurrence']), short=f"- {budget.truncate_to_tokens(p['description'], 25)}")
+                     for p in patterns]
+    # Los ejes son pocos y son la base de la evaluación: nunca se recortan antes que el resto
+    axis_items = [budget.Item(f"- {s['axis_name']}: {s['value']} ({s['status']})", 10) for s in axis_states]
+    tension_items = [budget.Item(f"- {t['description']}" + (f" (Severidad: {t['severity']})" if with_levels else ''),
+                                 _level(t['severity']), short=f"- {budget.truncate_to_tokens(t['description'], 25)}")
+                     for t in tensions]
+    return [("PATRONES:", pattern_items), ("EJES:", axis_items), ("TENSIONES:", tension_items)]
+
+def _prepare_threshold(case_id, mode):
+    patterns = db.get_case_patterns(case_id)
+    axis_states = db.get_axis_states(case_id)
+    tensions = db.get_case_tensions(case_id)
+    if not axis_states:
+        raise PhaseError('Faltan datos de ejes. Completa fases anteriores.', 400)
+    return _fit_prompt('threshold_evaluation.md', 'case_summary_text', _summary_sections(patterns, axis_states, tensions), mode)
+
+def _parse_threshold(content):
+    result_json = _load_json(content)
+    # Handle potential nesting
+    return result_json.get('evaluation', result_json)
+
+def _save_threshold(case_id, eval_data):
+    try:
+        db.save_threshold_evaluation(case_id, eval_data['score'], eval_data['status'], eval_data['reasoning'])
+    except (KeyError, TypeError) as e:
+        raise PhaseError(f'La IA devolvió una evaluación incompleta: {e}', 500)
+    return {'status': 'success', 'evaluation': eval_data}
+
+# --- FASE 7: Arquetipo ---
+
+def _prepare_archetype(case_id, mode):
+    patterns = db.get_case_patterns(case_id)
+    axis_states = db.get_axis_states(case_id)
+    tensions = db.get_case_tensions(case_id)
+    threshold = db.get_threshold_evaluation(case_id)
+    if not threshold:
+        raise PhaseError('Falta evaluación de umbral. Completa la Fase 6.', 400)
+
+    sections = _summary_sections(patterns, axis_states, tensions, with_levels=False)
+    verdict = f"Score: {threshold['score']}\nStatus: {threshold['status']}"
+    sections.append(("EVALUACIÓN DE UMBRAL:", [
+        budget.Item(verdict, 10),
+        budget.Item(f"Reasoning: {threshold['reasoning']}", 5,
+                    short=f"Reasoning: {budget.truncate_to_tokens(threshold['reasoning'] or '', 80)}"),
+    ]))
+    return _fit_prompt('archetype_assignment.md', 'case_summary_text', sections, mode)
+
+def _parse_archetype(content):
+    result_json = _load_json(content)
+    # Handle potential nesting
+    return result_json.get('archetype', result_json)
+
+def _save_archetype(case_id, arch_data):
+    try:
+        db.save_archetype_assignment(case_id, arch_data['archetype_name'], arch_data['description'], arch_data['fit_score'], arch_data['key_traits'])
+    except (KeyError, TypeError) as e:
+        raise PhaseError(f'La IA devolvió un arquetipo incompleto: {e}', 500)
+    return {'status': 'success', 'archetype': arch_data}
+
+# --- Registro de Fases ---
+# Además de los tres pasos, cada entrada lleva las opciones de llamada de
+# llm.build_params (el prompt de patrones no fuerza format='json' en Ollama).
+# Las fases de patrones registran la marca de agua de inputs al guardar; su
+# paso ``plan`` (embeddings y fusiones) corre antes de la transacción de save.
+# Las fases con ``short_ids`` nombran los patrones por su posición: prepare,
+# map_reduce y plan (o save) reciben la misma lista (``refs``), leída una sola vez.
+
+PHASES = {
+    'patterns': {
+        'prepare': _prepare_patterns, 'parse': _parse_patterns, 'plan': _plan_patterns, 'save': _save_patterns,
+        'map_reduce': _map_reduce_patterns,
+        'temperature': 0.2, 'local_role': 'user', 'local_json': False,
+        'local_suffix': "\n\nIMPORTANTE: Responde ÚNICAMENTE con el JSON válido. Sin markdown, sin explicaciones.",
+    },
+    'patterns_update': {
+        'prepare': _prepare_patterns_update, 'parse': _parse_patterns, 'plan': _plan_patterns,
+        'save': _save_patterns_update,
+        'map_reduce': _map_patterns_update, 'short_ids': True,
+        'temperature': 0.2, 'local_role': 'user', 'local_json': False,
+        'local_suffix': "\n\nIMPORTANTE: Responde ÚNICAMENTE con el JSON válido. Sin markdown, sin explicaciones.",
+    },
+    'link_axes': {
+        'prepare': _prepare_link_axes, 'parse': _parse_link_axes, 'save': _save_link_axes,
+        'short_ids': True, 'local_role': 'user',
+    },
+    'dimensions': {
+        'prepare': _prepare_dimensions, 'parse': _parse_dimensions, 'save': _save_dimensions,
+        'local_role': 'user',
+    },
+    'tensions': {
+        'prepare': _prepare_tensions, 'parse': _parse_tensions, 'save': _save_tensions,
+    },
+    'threshold': {
+        'prepare': _prepare_threshold, 'parse': _parse_threshold, 'save': _save_threshold,
+    },
+    'archetype': {
+        'prepare': _prepare_archetype, 'parse': _parse_archetype, 'save': _save_archetype,
+    },
+}
+
+WATERMARKED_PHASES = ('patterns', 'patterns_update')
+
+def _refs(spec, case_id):
+    """Argumentos extra de prepare, map_reduce y plan (o save): la lista de patrones de los ids cortos."""
+    return (_ordered_patterns(case_id),) if spec.get('short_ids') else ()
+
+def _save(phase, spec, case_id, items, watermark, tokens, refs):
+    if phase not in WATERMARKED_PHASES:
+        result = spec['save'](case_id, items, *refs)
+    else:
+        # Las decisiones de fusión se calculan fuera; dentro de la transacción solo se escribe.
+        # Los patrones y la marca de agua se guardan juntos: si falla uno, los inputs siguen pendientes
+        plan = spec['plan'](case_id, items, *refs)
+        with db.transaction():
+            result = spec['save'](case_id, items, plan)
+            previous = db.get_analyzed_watermark(case_id)
+            result['new_inputs'] = db.count_inputs_since(case_id, previous) - db.count_inputs_since(case_id, watermark)
+            db.record_analysis_run(case_id, phase, watermark, result['new_inputs'],
+                                   result.get('created', 0), result.get('updated', 0))
+    result['tokens'] = tokens
+    return result
+
+def _tokens(system_prompt, trimmed, mode, usage=None):
+    """Resumen de tokens del prompt (estimados) que acompaña al resultado de cada fase."""
+    tokens = {'prompt': budget.estimate_tokens(system_prompt, mode), 'budget': budget.prompt_budget(mode), 'trimmed': trimmed}
+    if usage:
+        tokens.update(prompt=usage['prompt'], calls=usage['calls'], chunked=True)
+    return tokens
+
+def run_phase(phase, case_id, mode='local', use_cache=True):
+    """Ejecuta una fase completa (prompt → modelo → parseo → DB) y devuelve su resultado."""
+    spec = PHASES[phase]
+    # Se lee antes de preparar el prompt: un input que llegue durante la llamada queda pendiente
+    watermark = db.get_input_watermark(case_id) if phase in WATERMARKED_PHASES else None
+    refs = _refs(spec, case_id)
+    system_prompt, trimmed = spec['prepare'](case_id, mode, *refs)
+    usage = None
+    if _needs_chunks(phase, system_prompt, mode):
+        import jobs
+        steps = spec['map_reduce'](case_id, mode, use_cache, *refs)
+        while True:
+            try:
+                step, progress = next(steps)
+            except StopIteration as stop:
+                items, usage = stop.value
+                break
+            jobs.report_progress(phase=phase, step=step, **progress)
+    else:
+        content = _call_model(system_prompt, mode, spec, phase, use_cache)
+        items = spec['parse'](content)
+    return _save(phase, spec, case_id, items, watermark, _tokens(system_prompt, trimmed, mode, usage), refs)
+
+def stream_phase(phase, case_id, mode='local', use_cache=True):
+    """Versión en streaming de run_phase: genera eventos (nombre, datos).
+
+    'token' por cada fragmento del modelo, 'item' por cada elemento JSON ya
+    completo, 'queue' mientras espera turno en el modelo local, y al final 'done' con el resultado guardado en la DB (o
+    'phase_error' si algo falla).
+    """
+    try:
+        spec = PHASES[phase]
+        watermark = db.get_input_watermark(case_id) if phase in WATERMARKED_PHASES else None
+        refs = _refs(spec, case_id)
+        system_prompt, trimmed = spec['prepare'](case_id, mode, *refs)
+        yield 'start', {'phase': phase, 'mode': mode}
+
+        if _needs_chunks(phase, system_prompt, mode):
+            # Por bloques no hay tokens que retransmitir: se informa del avance de cada bloque
+            steps = spec['map_reduce'](case_id, mode, use_cache, *refs)
+            while True:
+                try:
+                    step, progress = next(steps)
+                except StopIteration as stop:
+                    items, usage = stop.value
+                    break
+                yield 'progress', dict(progress, step=step)
+            for item in items:
+                yield 'item', item
+            yield 'done', _save(phase, spec, case_id, items, watermark, _tokens(system_prompt, trimmed, mode, usage), refs)
+            return
+
+        scanner = JsonItemScanner()
+        parts = []
+        for text in _stream_model(system_prompt, mode, spec, phase, use_cache):
+            if isinstance(text, llm.QueueStatus):
+                # Esperando turno en la cola de Ollama
+                yield 'queue', dict(text)
+                continue
+            parts.append(text)
+            yield 'token', {'text': text}
+            for item in scanner.feed(text):
+                yield 'item', item
+
+        items = spec['parse'](''.join(parts))
+        yield 'done', _save(phase, spec, case_id, items, watermark, _tokens(system_prompt, trimmed, mode), refs)
+    except PhaseError as e:
+        yield 'phase_error', {'error': e.message, 'status': e.status}
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        yield 'phase_error', {'error': f"Error interno: {str(e)}", 'status': 500}
@@ -0,0 +1,153 @@
+"""Pipeline completo de un caso (Fases 2 → 7) como grafo de dependencias.
+
+Cada etapa es una fase de phases.PHASES y se guarda en la DB al terminar,
+igual que cuando se lanza desde la UI. Si una etapa falla, las que dependen
+de ella se marcan como omitidas; si la evaluación de umbral no alcanza el
+mínimo, no se asigna arquetipo.
+"""
+import os
+import time
+import database as db
+import jobs
+import phases
+
+# etapa -> etapas de las que depende
+STAGES = {
+    'patterns': [],
+    'link_axes': ['patterns'],
+    'dimensions': ['link_axes'],
+    'tensions': ['dimensions'],
+    'threshold': ['dimensions', 'tensions'],
+    'archetype': ['threshold'],
+}
+
+THRESHOLD_MIN_SCORE = int(os.getenv('PHENOMA_THRESHOLD_MIN_SCORE', '61'))
+
+def stage_order(stages=STAGES, start=None):
+    """Orden topológico de las etapas; con ``start``, solo esa etapa y sus descendientes."""
+    selected = set(stages)
+    if start is not None:
+        if start not in stages:
+            raise phases.PhaseError(f'Etapa desconocida: {start}', 400)
+        selected = {start}
+        changed = True
+        while changed:
+            changed = False
+            for name, deps in stages.items():
+                if name not in selected and selected.intersection(deps):
+                    selected.add(name)
+                    changed = True
+
+    order = []
+    done = set()
+    while len(order) < len(selected):
+        ready = [name for name in stages
+                 if name in selected and name not in done
+                 and all(d in done or d not in selected for d in stages[name])]
+        if not ready:
+            raise phases.PhaseError('Dependencias cíclicas en el pipeline', 500)
+        for name in ready:
+            order.append(name)
+            done.add(name)
+    return order
+
+def threshold_reached(evaluation):
+    status = str(evaluation.get('status', '')).strip().lower()
+    if status in ('apto', 'umbral alcanzado'):
+        return True
+    if status.startswith('no') or status == 'dudoso':
+        return False
+    try:
+        return int(evaluation.get('score', 0)) >= THRESHOLD_MIN_SCORE
+    except (TypeError, ValueError):
+        return False
+
+def resume_stage(bundle):
+    """Primera etapa que falta en el caso, o None si el pipeline está completo.
+
+    Las tensiones pueden ser legítimamente cero, así que la falta de evaluación
+    de umbral es lo que indica que las etapas finales no se completaron.
+    """
+    if not bundle['patterns']:
+        return 'patterns'
+    if not bundle['axis_assignments']:
+        return 'link_axes'
+    if not bundle['axis_states']:
+        return 'dimensions'
+    if not bundle['threshold']:
+        return 'tensions'
+    if not bundle['archetype'] and threshold_reached(bundle['threshold']):
+        return 'archetype'
+    return None
+
+def run_pipeline(case_id, mode='local', start=None, use_cache=True):
+    """Ejecuta las etapas en orden y devuelve el estado y duración de cada una."""
+    order = stage_order(STAGES, start)
+    results = {name: {'status': 'pending'} for name in order}
+    blocked = {}  # etapa -> motivo por el que no se ejecuta
+    started = time.perf_counter()
+
+    def publish(current=None):
+        jobs.report_progress(case_id=case_id, current=current, order=order, stages=results,
+                             completed=sum(1 for r in results.values() if r['status'] == 'done'),
+                             total=len(order))
+
+    for name in order:
+        reason = next((blocked[d] for d in STAGES[name] if d in blocked), None)
+        if reason:
+            results[name] = {'status': 'skipped', 'reason': reason}
+            blocked[name] = reason
+            continue
+
+        results[name] = {'status': 'running'}
+        publish(name)
+        stage_start = time.perf_counter()
+        try:
+            output = phases.run_phase(name, case_id, mode, use_cache)
+        except phases.PhaseError as e:
+            results[name] = {'status': 'error', 'error': e.message, 'seconds': round(time.perf_counter() - stage_start, 2)}
+            blocked[name] = f'Falló la etapa {name}'
+            continue
+        results[name] = {'status': 'done', 'seconds': round(time.perf_counter() - stage_start, 2)}
+
+        if name == 'threshold' and not threshold_reached(output.get('evaluation') or {}):
+            results[name]['threshold_reached'] = False
+            blocked[name] = 'Umbral no alcanzado'
+
+    publish()
+    failed = [n for n, r in results.items() if r['status'] == 'error']
+    return {
+        'status': 'error' if failed else 'success',
+        'case_id': case_id,
+        'mode': mode,
+        'stages': results,
+        'order': order,
+        'stopped_reason': next(iter(blocked.values()), None),
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+def run_incremental(case_id, mode='local', use_cache=True):
+    """Fase 9: analiza solo los inputs nuevos y recalcula lo posterior si los patrones cambian."""
+    started = time.perf_counter()
+    pending = db.count_inputs_since(case_id, db.get_analyzed_watermark(case_id))
+    summary = {'status': 'success', 'case_id': case_id, 'mode': mode, 'new_inputs': pending,
+               'patterns': None, 'downstream': None}
+    if not pending:
+        summary['seconds'] = round(time.perf_counter() - started, 2)
+        return summary
+
+    if not db.get_case_patterns(case_id):
+        # Caso sin patrones: no hay nada que fusionar, se ejecuta el pipeline completo
+        summary['downstream'] = run_pipeline(case_id, mode, use_cache=use_cache)
+        summary['status'] = summary['downstream']['status']
+        summary['seconds'] = round(time.perf_counter() - started, 2)
+        return summary
+
+    jobs.report_progress(case_id=case_id, current='patterns_update', new_inputs=pending)
+    result = phases.run_phase('patterns_update', case_id, mode, use_cache)
+    summary['patterns'] = {k: result.get(k) for k in ('created', 'updated', 'changed', 'new_inputs')}
+    if result['changed']:
+        summary['downstream'] = run_pipeline(case_id, mode, start='link_axes', use_cache=use_cache)
+        summary['status'] = summary['downstream']['status']
+    summary['seconds'] = round(time.perf_counter() - started, 2)
+    return summary
@@ -0,0 +1,112 @@
+"""Registro de plantillas de prompt (carpeta prompts/).
+
+Las plantillas se cargan una vez al importar, se validan contra sus
+placeholders declarados y se precompilan en segmentos literales, así que
+render() solo concatena. Una plantilla se vuelve a leer únicamente si su mtime
+cambia; si la versión nueva no es válida se mantiene la anterior.
+"""
+import os
+import re
+import hashlib
+import threading
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts')
+
+# Placeholders que debe contener cada plantilla. Se sustituyen literalmente
+# (no con str.format) porque los prompts incluyen ejemplos JSON con llaves.
+TEMPLATES = {
+    'pattern_detection.md': ('inputs_text',),
+    'pattern_update.md': ('existing_patterns_text', 'new_inputs_text'),
+    'pattern_reduce.md': ('patterns_text',),
+    'axis_linking.md': ('patterns_text',),
+    'axis_classification.md': ('axis_assignments_text',),
+    'tension_detection.md': ('axis_states_text',),
+    'threshold_evaluation.md': ('case_summary_text',),
+    'archetype_assignment.md': ('case_summary_text',),
+}
+
+PLACEHOLDER_RE = re.compile(r'\{([a-z_]+)\}')
+
+class PromptError(Exception):
+    pass
+
+class PromptTemplate:
+    def __init__(self, name, text, mtime, placeholders):
+        self.name = name
+        self.text = text
+        self.mtime = mtime
+        self.placeholders = placeholders
+        self.hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+        found = PLACEHOLDER_RE.findall(text)
+        missing = [p for p in placeholders if p not in found]
+        unknown = sorted({p for p in found if p not in placeholders})
+        if missing:
+            raise PromptError(f"La plantilla {name} no contiene: {', '.join('{' + p + '}' for p in missing)}")
+        if unknown:
+            raise PromptError(f"La plantilla {name} usa placeholders no declarados: {', '.join('{' + p + '}' for p in unknown)}")
+
+        # Segmentos alternos: literal, nombre, literal, nombre, ..., literal
+        self._segments = PLACEHOLDER_RE.split(text)
+
+    def render(self, **values):
+        missing = [p for p in self.placeholders if p not in values]
+        if missing:
+            raise PromptError(f"Faltan valores para {self.name}: {', '.join(missing)}")
+        out = self._segments[:]
+        for i in range(1, len(out), 2):
+            out[i] = str(values[out[i]])
+        return ''.join(out)
+
+    def info(self):
+        return {'name': self.name, 'hash': self.hash, 'mtime': self.mtime, 'placeholders': list(self.placeholders)}
+
+_templates = {}
+_lock = threading.Lock()
+
+def _read(name):
+    path = os.path.join(PROMPTS_DIR, name)
+    mtime = os.stat(path).st_mtime
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    return PromptTemplate(name, text, mtime, TEMPLATES.get(name, ()))
+
+def load_all():
+    """Carga y valida todas las plantillas registradas (falla en el arranque si alguna es inválida)."""
+    loaded = {name: _read(name) for name in TEMPLATES}
+    with _lock:
+        _templates.update(loaded)
+    return list(loaded)
+
+def get(name):
+    """Devuelve la plantilla, recargándola si el fichero ha cambiado desde la última lectura."""
+    template = _templates.get(name)
+    try:
+        mtime = os.stat(os.path.join(PROMPTS_DIR, name)).st_mtime
+    except FileNotFoundError:
+        if template is None:
+            raise PromptError(f"Prompt no encontrado: {name}")
+        return template
+    if template is None or mtime != template.mtime:
+        try:
+            fresh = _read(name)
+        except (PromptError, OSError) as e:
+            if template is None:
+                raise PromptError(str(e))
+            print(f"Aviso: no se recarga {name}, se mantiene la versión anterior: {e}")
+            return template
+        with _lock:
+            _templates[name] = fresh
+        template = fresh
+    return template
+
+def render(name, **values):
+    return get(name).render(**values)
+
+def template_hash(name):
+    return get(name).hash
+
+def list_templates():
+    return [get(name).info() for name in TEMPLATES]
+
+load_all()
@@ -0,0 +1,209 @@
+"""Límite de peticiones a OpenAI compartido por todos los procesos y reintentos con backoff.
+
+Dos cubos de fichas por proveedor en la tabla ``rate_buckets``: peticiones por
+minuto y tokens por minuto. Cada llamada reserva una petición y los tokens
+estimados (prompt + respuesta máxima) dentro de una transacción BEGIN
+IMMEDIATE, así que los workers de gunicorn y el CLI se coordinan con el
+bloqueo de escritura de SQLite; si no hay fichas, se espera fuera de la
+transacción lo que tarden en reponerse. Un 429 con Retry-After pausa a todos
+los procesos hasta ese momento, no solo al que lo recibió.
+"""
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+import budget
+import database as db
+
+# 0 desactiva el límite correspondiente
+LIMITS = {
+    'openai': {
+        'rpm': int(os.getenv('PHENOMA_OPENAI_RPM', '500')),
+        'tpm': int(os.getenv('PHENOMA_OPENAI_TPM', '30000')),
+    },
+}
+MAX_RETRIES = int(os.getenv('PHENOMA_CLOUD_RETRIES', '5'))
+BACKOFF_BASE = float(os.getenv('PHENOMA_BACKOFF_BASE', '1'))
+BACKOFF_MAX = float(os.getenv('PHENOMA_BACKOFF_MAX', '60'))
+# Ráfaga permitida, en segundos de límite: OpenAI reparte el límite por minuto en
+# ventanas más cortas, así que un cubo lleno con un minuto entero de fichas
+# dejaría pasar ráfagas que acaban en 429
+BURST_SECONDS = float(os.getenv('PHENOMA_RATE_BURST_SECONDS', '1'))
+# Espera máxima por fichas antes de rendirse (la petición HTTP del usuario sigue abierta)
+MAX_WAIT = float(os.getenv('PHENOMA_RATE_MAX_WAIT', '120'))
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+_counters_lock = threading.Lock()
+_counters = {'retries': 0, 'throttled': 0, 'waited_seconds': 0.0}
+
+def _count(name, amount=1):
+    with _counters_lock:
+        _counters[name] += amount
+
+class RateLimitExceeded(Exception):
+    def __init__(self, wait):
+        super().__init__(f'Sin capacidad durante los próximos {wait:.0f}s')
+        self.wait = wait
+
+def request_tokens(params):
+    """Tokens que la petición consume del límite: prompt más la respuesta máxima."""
+    text = '\n'.join(str(m.get('content') or '') for m in params.get('messages', []))
+    return budget.estimate_tokens(text, 'cloud') + params.get('max_tokens', budget.RESPONSE_TOKENS)
+
+def response_tokens(params, text):
+    """Estimación del consumo real cuando la API no lo informa: prompt más la respuesta recibida."""
+    return request_tokens(dict(params, max_tokens=0)) + budget.estimate_tokens(text, 'cloud')
+
+def _burst(limit):
+    return max(1.0, limit * BURST_SECONDS / 60)
+
+def _level(row, limit, now):
+    # Reposición continua a ``limit`` fichas por minuto, hasta el tamaño de ráfaga
+    if row is None:
+        return _burst(limit)
+    return min(_burst(limit), row['tokens'] + (now - row['updated_at']) * limit / 60)
+
+def _take(provider, tokens):
+    """Reserva las fichas si hay; si no, devuelve los segundos que faltan.
+
+    Una petición mayor que la ráfaga pasa en cuanto el cubo está lleno y lo deja
+    en negativo: la deuda retrasa a las siguientes y el ritmo medio se respeta.
+    """
+    limits = LIMITS.get(provider, {})
+    now = time.time()
+    with db.transaction() as conn:
+        rows = {row['name']: row for row in conn.execute(
+            'SELECT * FROM rate_buckets WHERE name IN (?, ?)', (f'{provider}:rpm', f'{provider}:tpm'))}
+        wait = 0.0
+        levels = []
+        for kind, limit in limits.items():
+            name = f'{provider}:{kind}'
+            row = rows.get(name)
+            if row is not None:
+                wait = max(wait, row['blocked_until'] - now)
+            if limit <= 0:
+                continue
+            cost = tokens if kind == 'tpm' else 1
+            level = _level(row, limit, now)
+            wait = max(wait, (min(cost, _burst(limit)) - level) * 60 / limit)
+            levels.append((name, level - cost, now))
+        if wait > 0:
+            return wait
+        conn.executemany('''INSERT INTO rate_buckets (name, tokens, updated_at) VALUES (?, ?, ?)
+                            ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at''',
+                         levels)
+    return 0.0
+
+def acquire(provider, tokens, max_wait=None):
+    """Espera hasta poder hacer una petición de ``tokens`` y devuelve los segundos esperados."""
+    max_wait = MAX_WAIT if max_wait is None else max_wait
+    waited = 0.0
+    while True:
+        wait = _take(provider, tokens)
+        if wait <= 0:
+            return waited
+        if waited + wait > max_wait:
+            raise RateLimitExceeded(wait)
+        # Un poco de jitter para que los procesos en espera no despierten a la vez
+        wait += random.uniform(0, min(0.25, wait))
+        time.sleep(wait)
+        waited += wait
+        _count('waited_seconds', wait)
+
+def settle(provider, reserved, used):
+    """Ajusta el cubo de tokens con el consumo real que informa la API."""
+    limit = LIMITS.get(provider, {}).get('tpm', 0)
+    if limit <= 0 or used is None:
+        return
+    with db.transaction() as conn:
+        conn.execute('UPDATE rate_buckets SET tokens = MIN(?, tokens + ?) WHERE name = ?',
+                     (_burst(limit), reserved - used, f'{provider}:tpm'))
+
+def block(provider, seconds):
+    """Pausa las peticiones de todos los procesos durante ``seconds`` (tras un 429)."""
+    until = time.time() + seconds
+    now = time.time()
+    with db.transaction() as conn:
+        for kind, limit in LIMITS.get(provider, {}).items():
+            conn.execute('''INSERT INTO rate_buckets (name, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(name) DO UPDATE SET blocked_until = MAX(blocked_until, excluded.blocked_until)''',
+                         (f'{provider}:{kind}', _burst(limit) if limit > 0 else 0, now, until))
+
+def stats(provider):
+    """Fichas disponibles y pausa pendiente de cada cubo, más los contadores de este proceso."""
+    now = time.time()
+    rows = {row['name']: row for row in db.get_db_connection().execute(
+        'SELECT * FROM rate_buckets WHERE name LIKE ?', (f'{provider}:%',))}
+    out = {}
+    for kind, limit in LIMITS.get(provider, {}).items():
+        row = rows.get(f'{provider}:{kind}')
+        out[kind] = {'limit': limit or None, 'available': round(_level(row, limit, now), 1) if limit > 0 else None,
+                     'blocked_seconds': round(max(0.0, row['blocked_until'] - now), 1) if row else 0.0}
+    with _counters_lock:
+        out.update(_counters, waited_seconds=round(_counters['waited_seconds'], 1))
+    return out
+
+# --- Reintentos ---
+
+def status_code(error):
+    return getattr(error, 'status_code', None)
+
+def is_retryable(error):
+    if getattr(error, 'code', None) == 'insufficient_quota':
+        return False  # 429 por saldo agotado: reintentar no sirve
+    code = status_code(error)
+    if code is not None:
+        return code in RETRY_STATUS
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError')
+
+def retry_after(error):
+    """Segundos indicados por el servidor (retry-after-ms o Retry-After en segundos o fecha HTTP)."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+def backoff(attempt, after=None):
+    """Espera antes del reintento ``attempt`` (0, 1, ...): la del servidor o exponencial con jitter completo."""
+    if after is not None:
+        return min(after, BACKOFF_MAX) + random.uniform(0, BACKOFF_BASE)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def call_with_retries(provider, params, fn):
+    """Ejecuta ``fn()`` respetando el límite compartido y reintentando los errores transitorios.
+
+    Devuelve (resultado, tokens reservados).
+    """
+    tokens = request_tokens(params)
+    for attempt in range(MAX_RETRIES + 1):
+        acquire(provider, tokens)
+        try:
+            return fn(), tokens
+        except Exception as e:
+            # La petición fallida no gasta tokens: su reserva vuelve al cubo antes de reintentar
+            settle(provider, tokens, 0)
+            if attempt == MAX_RETRIES or not is_retryable(e):
+                raise
+            after = retry_after(e)
+            delay = backoff(attempt, after)
+            _count('retries')
+            if status_code(e) == 429:
+                _count('throttled')
+                block(provider, delay)
+            else:
+                time.sleep(delay)
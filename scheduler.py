@@ -0,0 +1,200 @@
+"""Cola de llamadas al modelo local (Ollama), compartida por todos los procesos.
+
+Ollama atiende OLLAMA_NUM_PARALLEL peticiones a la vez (1 por defecto) y deja
+el resto esperando dentro del servidor, sin que nadie lo vea, hasta que vence
+el timeout del cliente. Aquí cada llamada local toma un turno en la tabla
+``local_queue``: se atiende por prioridad y, a igual prioridad, por orden de
+llegada, y solo pasan a Ollama tantas como huecos tenga. Mientras espera,
+cada turno publica su posición y la espera estimada (con la duración media
+de las últimas llamadas); si con esa estimación ya no llega a su plazo, se
+rechaza en el momento en vez de fallar por timeout minutos después.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+import database as db
+
+SLOTS = max(1, int(os.getenv('PHENOMA_LOCAL_SLOTS') or os.getenv('OLLAMA_NUM_PARALLEL') or '1'))
+MAX_QUEUE = int(os.getenv('PHENOMA_LOCAL_MAX_QUEUE', '32'))
+# Plazo por petición, desde que entra en la cola hasta que termina la respuesta
+DEADLINE_SECONDS = float(os.getenv('PHENOMA_LOCAL_DEADLINE', '600'))
+# Duración supuesta de una llamada mientras no hay historial
+DEFAULT_SERVICE_SECONDS = float(os.getenv('PHENOMA_LOCAL_SERVICE_SECONDS', '30'))
+POLL_SECONDS = 0.25
+# Un turno en espera sin latido, o en curso más allá del timeout del cliente, quedó huérfano
+STALE_WAITING_SECONDS = 15
+STALE_RUNNING_SECONDS = float(os.getenv('PHENOMA_LOCAL_TIMEOUT', '300')) + 60
+HISTORY = 20
+
+# Menor valor, antes se atiende: el usuario esperando en la pantalla va primero
+PRIORITIES = {'interactive': 0, 'job': 5, 'batch': 9}
+
+_context = threading.local()
+
+class QueueRejected(Exception):
+    """La petición no cabe en la cola o no llegaría a tiempo."""
+    def __init__(self, message, eta=None):
+        super().__init__(message)
+        self.message = message
+        self.eta = eta
+
+@contextmanager
+def context(priority=None, job_id=None, deadline=None):
+    """Prioridad, trabajo y plazo (segundos) de las llamadas locales de este hilo."""
+    previous = dict(getattr(_context, 'values', {}))
+    values = dict(previous)
+    values.update({k: v for k, v in (('priority', priority), ('job_id', job_id), ('deadline', deadline))
+                   if v is not None})
+    _context.values = values
+    try:
+        yield
+    finally:
+        _context.values = previous
+
+def _current(name, default=None):
+    return getattr(_context, 'values', {}).get(name, default)
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _cleanup(conn, now):
+    rows = conn.execute("SELECT id, pid, status, heartbeat, started_at FROM local_queue WHERE status IN ('waiting', 'running')")
+    stale = [row['id'] for row in rows
+             if not _alive(row['pid'])
+             or (row['status'] == 'waiting' and now - row['heartbeat'] > STALE_WAITING_SECONDS)
+             or (row['status'] == 'running' and now - row['started_at'] > STALE_RUNNING_SECONDS)]
+    if stale:
+        conn.execute(f"DELETE FROM local_queue WHERE id IN ({', '.join('?' * len(stale))})", stale)
+    conn.execute("DELETE FROM local_queue WHERE status = 'done' AND finished_at < ?", (now - 3600,))
+
+def _service_seconds(conn):
+    row = conn.execute(f"""SELECT AVG(seconds) FROM (SELECT seconds FROM local_queue WHERE status = 'done'
+                           ORDER BY finished_at DESC LIMIT {HISTORY})""").fetchone()
+    return row[0] or DEFAULT_SERVICE_SECONDS
+
+def _estimate(conn, now, priority=None, ticket=None):
+    """(turnos por delante, segundos de espera estimados) para un turno o para uno nuevo."""
+    service = _service_seconds(conn)
+    running = conn.execute("SELECT started_at FROM local_queue WHERE status = 'running'").fetchall()
+    if ticket is None:
+        ahead = conn.execute("SELECT COUNT(*) FROM local_queue WHERE status = 'waiting' AND priority <= ?",
+                             (priority,)).fetchone()[0]
+    else:
+        ahead = conn.execute("""SELECT COUNT(*) FROM local_queue WHERE status = 'waiting'
+                                AND (priority < ? OR (priority = ? AND id < ?))""",
+                             (priority, priority, ticket)).fetchone()[0]
+    remaining = sum(max(0.0, service - (now - row['started_at'])) for row in running)
+    # Con todos los huecos libres no se espera aunque haya turnos por delante que aún no han entrado
+    busy = len(running) + ahead
+    eta = 0.0 if busy < SLOTS else (remaining + ahead * service) / SLOTS
+    return ahead + len(running), eta, service
+
+def _late(eta, service, remaining):
+    return QueueRejected(f'El modelo local no terminaría a tiempo: {eta:.0f}s de espera estimada y ~{service:.0f}s '
+                         f'de respuesta superan el plazo restante de {max(0, remaining):.0f}s', eta)
+
+def wait_turn(phase=None):
+    """Genera el estado del turno ({position, eta_seconds}) mientras espera y devuelve su id al entrar.
+
+    Lanza QueueRejected si la cola está llena o el plazo no alcanza.
+    """
+    priority = PRIORITIES.get(_current('priority', 'interactive'), 0)
+    now = time.time()
+    deadline = now + (_current('deadline') or DEADLINE_SECONDS)
+    with db.transaction() as conn:
+        _cleanup(conn, now)
+        waiting = conn.execute("SELECT COUNT(*) FROM local_queue WHERE status = 'waiting'").fetchone()[0]
+        if waiting >= MAX_QUEUE:
+            raise QueueRejected(f'La cola del modelo local está llena ({waiting} peticiones esperando)')
+        position, eta, service = _estimate(conn, now, priority)
+        if now + eta + service > deadline:
+            raise _late(eta, service, deadline - now)
+        ticket = conn.execute("""INSERT INTO local_queue (priority, phase, job_id, pid, status, enqueued_at, deadline,
+                                 heartbeat, position, eta) VALUES (?, ?, ?, ?, 'waiting', ?, ?, ?, ?, ?)""",
+                              (priority, phase, _current('job_id'), os.getpid(), now, deadline, now,
+                               position, eta)).lastrowid
+
+    last = None
+    try:
+        while True:
+            now = time.time()
+            with db.transaction() as conn:
+                _cleanup(conn, now)
+                if not conn.execute('SELECT 1 FROM local_queue WHERE id = ?', (ticket,)).fetchone():
+                    raise QueueRejected('El turno en la cola del modelo local se perdió')
+                position, eta, service = _estimate(conn, now, priority, ticket)
+                if position < SLOTS:
+                    conn.execute("UPDATE local_queue SET status = 'running', started_at = ?, position = 0, eta = 0 WHERE id = ?",
+                                 (now, ticket))
+                    return ticket
+                if now + eta + service > deadline:
+                    raise _late(eta, service, deadline - now)
+                conn.execute('UPDATE local_queue SET heartbeat = ?, position = ?, eta = ? WHERE id = ?',
+                             (now, position, eta, ticket))
+            status = {'position': position, 'eta_seconds': round(eta)}
+            if status != last:
+                last = status
+                yield status
+            time.sleep(POLL_SECONDS)
+    except BaseException:
+        # Rechazo, cliente desconectado o error: el turno no debe bloquear a los demás
+        with db.transaction() as conn:
+            conn.execute("DELETE FROM local_queue WHERE id = ? AND status = 'waiting'", (ticket,))
+        raise
+
+def acquire(phase=None):
+    turn = wait_turn(phase)
+    while True:
+        try:
+            next(turn)
+        except StopIteration as stop:
+            return stop.value
+
+def release(ticket, seconds):
+    with db.transaction() as conn:
+        conn.execute("UPDATE local_queue SET status = 'done', finished_at = ?, seconds = ? WHERE id = ?",
+                     (time.time(), seconds, ticket))
+
+@contextmanager
+def slot(phase=None):
+    """Ocupa un hueco de Ollama durante el bloque (esperando turno si hace falta)."""
+    ticket = acquire(phase)
+    start = time.perf_counter()
+    try:
+        yield ticket
+    finally:
+        release(ticket, time.perf_counter() - start)
+
+def job_status(job_id):
+    """Posición y espera del turno que un trabajo tiene en la cola, o None si no espera."""
+    row = db.get_db_connection().execute(
+        "SELECT phase, position, eta FROM local_queue WHERE job_id = ? AND status = 'waiting' ORDER BY id LIMIT 1",
+        (job_id,)).fetchone()
+    if row is None:
+        return None
+    return {'phase': row['phase'], 'position': row['position'], 'eta_seconds': round(row['eta'] or 0)}
+
+def overview():
+    """Estado de la cola para /api/llm/queue: huecos, turnos y espera estimada para uno nuevo."""
+    now = time.time()
+    with db.transaction(write=False) as conn:
+        tickets = conn.execute("""SELECT id, priority, phase, job_id, status, enqueued_at, started_at, position, eta
+                                  FROM local_queue WHERE status IN ('waiting', 'running')
+                                  ORDER BY status DESC, priority, id""").fetchall()
+        _, eta, service = _estimate(conn, now, PRIORITIES['interactive'])
+    return {
+        'slots': SLOTS,
+        'max_queue': MAX_QUEUE,
+        'running': sum(1 for t in tickets if t['status'] == 'running'),
+        'waiting': sum(1 for t in tickets if t['status'] == 'waiting'),
+        'avg_service_seconds': round(service, 1),
+        'estimated_wait_seconds': round(eta),
+        'tickets': [dict(t, waited_seconds=round(now - t['enqueued_at'], 1)) for t in tickets],
+    }
@@ -0,0 +1,63 @@
+"""Búsqueda de texto completo en todos los casos: inputs, patrones y justificaciones.
+
+Las consultas van contra los índices FTS5 de la migración 10, que los
+triggers mantienen al día con cada escritura. Lo que escribe el usuario se
+traduce a una consulta FTS5 segura (sin operadores) y los fragmentos vuelven
+como HTML escapado con las coincidencias entre <mark>.
+"""
+import re
+import html
+import time
+import database as db
+
+LIMIT = 20
+MAX_LIMIT = 100
+# Caracteres de control que no aparecen en el texto: marcan las coincidencias
+# en el fragmento hasta que se escapa el HTML y se cambian por <mark>
+_OPEN, _CLOSE = '\x02', '\x03'
+_TERM = re.compile(r'"([^"]*)"?|(\S+)')
+_WORD = re.compile(r'\w+')
+
+def build_query(text):
+    """Traduce la búsqueda del usuario a FTS5.
+
+    Las palabras sueltas tienen que aparecer todas, en cualquier orden; el texto
+    entre comillas, como frase; ``palabra*`` busca por prefijo. Los operadores
+    de FTS5 (AND, NEAR, columna:...) se tratan como texto.
+    """
+    terms = []
+    for phrase, word in _TERM.findall(text or ''):
+        tokens = _WORD.findall(phrase or word)
+        if not tokens:
+            continue
+        prefix = '*' if not phrase and word.endswith('*') else ''
+        terms.append('"' + ' '.join(tokens) + '"' + prefix)
+    return ' '.join(terms)
+
+def _highlight(snippet):
+    return html.escape(snippet or '').replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+def search(text, kinds=None, case_id=None, limit=None):
+    """Coincidencias ordenadas por relevancia en todos los casos (o en ``case_id``)."""
+    query = build_query(text)
+    if not query:
+        raise ValueError('La búsqueda está vacía')
+    unknown = [k for k in kinds or [] if k not in db.SEARCH_SOURCES]
+    if unknown:
+        raise ValueError(f"Tipo de texto desconocido: {', '.join(unknown)}")
+    try:
+        limit = LIMIT if limit in (None, '') else max(1, min(int(limit), MAX_LIMIT))
+    except (TypeError, ValueError):
+        raise ValueError('limit debe ser un entero')
+
+    start = time.perf_counter()
+    hits = db.search_text(query, kinds, case_id, limit, marks=(_OPEN, _CLOSE))
+    return {
+        'query': query,
+        'hits': [{'kind': hit['kind'], 'id': hit['id'], 'case_id': hit['case_id'],
+                  'case_identifier': hit['case_identifier'], 'detail': hit['detail'],
+                  'snippet': _highlight(hit['snippet']),
+                  'score': round(-hit['rank'], 3)}
+                 for hit in hits],
+        'took_ms': round((time.perf_counter() - start) * 1000, 1),
+    }
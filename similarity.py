@@ -0,0 +1,236 @@
+"""Casos parecidos: un vector por caso y un índice en memoria para buscar los más cercanos.
+
+Los estados de los ejes son texto libre que solo se lee caso a caso. Aquí cada
+caso se resume en un vector con cuatro bloques: los seis ejes (el valor de
+cada uno, con el vectorizador de hashing de ``embeddings``, pesado por su
+estado), la media de los vectores de sus patrones, el arquetipo y la
+puntuación de umbral. Cada bloque va normalizado y escalado por la raíz de su
+peso, así que el producto escalar de dos casos es la media ponderada de las
+similitudes coseno de cada bloque (un bloque que falta aporta 0).
+
+Los vectores viven en una matriz float32 en memoria, una por proceso. La
+migración 12 apunta en ``case_feature_changes`` la revisión en la que cambió
+cada caso; en cada búsqueda se recalculan solo los casos con revisión
+posterior a la del índice, y la consulta es un producto matriz-vector más
+argpartition.
+"""
+import math
+import time
+import threading
+import numpy as np
+import database as db
+import embeddings
+
+LIMIT = 20
+MAX_LIMIT = 100
+
+# Ejes del modelo, por la primera palabra de su nombre sin tildes ni mayúsculas
+# ("Relación con el cambio feminista" -> relacion)
+AXES = ('generacion', 'relacion', 'modelo', 'apertura', 'manejo', 'presion')
+AXIS_DIM = 32
+# Lo que cuenta el valor de un eje según su estado
+STATUS_WEIGHTS = {'definido': 1.0, 'parcial': 0.75, 'tension': 0.5, 'no definido': 0.0}
+PATTERN_DIM = 256
+ARCHETYPE_DIM = 32
+
+# Peso de cada bloque en la similitud (suman 1)
+WEIGHTS = {'axes': 0.45, 'patterns': 0.3, 'archetype': 0.1, 'threshold': 0.15}
+_SIZES = {'axes': len(AXES) * AXIS_DIM, 'patterns': PATTERN_DIM, 'archetype': ARCHETYPE_DIM, 'threshold': 2}
+BLOCKS = {}
+_offset = 0
+for _name, _size in _SIZES.items():
+    BLOCKS[_name] = slice(_offset, _offset + _size)
+    _offset += _size
+DIM = _offset
+
+# Filas de patrones que se decodifican a la vez al construir el índice
+_CHUNK = 20000
+
+def _axis_slot(name):
+    words = embeddings._fold(name).split()
+    return AXES.index(words[0]) if words and words[0] in AXES else None
+
+def _embed_unique(texts, dim):
+    """embed() de cada texto calculando una sola vez los repetidos (los valores de los ejes se repiten mucho)."""
+    unique = {}
+    positions = np.array([unique.setdefault(text or '', len(unique)) for text in texts], dtype=np.intp)
+    return embeddings.embed(list(unique), dim)[positions]
+
+def _fold(vectors):
+    """Reduce los vectores de patrones a PATTERN_DIM sumando tramos (como un hashing de segundo nivel)."""
+    pad = -vectors.shape[1] % PATTERN_DIM
+    if pad:
+        vectors = np.pad(vectors, ((0, 0), (0, pad)))
+    return vectors.reshape(len(vectors), -1, PATTERN_DIM).sum(axis=1)
+
+def _score(value):
+    try:
+        return min(max(float(value), 0.0), 100.0)
+    except (TypeError, ValueError):
+        return None
+
+def features(case_ids, data):
+    """Matriz (len(case_ids), DIM) con el vector de cada caso a partir de las filas de db.get_case_features."""
+    row_of = {case_id: n for n, case_id in enumerate(case_ids)}
+    out = np.zeros((len(case_ids), DIM), dtype=np.float32)
+
+    axes = [(row_of[r['case_id']], _axis_slot(r['axis_name']), r) for r in data['axes'] if r['case_id'] in row_of]
+    axes = [(n, slot, r) for n, slot, r in axes if slot is not None]
+    if axes:
+        weights = np.array([STATUS_WEIGHTS.get(embeddings._fold(r['status']).strip(), 0.5) for _, _, r in axes],
+                           dtype=np.float32)
+        vectors = _embed_unique([r['value'] for _, _, r in axes], AXIS_DIM) * weights[:, None]
+        block = out[:, BLOCKS['axes']].reshape(len(case_ids), len(AXES), AXIS_DIM)
+        block[[n for n, _, _ in axes], [slot for _, slot, _ in axes]] = vectors
+        out[:, BLOCKS['axes']] = block.reshape(len(case_ids), -1)
+
+    patterns = [r for r in data['patterns'] if r['case_id'] in row_of]
+    sums = np.zeros((len(case_ids), PATTERN_DIM), dtype=np.float32)
+    for start in range(0, len(patterns), _CHUNK):
+        chunk = patterns[start:start + _CHUNK]
+        stored = [r for r in chunk if r['vector'] is not None]
+        missing = [r for r in chunk if r['vector'] is None]
+        # Los patrones sin vector guardado (anteriores a la migración 11) se calculan aquí sin escribir en la DB
+        if stored:
+            np.add.at(sums, [row_of[r['case_id']] for r in stored],
+                      _fold(embeddings.from_blobs([r['vector'] for r in stored])))
+        if missing:
+            np.add.at(sums, [row_of[r['case_id']] for r in missing],
+                      _fold(_embed_unique([r['description'] for r in missing], embeddings.DIM)))
+    out[:, BLOCKS['patterns']] = sums
+
+    archetypes = [r for r in data['archetypes'] if r['case_id'] in row_of]
+    if archetypes:
+        out[[row_of[r['case_id']] for r in archetypes], BLOCKS['archetype']] = \
+            _embed_unique([r['archetype_name'] for r in archetypes], ARCHETYPE_DIM)
+
+    # La puntuación (0-100) como ángulo de 0 a 90 grados: el coseno entre dos casos
+    # baja a medida que se separan sus puntuaciones
+    for r in data['thresholds']:
+        score = _score(r['score'])
+        if r['case_id'] in row_of and score is not None:
+            angle = score / 100 * math.pi / 2
+            out[row_of[r['case_id']], BLOCKS['threshold']] = (math.cos(angle), math.sin(angle))
+
+    for name, columns in BLOCKS.items():
+        block = out[:, columns]
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        out[:, columns] = np.divide(block, norms, out=np.zeros_like(block), where=norms > 0) * math.sqrt(WEIGHTS[name])
+    return out
+
+class Index:
+    """Vectores de los casos en una matriz que crece por duplicación; ``ids`` y ``pos`` la relacionan con los casos."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.revision = None
+        self.size = 0
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.matrix = np.zeros((0, DIM), dtype=np.float32)
+        self.pos = {}
+
+    def _grow(self, needed):
+        if needed <= len(self.ids):
+            return
+        capacity = max(needed, 2 * len(self.ids), 1024)
+        ids = np.zeros(capacity, dtype=np.int64)
+        matrix = np.zeros((capacity, DIM), dtype=np.float32)
+        ids[:self.size] = self.ids[:self.size]
+        matrix[:self.size] = self.matrix[:self.size]
+        self.ids, self.matrix = ids, matrix
+
+    def _remove(self, case_id):
+        # El último ocupa el hueco para que las filas sigan contiguas
+        n = self.pos.pop(case_id, None)
+        if n is None:
+            return
+        last = self.size - 1
+        if n != last:
+            self.ids[n] = self.ids[last]
+            self.matrix[n] = self.matrix[last]
+            self.pos[int(self.ids[n])] = n
+        self.size = last
+
+    def _apply(self, changed, existing, data):
+        wanted = set(changed)
+        existing = [case_id for case_id in existing if case_id in wanted]
+        vectors = features(existing, data)
+        present = np.abs(vectors).sum(axis=1) > 0
+        keep = {case_id for case_id, ok in zip(existing, present) if ok}
+        for case_id in changed:
+            if case_id not in keep:
+                self._remove(case_id)
+        self._grow(self.size + len(keep))
+        for case_id, vector, ok in zip(existing, vectors, present):
+            if not ok:
+                continue
+            n = self.pos.get(case_id)
+            if n is None:
+                n = self.pos[case_id] = self.size
+                self.ids[n] = case_id
+                self.size += 1
+            self.matrix[n] = vector
+
+    def refresh(self):
+        """Pone el índice al día: completo la primera vez, después solo los casos que cambiaron."""
+        with self.lock:
+            if self.revision is None:
+                revision, existing, data = db.get_case_features(None, embeddings.MODEL)
+                self._apply(existing, existing, data)
+                self.revision = revision
+                return
+            revision, changed = db.get_changed_cases(self.revision)
+            if not changed:
+                return
+            # Los datos se leen después de la revisión: si entretanto cambia algo más,
+            # la siguiente pasada lo vuelve a leer
+            _, existing, data = db.get_case_features(changed, embeddings.MODEL)
+            self._apply(changed, existing, data)
+            self.revision = revision
+
+    def nearest(self, case_id, limit):
+        """[(case_id, similitud, {bloque: aporte})] de los ``limit`` casos más parecidos, o None si no está indexado."""
+        with self.lock:
+            n = self.pos.get(case_id)
+            if n is None:
+                return None
+            query = self.matrix[n].copy()
+            matrix = self.matrix[:self.size]
+            scores = matrix @ query
+            scores[n] = -np.inf
+            k = min(limit, self.size - 1)
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            parts = {name: matrix[top, columns] @ query[columns] for name, columns in BLOCKS.items()}
+            ids = self.ids[top].tolist()
+            similarities = scores[top].tolist()
+        return [(case_id, similarity, {name: float(values[i]) for name, values in parts.items()})
+                for i, (case_id, similarity) in enumerate(zip(ids, similarities))]
+
+_index = Index()
+
+def similar(case_id, limit=None):
+    """Los casos más parecidos a ``case_id``, o None si el caso aún no tiene nada con qué compararlo.
+
+    Lanza ValueError si ``limit`` no es válido.
+    """
+    try:
+        limit = LIMIT if limit in (None, '') else max(1, min(int(limit), MAX_LIMIT))
+    except (TypeError, ValueError):
+        raise ValueError('limit debe ser un entero')
+    start = time.perf_counter()
+    _index.refresh()
+    nearest = _index.nearest(case_id, limit)
+    if nearest is None:
+        return None
+    identifiers = db.get_case_identifiers([other for other, _, _ in nearest])
+    return {
+        'case_id': case_id,
+        'cases': [{'case_id': other, 'identifier': identifiers.get(other), 'similarity': round(similarity, 4),
+                   'components': {name: round(value, 4) for name, value in parts.items()}}
+                  for other, similarity, parts in nearest],
+        'indexed': _index.size,
+        'took_ms': round((time.perf_counter() - start) * 1000, 2),
+    }
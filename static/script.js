@@ -51,6 +51,64 @@ document.addEventListener('DOMContentLoaded', () => {
         alert("Error crítico al iniciar la aplicación: " + e.message);
     }
 
+    // --- LISTAS PAGINADAS (scroll infinito) ---
+    // Pide páginas ({items, next_cursor}) mientras el centinela del final de la
+    // lista esté a la vista. reset() vuelve a la primera página (al cambiar un
+    // filtro) y show(page) pinta una primera página que ya se tiene.
+    function infiniteList({ container, sentinel, url, renderItem, emptyHtml }) {
+        let cursor = null;
+        let done = true;
+        let loading = false;
+        let generation = 0;
+
+        function nearViewport() {
+            return sentinel && sentinel.getBoundingClientRect().top < window.innerHeight + 400;
+        }
+
+        function show(page, append = false) {
+            if (!append) container.innerHTML = page.items.length ? '' : emptyHtml;
+            page.items.forEach(item => container.appendChild(renderItem(item)));
+            cursor = page.next_cursor;
+            done = !cursor;
+            // Si la página no llena la pantalla el centinela sigue visible y el observer no vuelve a avisar
+            if (!done && nearViewport()) setTimeout(loadMore, 0);
+        }
+
+        async function loadMore() {
+            if (loading || done) return;
+            loading = true;
+            const current = generation;
+            try {
+                const res = await fetch(url(cursor));
+                const page = await res.json();
+                if (current !== generation) return;
+                if (!res.ok) throw new Error(page.error || res.statusText);
+                loading = false;
+                show(page, cursor !== null);
+            } catch (e) {
+                console.error("Error loading page:", e);
+                done = true;
+            } finally {
+                if (current === generation) loading = false;
+            }
+        }
+
+        function reset() {
+            generation++;
+            cursor = null;
+            done = false;
+            loading = false;
+            return loadMore();
+        }
+
+        if (sentinel && 'IntersectionObserver' in window) {
+            new IntersectionObserver(entries => {
+                if (entries.some(e => e.isIntersecting)) loadMore();
+            }, { rootMargin: '400px' }).observe(sentinel);
+        }
+        return { reset, show, loadMore };
+    }
+
     // --- DASHBOARD LOGIC ---
     function initDashboard() {
         const modal = document.getElementById('new-case-modal');
@@ -59,33 +117,96 @@ document.addEventListener('DOMContentLoaded', () => {
         const form = document.getElementById('new-case-form');
         const grid = document.getElementById('cases-grid');
 
-        // Cargar casos
-        fetch('/api/cases')
-            .then(res => res.json())
-            .then(cases => {
-                grid.innerHTML = '';
-                if (cases.length === 0) {
-                    grid.innerHTML = '<div style="color:var(--text-secondary)">No hay casos. Crea uno nuevo.</div>';
-                    return;
-                }
-                cases.forEach(c => {
-                    const card = document.createElement('div');
-                    card.className = 'case-card';
-                    card.innerHTML = `
-                        <div class="card-header">
-                            <h3>${c.identifier}</h3>
-                            <button class="delete-btn" title="Eliminar caso" onclick="event.stopPropagation(); deleteCase(${c.id})">🗑️</button>
-                        </div>
-                        <p>${c.description || 'Sin descripción'}</p>
-                        <div class="case-meta">
-                            <span>${new Date(c.created_at).toLocaleDateString()}</span>
-                            <span style="color: var(--success)">Activo</span>
-                        </div>
-                    `;
-                    card.onclick = () => window.location.href = `/case/${c.id}`;
-                    grid.appendChild(card);
-                });
+        const search = document.getElementById('cases-search');
+        const statusFilter = document.getElementById('cases-status-filter');
+        const STATUS_LABELS = {
+            empty: 'Sin inputs', new: 'Sin analizar', pending: 'Inputs nuevos',
+            incomplete: 'Incompleto', complete: 'Completo'
+        };
+
+        // Cargar casos por páginas, con los filtros en el servidor
+        const casesPager = infiniteList({
+            container: grid,
+            sentinel: document.getElementById('cases-sentinel'),
+            emptyHtml: '<div style="color:var(--text-secondary)">No hay casos. Crea uno nuevo.</div>',
+            url: cursor => {
+                const params = new URLSearchParams();
+                if (cursor) params.set('cursor', cursor);
+                if (search && search.value.trim()) params.set('identifier', search.value.trim());
+                if (statusFilter && statusFilter.value) params.set('status', statusFilter.value);
+                return `/api/cases?${params}`;
+            },
+            renderItem: c => {
+                const card = document.createElement('div');
+                card.className = 'case-card';
+                card.innerHTML = `
+                    <div class="card-header">
+                        <h3>${c.identifier}</h3>
+                        <button class="delete-btn" title="Eliminar caso" onclick="event.stopPropagation(); deleteCase(${c.id})">🗑️</button>
+                    </div>
+                    <p>${c.description || 'Sin descripción'}</p>
+                    <div class="case-meta">
+                        <span>${new Date(c.created_at).toLocaleDateString()}</span>
+                        <span style="color: ${c.status === 'complete' ? 'var(--success)' : 'var(--text-secondary)'}">${STATUS_LABELS[c.status] || 'Activo'}</span>
+                    </div>
+                `;
+                card.onclick = () => window.location.href = `/case/${c.id}`;
+                return card;
+            }
+        });
+        casesPager.reset();
+
+        let searchTimer = null;
+        if (search) search.addEventListener('input', () => {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(casesPager.reset, 300);
+        });
+        if (statusFilter) statusFilter.addEventListener('change', casesPager.reset);
+
+        // Búsqueda de texto en todos los casos (los fragmentos llegan como HTML escapado con <mark>)
+        const contentSearch = document.getElementById('content-search');
+        const searchResults = document.getElementById('search-results');
+        const KIND_LABELS = { input: 'Input', pattern: 'Patrón', axis_assignment: 'Vínculo a eje', axis_state: 'Dimensión' };
+        let contentTimer = null;
+        let lastQuery = '';
+
+        async function runSearch() {
+            const q = contentSearch.value.trim();
+            if (q === lastQuery) return;
+            lastQuery = q;
+            if (!q) {
+                searchResults.classList.add('hidden');
+                return;
+            }
+            const res = await fetch(`/api/search?${new URLSearchParams({ q })}`);
+            const data = await res.json();
+            if (q !== lastQuery) return;
+            searchResults.classList.remove('hidden');
+            if (!res.ok || data.hits.length === 0) {
+                searchResults.innerHTML = `<div style="color:var(--text-secondary)">${res.ok ? 'Sin resultados.' : (data.error || 'Error en la búsqueda')}</div>`;
+                return;
+            }
+            searchResults.innerHTML = '';
+            data.hits.forEach(hit => {
+                const item = document.createElement('a');
+                item.className = 'search-hit';
+                item.href = `/case/${hit.case_id}`;
+                item.innerHTML = `
+                    <div class="input-header">
+                        <span class="search-case"></span>
+                        <span class="input-badge">${KIND_LABELS[hit.kind] || hit.kind}${hit.detail ? ' · ' + hit.detail : ''}</span>
+                    </div>
+                    <div class="search-snippet">${hit.snippet}</div>
+                `;
+                item.querySelector('.search-case').textContent = hit.case_identifier || `Caso ${hit.case_id}`;
+                searchResults.appendChild(item);
             });
+        }
+
+        if (contentSearch) contentSearch.addEventListener('input', () => {
+            clearTimeout(contentTimer);
+            contentTimer = setTimeout(() => runSearch().catch(e => console.error("Error searching:", e)), 300);
+        });
 
         // Delete Case Handler
         window.deleteCase = async function (id) {
@@ -96,7 +217,7 @@ document.addEventListener('DOMContentLoaded', () => {
             try {
                 const res = await fetch(`/api/cases/${id}`, { method: 'DELETE' });
                 if (res.ok) {
-                    initDashboard(); // Reload list
+                    casesPager.reset(); // Reload list
                 } else {
                     const data = await res.json();
                     alert('Error: ' + (data.error || 'No se pudo eliminar'));
@@ -166,18 +287,30 @@ document.addEventListener('DOMContentLoaded', () => {
             });
         }
 
-        // Cargar Info del Caso
-        fetch(`/api/cases/${CURRENT_CASE_ID}`)
-            .then(res => res.json())
-            .then(data => {
-                const header = document.getElementById('header-case-id');
-                if (header) header.textContent = data.identifier;
-            })
-            .catch(e => console.error("Error loading case info:", e));
-
-        // Initial Load
-        loadInputs();
-        loadPatterns();
+        // Carga inicial: todas las fases del caso en una sola petición
+        function loadBundle() {
+            return fetch(`/api/cases/${CURRENT_CASE_ID}/bundle`)
+                .then(res => res.json())
+                .then(bundle => {
+                    if (bundle.error) {
+                        console.error("Error loading case:", bundle.error);
+                        return;
+                    }
+                    const header = document.getElementById('header-case-id');
+                    if (header) header.textContent = bundle.case.identifier;
+
+                    inputsPager.show({ items: bundle.inputs, next_cursor: bundle.inputs_next_cursor });
+                    renderPatterns(bundle.patterns);
+                    renderAxesAssignments(bundle.axis_assignments);
+                    renderDimensions(bundle.axis_states);
+                    renderTensions(bundle.tensions);
+                    renderThreshold(bundle.threshold);
+                    renderArchetype(bundle.archetype);
+                    renderPendingInputs(bundle.pending_inputs, bundle.patterns.length);
+                })
+                .catch(e => console.error("Error loading case bundle:", e));
+        }
+        loadBundle();
 
         // Inicializar en Fase 1
         // (Ya se hace por defecto en el HTML, pero esto asegura el estado)
@@ -221,31 +354,36 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         };
 
+        // Inputs por páginas: el bundle trae la primera y el resto llega al hacer scroll
+        const inputsTypeFilter = document.getElementById('inputs-type-filter');
+        const inputsPager = infiniteList({
+            container: inputsList,
+            sentinel: document.getElementById('inputs-sentinel'),
+            emptyHtml: '<div style="text-align:center; color:var(--text-secondary); padding: 2rem;">No hay inputs registrados. Agrega el primero.</div>',
+            url: cursor => {
+                const params = new URLSearchParams();
+                if (cursor) params.set('cursor', cursor);
+                if (inputsTypeFilter && inputsTypeFilter.value) params.set('input_type', inputsTypeFilter.value);
+                return `/api/cases/${CURRENT_CASE_ID}/inputs?${params}`;
+            },
+            renderItem: inp => {
+                const div = document.createElement('div');
+                div.className = 'input-card';
+                const meta = JSON.parse(inp.metadata || '{}');
+                div.innerHTML = `
+                    <div class="input-header">
+                        <span class="input-badge">${inp.input_type}</span>
+                        <span>${meta.date || ''}</span>
+                    </div>
+                    <div class="input-content">${inp.content}</div>
+                `;
+                return div;
+            }
+        });
+        if (inputsTypeFilter) inputsTypeFilter.addEventListener('change', inputsPager.reset);
+
         function loadInputs() {
-            fetch(`/api/cases/${CURRENT_CASE_ID}/inputs`)
-                .then(res => res.json())
-                .then(inputs => {
-                    if (!inputsList) return;
-                    inputsList.innerHTML = '';
-                    if (inputs.length === 0) {
-                        inputsList.innerHTML = '<div style="text-align:center; color:var(--text-secondary); padding: 2rem;">No hay inputs registrados. Agrega el primero.</div>';
-                        return;
-                    }
-                    inputs.forEach(inp => {
-                        const div = document.createElement('div');
-                        div.className = 'input-card';
-                        const meta = JSON.parse(inp.metadata || '{}');
-                        div.innerHTML = `
-                            <div class="input-header">
-                                <span class="input-badge">${inp.input_type}</span>
-                                <span>${meta.date || ''}</span>
-                            </div>
-                            <div class="input-content">${inp.content}</div>
-                        `;
-                        inputsList.appendChild(div);
-                    });
-                })
-                .catch(e => console.error("Error loading inputs:", e));
+            inputsPager.reset();
         }
 
         // Helper to toggle loading state
@@ -269,35 +407,200 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         }
 
-        // --- PHASE 2 LOGIC ---
-        if (analyzeBtn) {
-            analyzeBtn.onclick = async () => {
-                setLoading(analyzeBtn, true, "Detectando Patrones...");
+        // Actualiza el texto de un botón que ya está en estado de carga
+        function setLoadingText(btn, text) {
+            const textSpan = btn && btn.querySelector('.btn-text');
+            if (textSpan) textSpan.textContent = text;
+        }
 
-                const mode = (cloudToggle && cloudToggle.checked) ? 'cloud' : 'local';
-                console.log("Modo:", mode);
+        // Texto de espera en la cola del modelo local ({position, eta_seconds})
+        function queueLabel(queue) {
+            const eta = queue.eta_seconds >= 60 ? `${Math.round(queue.eta_seconds / 60)} min` : `${queue.eta_seconds} s`;
+            return `En cola: ${queue.position} por delante (~${eta})`;
+        }
+
+        // onProgress para las fases que solo informan de la cola
+        function showQueue(btn) {
+            return p => { if (p.step === 'queue') setLoadingText(btn, queueLabel(p)); };
+        }
+
+        // Lanza un análisis y devuelve su resultado. Con EventSource se recibe en streaming
+        // (onItem se llama con cada elemento ya parseado); si no, se encola como trabajo.
+        function runAnalysis(phase, mode, onItem, onProgress) {
+            if (window.EventSource) return streamAnalysis(phase, mode, onItem, onProgress);
+            return runAnalysisJob(phase, mode);
+        }
+
+        function streamAnalysis(phase, mode, onItem, onProgress) {
+            return new Promise(resolve => {
+                const source = new EventSource(`/api/cases/${CURRENT_CASE_ID}/analyze/${phase}/stream?mode=${mode}`);
+                let count = 0;
+                source.addEventListener('item', e => {
+                    count++;
+                    if (onItem) onItem(JSON.parse(e.data), count);
+                });
+                // Casos grandes: avance del análisis por bloques (map-reduce)
+                source.addEventListener('progress', e => {
+                    if (onProgress) onProgress(JSON.parse(e.data));
+                });
+                // Modelo local ocupado: posición en la cola y espera estimada
+                source.addEventListener('queue', e => {
+                    if (onProgress) onProgress(Object.assign({ step: 'queue' }, JSON.parse(e.data)));
+                });
+                source.addEventListener('done', e => {
+                    source.close();
+                    resolve(JSON.parse(e.data));
+                });
+                source.addEventListener('phase_error', e => {
+                    source.close();
+                    resolve({ error: JSON.parse(e.data).error });
+                });
+                source.onerror = () => {
+                    source.close();
+                    resolve({ error: 'Se perdió la conexión con el servidor' });
+                };
+            });
+        }
 
+        // Encola el análisis (responde 202 con un trabajo) y espera su resultado consultando /api/jobs
+        async function runAnalysisJob(phase, mode) {
+            const res = await fetch(`/api/cases/${CURRENT_CASE_ID}/analyze/${phase}`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ mode: mode })
+            });
+            const job = await res.json();
+            if (res.status !== 202) return job;
+
+            const status = await pollJob(job.status_url);
+            if (status.status === 'done') return status.result;
+            return { error: status.error || 'Error desconocido' };
+        }
+
+        // Consulta /api/jobs cada 1,5 s hasta que el trabajo termina (onStatus recibe cada consulta).
+        // Devuelve el último estado; si el servidor ya no lo conoce o pasa JOB_MAX_WAIT_MS, un estado de error.
+        const JOB_POLL_MS = 1500;
+        const JOB_MAX_WAIT_MS = 60 * 60 * 1000;
+
+        async function pollJob(statusUrl, onStatus) {
+            const deadline = Date.now() + JOB_MAX_WAIT_MS;
+            while (Date.now() < deadline) {
+                await new Promise(resolve => setTimeout(resolve, JOB_POLL_MS));
+                const res = await fetch(statusUrl);
+                const status = await res.json();
+                if (!res.ok) return { status: 'error', error: status.error || `Error ${res.status}` };
+                if (onStatus) onStatus(status);
+                if (status.status === 'done' || status.status === 'error') return status;
+            }
+            return { status: 'error', error: 'El trabajo no ha terminado tras 60 minutos; vuelve a cargar el caso más tarde' };
+        }
+
+        // Pipeline completo (Fases 2→7) como un único trabajo en el servidor
+        const pipelineBtn = document.getElementById('run-pipeline-btn');
+        const STAGE_LABELS = {
+            patterns: 'Patrones', link_axes: 'Ejes', dimensions: 'Dimensiones',
+            tensions: 'Tensiones', threshold: 'Diagnóstico', archetype: 'Arquetipo'
+        };
+
+        if (pipelineBtn) {
+            pipelineBtn.onclick = async () => {
+                setLoading(pipelineBtn, true, "Encolando...");
+                const mode = (cloudToggle && cloudToggle.checked) ? 'cloud' : 'local';
                 try {
-                    const res = await fetch(`/api/cases/${CURRENT_CASE_ID}/analyze/patterns`, {
+                    const res = await fetch(`/api/cases/${CURRENT_CASE_ID}/pipeline`, {
                         method: 'POST',
                         headers: { 'Content-Type': 'application/json' },
                         body: JSON.stringify({ mode: mode })
                     });
+                    const job = await res.json();
+                    if (res.status !== 202) {
+                        alert('Error: ' + (job.error || 'No se pudo iniciar el pipeline'));
+                        return;
+                    }
 
-                    const contentType = res.headers.get("content-type");
-                    if (contentType && contentType.indexOf("application/json") !== -1) {
-                        const data = await res.json();
-                        if (data.error) {
-                            alert('Error: ' + data.error);
-                        } else {
-                            loadPatterns();
+                    const status = await pollJob(job.status_url, status => {
+                        const progress = status.progress || {};
+                        if (status.queue) setLoadingText(pipelineBtn, queueLabel(status.queue));
+                        else if (progress.current) {
+                            setLoadingText(pipelineBtn, `${STAGE_LABELS[progress.current] || progress.current} (${progress.completed + 1}/${progress.total})`);
                         }
-                    } else {
-                        const text = await res.text();
-                        console.error("Server Error:", text);
-                        alert('Error del servidor (500). Revisa la consola para más detalles.');
+                    });
+
+                    await loadBundle();
+                    const result = status.result || {};
+                    if (status.status === 'error') alert('Error: ' + status.error);
+                    else if (result.status === 'error') {
+                        const failed = Object.entries(result.stages).filter(([, s]) => s.status === 'error');
+                        alert(failed.map(([name, s]) => `${STAGE_LABELS[name] || name}: ${s.error}`).join('\n'));
+                    } else if (result.stopped_reason) alert(`Pipeline detenido: ${result.stopped_reason}`);
+                } catch (e) {
+                    alert('Error de conexión: ' + e.message);
+                } finally {
+                    setLoading(pipelineBtn, false);
+                }
+            };
+        }
+
+        // Fase 9: re-análisis incremental (solo inputs añadidos desde el último análisis)
+        const incrementalBtn = document.getElementById('incremental-btn');
+
+        function renderPendingInputs(pending, patternCount) {
+            if (!incrementalBtn) return;
+            incrementalBtn.classList.toggle('hidden', !(pending > 0 && patternCount > 0));
+            const textSpan = incrementalBtn.querySelector('.btn-text');
+            if (textSpan && !incrementalBtn.disabled) textSpan.textContent = `🔄 Analizar ${pending} inputs nuevos`;
+        }
+
+        if (incrementalBtn) {
+            incrementalBtn.onclick = async () => {
+                setLoading(incrementalBtn, true, "Analizando inputs nuevos...");
+                const mode = (cloudToggle && cloudToggle.checked) ? 'cloud' : 'local';
+                try {
+                    const res = await fetch(`/api/cases/${CURRENT_CASE_ID}/analyze/incremental`, {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ mode: mode })
+                    });
+                    const job = await res.json();
+                    if (res.status !== 202) {
+                        alert('Error: ' + (job.error || 'No se pudo iniciar el análisis'));
+                        return;
                     }
+                    const status = await pollJob(job.status_url, status => {
+                        const progress = status.progress || {};
+                        if (status.queue) setLoadingText(incrementalBtn, queueLabel(status.queue));
+                        else if (progress.current) setLoadingText(incrementalBtn, `${STAGE_LABELS[progress.current] || 'Patrones'}...`);
+                    });
+                    if (status.status === 'error') alert('Error: ' + status.error);
+                    else if (status.result.patterns && !status.result.patterns.changed) alert('Los inputs nuevos no cambian los patrones.');
+                } catch (e) {
+                    alert('Error de conexión: ' + e.message);
+                } finally {
+                    setLoading(incrementalBtn, false);
+                    await loadBundle();
+                }
+            };
+        }
 
+        // --- PHASE 2 LOGIC ---
+        if (analyzeBtn) {
+            analyzeBtn.onclick = async () => {
+                setLoading(analyzeBtn, true, "Detectando Patrones...");
+
+                const mode = (cloudToggle && cloudToggle.checked) ? 'cloud' : 'local';
+                console.log("Modo:", mode);
+
+                try {
+                    const data = await runAnalysis('patterns', mode,
+                        (item, n) => setLoadingText(analyzeBtn, `Detectando Patrones... (${n} patrones)`),
+                        p => setLoadingText(analyzeBtn, p.step === 'queue' ? queueLabel(p)
+                            : p.step === 'map' ? `Analizando bloques... (${p.completed}/${p.total})`
+                            : `Consolidando ${p.candidates} patrones...`));
+                    if (data.error) {
+                        alert('Error: ' + data.error);
+                    } else {
+                        loadPatterns();
+                    }
                 } catch (e) {
                     alert('Error de conexión: ' + e.message);
                     console.error(e);
@@ -310,31 +613,33 @@ document.addEventListener('DOMContentLoaded', () => {
         function loadPatterns() {
             fetch(`/api/cases/${CURRENT_CASE_ID}/patterns`)
                 .then(res => res.json())
-                .then(patterns => {
-                    if (!patternsList) return;
-                    patternsList.innerHTML = '';
-                    if (patterns.length === 0) {
-                        patternsList.innerHTML = '<div style="text-align:center; color:var(--text-secondary); padding: 2rem; grid-column: 1/-1;">No hay patrones detectados aún.</div>';
-                        return;
-                    }
-                    patterns.forEach(p => {
-                        const div = document.createElement('div');
-                        div.className = 'pattern-card';
-                        div.innerHTML = `
-                            <div class="pattern-tags">
-                                <span class="tag recurrence-${p.recurrence}">Recurrencia: ${p.recurrence}</span>
-                                <span class="tag">Persistencia: ${p.persistence}</span>
-                                <span class="tag">Presión: ${p.pressure_context}</span>
-                            </div>
-                            <h4>${p.description}</h4>
-                            ${p.contradictions !== 'Ninguna' ? `<div class="pattern-contradictions">⚠️ ${p.contradictions}</div>` : ''}
-                        `;
-                        patternsList.appendChild(div);
-                    });
-                })
+                .then(renderPatterns)
                 .catch(e => console.error("Error loading patterns:", e));
         }
 
+        function renderPatterns(patterns) {
+            if (!patternsList) return;
+            patternsList.innerHTML = '';
+            if (patterns.length === 0) {
+                patternsList.innerHTML = '<div style="text-align:center; color:var(--text-secondary); padding: 2rem; grid-column: 1/-1;">No hay patrones detectados aún.</div>';
+                return;
+            }
+            patterns.forEach(p => {
+                const div = document.createElement('div');
+                div.className = 'pattern-card';
+                div.innerHTML = `
+                    <div class="pattern-tags">
+                        <span class="tag recurrence-${p.recurrence}">Recurrencia: ${p.recurrence}</span>
+                        <span class="tag">Persistencia: ${p.persistence}</span>
+                        <span class="tag">Presión: ${p.pressure_context}</span>
+                    </div>
+                    <h4>${p.description}</h4>
+                    ${p.contradictions !== 'Ninguna' ? `<div class="pattern-contradictions">⚠️ ${p.contradictions}</div>` : ''}
+                `;
+                patternsList.appendChild(div);
+            });
+        }
+
 
         // --- PHASE 3 LOGIC ---
         const autoLinkBtn = document.getElementById('auto-link-btn');
@@ -345,12 +650,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 const mode = (cloudToggle && cloudToggle.checked) ? 'cloud' : 'local';
 
                 try {
-                    const res = await fetch(`/api/cases/${CURRENT_CASE_ID}/analyze/link_axes`, {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ mode: mode })
-                    });
-                    const data = await res.json();
+                    const data = await runAnalysis('link_axes', mode, (item, n) => setLoadingText(autoLinkBtn, `Vinculando Ejes... (${n} vínculos)`),
+                        showQueue(autoLinkBtn));
                     if (data.error) alert(data.error);
                     else loadAxesAssignments();
                 } catch (e) {
@@ -364,29 +665,28 @@ document.addEventListener('DOMContentLoaded', () => {
         function loadAxesAssignments() {
             fetch(`/api/cases/${CURRENT_CASE_ID}/axis_assignments`)
                 .then(res => res.json())
-                .then(assigns => {
-                    // Limpiar columnas
-                    document.querySelectorAll('.axis-column .axis-content').forEach(el => el.innerHTML = '');
-
-                    assigns.forEach(a => {
-                        // Buscar columna por nombre de eje (data-axis)
-                        const col = document.querySelector(`.axis-column[data-axis="${a.axis_name}"] .axis-content`);
-                        if (col) {
-                            const card = document.createElement('div');
-                            card.className = 'axis-card';
-                            card.innerHTML = `
-                                <strong>${a.pattern_description}</strong>
-                                <div class="justification">${a.justification}</div>
-                            `;
-                            col.appendChild(card);
-                        }
-                    });
-                })
+                .then(renderAxesAssignments)
                 .catch(e => console.error("Error loading axes:", e));
         }
 
-        // Cargar datos iniciales si estamos en fase 3
-        loadAxesAssignments();
+        function renderAxesAssignments(assigns) {
+            // Limpiar columnas
+            document.querySelectorAll('.axis-column .axis-content').forEach(el => el.innerHTML = '');
+
+            assigns.forEach(a => {
+                // Buscar columna por nombre de eje (data-axis)
+                const col = document.querySelector(`.axis-column[data-axis="${a.axis_name}"] .axis-content`);
+                if (col) {
+                    const card = document.createElement('div');
+                    card.className = 'axis-card';
+                    card.innerHTML = `
+                        <strong>${a.pattern_description}</strong>
+                        <div class="justification">${a.justification}</div>
+                    `;
+                    col.appendChild(card);
+                }
+            });
+        }
 
         // Habilitar link fase 3
         const p3Link = document.querySelector('[data-phase="3"]');
@@ -401,12 +701,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 const mode = (cloudToggle && cloudToggle.checked) ? 'cloud' : 'local';
 
                 try {
-                    const res = await fetch(`/api/cases/${CURRENT_CASE_ID}/analyze/dimensions`, {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ mode: mode })
-                    });
-                    const data = await res.json();
+                    const data = await runAnalysis('dimensions', mode, (item, n) => setLoadingText(analyzeDimBtn, `Clasificando... (${n} ejes)`),
+                        showQueue(analyzeDimBtn));
                     if (data.error) alert(data.error);
                     else loadDimensions();
                 } catch (e) {
@@ -420,36 +716,35 @@ document.addEventListener('DOMContentLoaded', () => {
         function loadDimensions() {
             fetch(`/api/cases/${CURRENT_CASE_ID}/axis_states`)
                 .then(res => res.json())
-                .then(states => {
-                    const container = document.getElementById('dimensions-container');
-                    if (!container) return;
-                    container.innerHTML = '';
-
-                    if (states.length === 0) {
-                        container.innerHTML = '<div style="grid-column:1/-1; text-align:center; color:var(--text-secondary)">No hay dimensiones analizadas.</div>';
-                        return;
-                    }
-
-                    states.forEach(s => {
-                        const statusClass = `status-${s.status.replace(/\s+/g, '-')}`;
-                        const div = document.createElement('div');
-                        div.className = `dimension-card ${statusClass}`;
-                        div.innerHTML = `
-                            <div class="dim-header">
-                                <span class="dim-title">${s.axis_name}</span>
-                                <span class="dim-status">${s.status}</span>
-                            </div>
-                            <div class="dim-value">${s.value || '---'}</div>
-                            <div class="dim-justification">${s.justification}</div>
-                        `;
-                        container.appendChild(div);
-                    });
-                })
+                .then(renderDimensions)
                 .catch(e => console.error("Error loading dimensions:", e));
         }
 
-        // Cargar datos iniciales si estamos en fase 4
-        loadDimensions();
+        function renderDimensions(states) {
+            const container = document.getElementById('dimensions-container');
+            if (!container) return;
+            container.innerHTML = '';
+
+            if (states.length === 0) {
+                container.innerHTML = '<div style="grid-column:1/-1; text-align:center; color:var(--text-secondary)">No hay dimensiones analizadas.</div>';
+                return;
+            }
+
+            states.forEach(s => {
+                const statusClass = `status-${s.status.replace(/\s+/g, '-')}`;
+                const div = document.createElement('div');
+                div.className = `dimension-card ${statusClass}`;
+                div.innerHTML = `
+                    <div class="dim-header">
+                        <span class="dim-title">${s.axis_name}</span>
+                        <span class="dim-status">${s.status}</span>
+                    </div>
+                    <div class="dim-value">${s.value || '---'}</div>
+                    <div class="dim-justification">${s.justification}</div>
+                `;
+                container.appendChild(div);
+            });
+        }
 
         // Habilitar link fase 4 si hay datos previos (opcional, por ahora lo dejamos habilitado por defecto en HTML o aquí)
         const p4Link = document.querySelector('[data-phase="4"]');
@@ -464,12 +759,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 const mode = (cloudToggle && cloudToggle.checked) ? 'cloud' : 'local';
 
                 try {
-                    const res = await fetch(`/api/cases/${CURRENT_CASE_ID}/analyze/tensions`, {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ mode: mode })
-                    });
-                    const data = await res.json();
+                    const data = await runAnalysis('tensions', mode, (item, n) => setLoadingText(analyzeTensionBtn, `Buscando Tensiones... (${n} tensiones)`),
+                        showQueue(analyzeTensionBtn));
                     if (data.error) alert(data.error);
                     else loadTensions();
                 } catch (e) {
@@ -483,42 +774,41 @@ document.addEventListener('DOMContentLoaded', () => {
         function loadTensions() {
             fetch(`/api/cases/${CURRENT_CASE_ID}/tensions`)
                 .then(res => res.json())
-                .then(tensions => {
-                    const container = document.getElementById('tensions-container');
-                    if (!container) return;
-                    container.innerHTML = '';
-
-                    if (tensions.length === 0) {
-                        container.innerHTML = '<div style="text-align:center; color:var(--text-secondary)">No hay tensiones detectadas.</div>';
-                        return;
-                    }
-
-                    tensions.forEach(t => {
-                        // Normalizar severidad para clase CSS (extraer Alta/Media/Baja)
-                        let severityClass = 'baja';
-                        if (t.severity.includes('Alta')) severityClass = 'alta';
-                        else if (t.severity.includes('Media')) severityClass = 'media';
-
-                        const div = document.createElement('div');
-                        div.className = 'tension-card';
-                        div.innerHTML = `
-                            <div class="tension-header">
-                                <span class="tension-type">${t.type}</span>
-                                <span class="tension-severity severity-${severityClass}">${t.severity}</span>
-                            </div>
-                            <div class="tension-desc">${t.description}</div>
-                            <div class="tension-axes">
-                                <strong>Ejes en conflicto:</strong> ${t.axes_involved.join(', ')}
-                            </div>
-                        `;
-                        container.appendChild(div);
-                    });
-                })
+                .then(renderTensions)
                 .catch(e => console.error("Error loading tensions:", e));
         }
 
-        // Cargar datos iniciales
-        loadTensions();
+        function renderTensions(tensions) {
+            const container = document.getElementById('tensions-container');
+            if (!container) return;
+            container.innerHTML = '';
+
+            if (tensions.length === 0) {
+                container.innerHTML = '<div style="text-align:center; color:var(--text-secondary)">No hay tensiones detectadas.</div>';
+                return;
+            }
+
+            tensions.forEach(t => {
+                // Normalizar severidad para clase CSS (extraer Alta/Media/Baja)
+                let severityClass = 'baja';
+                if (t.severity.includes('Alta')) severityClass = 'alta';
+                else if (t.severity.includes('Media')) severityClass = 'media';
+
+                const div = document.createElement('div');
+                div.className = 'tension-card';
+                div.innerHTML = `
+                    <div class="tension-header">
+                        <span class="tension-type">${t.type}</span>
+                        <span class="tension-severity severity-${severityClass}">${t.severity}</span>
+                    </div>
+                    <div class="tension-desc">${t.description}</div>
+                    <div class="tension-axes">
+                        <strong>Ejes en conflicto:</strong> ${t.axes_involved.join(', ')}
+                    </div>
+                `;
+                container.appendChild(div);
+            });
+        }
 
         // Habilitar link fase 5
         const p5Link = document.querySelector('[data-phase="5"]');
@@ -533,12 +823,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 const mode = (cloudToggle && cloudToggle.checked) ? 'cloud' : 'local';
 
                 try {
-                    const res = await fetch(`/api/cases/${CURRENT_CASE_ID}/analyze/threshold`, {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ mode: mode })
-                    });
-                    const data = await res.json();
+                    const data = await runAnalysis('threshold', mode, null, showQueue(analyzeThresholdBtn));
                     if (data.error) alert(data.error);
                     else loadThreshold();
                 } catch (e) {
@@ -552,26 +837,25 @@ document.addEventListener('DOMContentLoaded', () => {
         function loadThreshold() {
             fetch(`/api/cases/${CURRENT_CASE_ID}/threshold`)
                 .then(res => res.json())
-                .then(data => {
-                    const container = document.getElementById('threshold-container');
-                    if (!data || !container) return;
-
-                    container.classList.remove('hidden');
-                    document.getElementById('threshold-score').textContent = data.score;
-                    document.getElementById('threshold-status').textContent = data.status;
-                    document.getElementById('threshold-reasoning').textContent = data.reasoning;
-
-                    // Color coding based on score
-                    const circle = document.querySelector('.score-circle');
-                    if (data.score >= 61) circle.style.borderColor = 'var(--success)';
-                    else if (data.score >= 41) circle.style.borderColor = '#ffce56';
-                    else circle.style.borderColor = 'var(--danger)';
-                })
+                .then(renderThreshold)
                 .catch(e => console.error("Error loading threshold:", e));
         }
 
-        // Cargar datos iniciales
-        loadThreshold();
+        function renderThreshold(data) {
+            const container = document.getElementById('threshold-container');
+            if (!data || !container) return;
+
+            container.classList.remove('hidden');
+            document.getElementById('threshold-score').textContent = data.score;
+            document.getElementById('threshold-status').textContent = data.status;
+            document.getElementById('threshold-reasoning').textContent = data.reasoning;
+
+            // Color coding based on score
+            const circle = document.querySelector('.score-circle');
+            if (data.score >= 61) circle.style.borderColor = 'var(--success)';
+            else if (data.score >= 41) circle.style.borderColor = '#ffce56';
+            else circle.style.borderColor = 'var(--danger)';
+        }
 
         // Habilitar link fase 6
         const p6Link = document.querySelector('[data-phase="6"]');
@@ -586,12 +870,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 const mode = (cloudToggle && cloudToggle.checked) ? 'cloud' : 'local';
 
                 try {
-                    const res = await fetch(`/api/cases/${CURRENT_CASE_ID}/analyze/archetype`, {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ mode: mode })
-                    });
-                    const data = await res.json();
+                    const data = await runAnalysis('archetype', mode, null, showQueue(analyzeArchetypeBtn));
                     if (data.error) alert(data.error);
                     else loadArchetype();
                 } catch (e) {
@@ -605,31 +884,30 @@ document.addEventListener('DOMContentLoaded', () => {
         function loadArchetype() {
             fetch(`/api/cases/${CURRENT_CASE_ID}/archetype`)
                 .then(res => res.json())
-                .then(data => {
-                    const container = document.getElementById('archetype-container');
-                    if (!data || !container) return;
-
-                    container.classList.remove('hidden');
-                    document.getElementById('arch-name').textContent = data.archetype_name;
-                    document.getElementById('arch-fit').textContent = data.fit_score;
-                    document.getElementById('arch-desc').textContent = data.description;
-
-                    const traitsContainer = document.getElementById('arch-traits');
-                    traitsContainer.innerHTML = '';
-                    if (data.key_traits && Array.isArray(data.key_traits)) {
-                        data.key_traits.forEach(trait => {
-                            const span = document.createElement('span');
-                            span.className = 'trait-tag';
-                            span.textContent = trait;
-                            traitsContainer.appendChild(span);
-                        });
-                    }
-                })
+                .then(renderArchetype)
                 .catch(e => console.error("Error loading archetype:", e));
         }
 
-        // Cargar datos iniciales
-        loadArchetype();
+        function renderArchetype(data) {
+            const container = document.getElementById('archetype-container');
+            if (!data || !container) return;
+
+            container.classList.remove('hidden');
+            document.getElementById('arch-name').textContent = data.archetype_name;
+            document.getElementById('arch-fit').textContent = data.fit_score;
+            document.getElementById('arch-desc').textContent = data.description;
+
+            const traitsContainer = document.getElementById('arch-traits');
+            traitsContainer.innerHTML = '';
+            if (data.key_traits && Array.isArray(data.key_traits)) {
+                data.key_traits.forEach(trait => {
+                    const span = document.createElement('span');
+                    span.className = 'trait-tag';
+                    span.textContent = trait;
+                    traitsContainer.appendChild(span);
+                });
+            }
+        }
 
         // Habilitar link fase 7
         const p7Link = document.querySelector('[data-phase="7"]');
@@ -704,124 +982,122 @@ document.addEventListener('DOMContentLoaded', () => {
                             axesGrid.appendChild(div);
                         });
                     }
+
+                    // 5. Radar Chart (mismos datos de ejes del reporte)
+                    renderRadarChart(data.axes || []);
                 })
                 .catch(e => console.error("Error loading report:", e));
+        }
 
-            // 5. Radar Chart Logic
-            // Fetch Axes data again (or reuse if available in 'data.axes')
-            fetch(`/api/cases/${CURRENT_CASE_ID}/axis_states`)
-                .then(res => res.json())
-                .then(axes => {
-                    const ctx = document.getElementById('axesRadarChart');
-                    if (!ctx) return;
+        function renderRadarChart(axes) {
+            const ctx = document.getElementById('axesRadarChart');
+            if (!ctx) return;
 
-                    // Destroy existing chart if it exists
-                    if (window.myRadarChart) {
-                        window.myRadarChart.destroy();
-                    }
+            // Destroy existing chart if it exists
+            if (window.myRadarChart) {
+                window.myRadarChart.destroy();
+            }
 
-                    // Define Axis Labels and default values
-                    // Ordering is important for shape consistency
-                    const axisLabels = [
-                        "Generación",
-                        "Relación con el cambio feminista",
-                        "Modelo de masculinidad",
-                        "Apertura a diversidad sexual y familiar",
-                        "Manejo emocional y cuidado de sí",
-                        "Presión social / falta de referentes"
-                    ];
-
-                    // Helper to score importance/definition
-                    // 100 = Definido / Positivo / Abierto
-                    // 50 = En Tensión / Ambigio
-                    // 20 = No Definido / Tradicional / Cerrado (low score doesn't mean bad, just 'low' intensity of new masculinity traits)
-                    const getScore = (status, value) => {
-                        const s = (status || "").toLowerCase();
-                        if (s.includes("definido") && !s.includes("no")) return 90;
-                        if (s.includes("tensión") || s.includes("tension")) return 50;
-                        if (s.includes("parcial")) return 60;
-                        if (s.includes("no definido")) return 30;
-                        return 40; // Default fallback
-                    };
-
-                    // Map DB data to ordered array
-                    const dataPoints = axisLabels.map(label => {
-                        const found = axes.find(a => a.axis_name.includes(label) || label.includes(a.axis_name));
-                        // Fuzzy match fallback or exact match
-                        if (found) {
-                            return getScore(found.status, found.value);
-                        }
-                        return 20; // Default low score if missing
-                    });
+            // Define Axis Labels and default values
+            // Ordering is important for shape consistency
+            const axisLabels = [
+                "Generación",
+                "Relación con el cambio feminista",
+                "Modelo de masculinidad",
+                "Apertura a diversidad sexual y familiar",
+                "Manejo emocional y cuidado de sí",
+                "Presión social / falta de referentes"
+            ];
+
+            // Helper to score importance/definition
+            // 100 = Definido / Positivo / Abierto
+            // 50 = En Tensión / Ambigio
+            // 20 = No Definido / Tradicional / Cerrado (low score doesn't mean bad, just 'low' intensity of new masculinity traits)
+            const getScore = (status, value) => {
+                const s = (status || "").toLowerCase();
+                if (s.includes("definido") && !s.includes("no")) return 90;
+                if (s.includes("tensión") || s.includes("tension")) return 50;
+                if (s.includes("parcial")) return 60;
+                if (s.includes("no definido")) return 30;
+                return 40; // Default fallback
+            };
+
+            // Map DB data to ordered array
+            const dataPoints = axisLabels.map(label => {
+                const found = axes.find(a => a.axis_name.includes(label) || label.includes(a.axis_name));
+                // Fuzzy match fallback or exact match
+                if (found) {
+                    return getScore(found.status, found.value);
+                }
+                return 20; // Default low score if missing
+            });
 
-                    // Short Labels for Chart
-                    const shortLabels = [
-                        "Generación",
-                        "Feminismo",
-                        "Modelo Masc.",
-                        "Diversidad",
-                        "Emociones",
-                        "Presión Social"
-                    ];
-
-                    if (typeof Chart !== 'undefined') {
-                        window.myRadarChart = new Chart(ctx, {
-                            type: 'radar',
-                            data: {
-                                labels: shortLabels,
-                                datasets: [{
-                                    label: 'Perfil de Masculinidad',
-                                    data: dataPoints,
-                                    fill: true,
-                                    backgroundColor: 'rgba(127, 90, 240, 0.2)', // --accent with opacity
-                                    borderColor: '#7f5af0', // --accent
-                                    pointBackgroundColor: '#7f5af0',
-                                    pointBorderColor: '#fff',
-                                    pointHoverBackgroundColor: '#fff',
-                                    pointHoverBorderColor: '#7f5af0'
-                                }]
-                            },
-                            options: {
-                                elements: {
-                                    line: {
-                                        borderWidth: 3
-                                    }
+            // Short Labels for Chart
+            const shortLabels = [
+                "Generación",
+                "Feminismo",
+                "Modelo Masc.",
+                "Diversidad",
+                "Emociones",
+                "Presión Social"
+            ];
+
+            if (typeof Chart !== 'undefined') {
+                window.myRadarChart = new Chart(ctx, {
+                    type: 'radar',
+                    data: {
+                        labels: shortLabels,
+                        datasets: [{
+                            label: 'Perfil de Masculinidad',
+                            data: dataPoints,
+                            fill: true,
+                            backgroundColor: 'rgba(127, 90, 240, 0.2)', // --accent with opacity
+                            borderColor: '#7f5af0', // --accent
+                            pointBackgroundColor: '#7f5af0',
+                            pointBorderColor: '#fff',
+                            pointHoverBackgroundColor: '#fff',
+                            pointHoverBorderColor: '#7f5af0'
+                        }]
+                    },
+                    options: {
+                        elements: {
+                            line: {
+                                borderWidth: 3
+                            }
+                        },
+                        scales: {
+                            r: {
+                                angleLines: {
+                                    color: 'rgba(0, 0, 0, 0.1)'
+                                },
+                                grid: {
+                                    color: 'rgba(0, 0, 0, 0.1)'
                                 },
-                                scales: {
-                                    r: {
-                                        angleLines: {
-                                            color: 'rgba(0, 0, 0, 0.1)'
-                                        },
-                                        grid: {
-                                            color: 'rgba(0, 0, 0, 0.1)'
-                                        },
-                                        pointLabels: {
-                                            font: {
-                                                size: 12,
-                                                family: "'Inter', sans-serif"
-                                            },
-                                            color: '#232946'
-                                        },
-                                        suggestedMin: 0,
-                                        suggestedMax: 100,
-                                        ticks: {
-                                            display: false // Hide numbers for cleaner look
-                                        }
-                                    }
+                                pointLabels: {
+                                    font: {
+                                        size: 12,
+                                        family: "'Inter', sans-serif"
+                                    },
+                                    color: '#232946'
                                 },
-                                plugins: {
-                                    legend: {
-                                        display: false
-                                    }
+                                suggestedMin: 0,
+                                suggestedMax: 100,
+                                ticks: {
+                                    display: false // Hide numbers for cleaner look
                                 }
                             }
-                        });
-                    } else {
-                        console.error("Chart.js library not loaded.");
-                        ctx.innerHTML = "<p style='color:red;'>Error: Librería gráfica no cargada.</p>";
+                        },
+                        plugins: {
+                            legend: {
+                                display: false
+                            }
+                        }
                     }
-
                 });
+            } else {
+                console.error("Chart.js library not loaded.");
+                ctx.innerHTML = "<p style='color:red;'>Error: Librería gráfica no cargada.</p>";
+            }
         }
 
         // Hook into switchPhase to load report when tab is clicked
@@ -0,0 +1,167 @@
+"""Precarga de los modelos locales y guardián que los mantiene en memoria.
+
+Ollama carga el modelo en la primera llamada (en el Mac, solo la librería Metal
+tarda más de 11s) y lo descarga tras OLLAMA_KEEP_ALIVE sin uso, así que el
+primer análisis después de un rato parado paga el arranque en frío. Al
+arrancar cada worker de gunicorn (post_worker_init en gunicorn.conf.py) o el
+proceso hijo del recargador de ``python app.py`` se precargan los modelos
+configurados y un hilo en segundo plano renueva su keep_alive antes de que
+caduquen, solo en horario laboral: fuera de él Ollama los descarga y libera la
+memoria. De todos esos procesos solo uno hace de guardián, el que tiene el
+cerrojo de fichero junto a la DB. Con otros lanzadores (``flask run``) no se
+arranca.
+"""
+import os
+import time
+import threading
+from datetime import datetime, timezone
+import database as db
+import llm
+import scheduler
+
+ENABLED = os.getenv('PHENOMA_WARMUP', '1') != '0'
+MODELS = [m.strip() for m in os.getenv('PHENOMA_WARM_MODELS', llm.LOCAL_MODEL).split(',') if m.strip()]
+INTERVAL = float(os.getenv('PHENOMA_WARM_INTERVAL', '120'))
+# Horas [inicio, fin) y días (0 = lunes, ambos incluidos) en los que el modelo se mantiene cargado
+HOURS = os.getenv('PHENOMA_WARM_HOURS', '8-20')
+DAYS = os.getenv('PHENOMA_WARM_DAYS', '0-4')
+
+_lock = threading.Lock()
+_keeper_pid = None
+_lease = None
+_last_attempt = None
+_state = {'models': {}, 'last_check': None, 'last_error': None}
+
+def _span(text):
+    start, _, end = text.partition('-')
+    return int(start), int(end or start)
+
+def in_business_hours(now=None):
+    now = now or datetime.now()
+    first_day, last_day = _span(DAYS)
+    start, end = _span(HOURS)
+    return first_day <= now.weekday() <= last_day and start <= now.hour < end
+
+def _base_name(name):
+    return name if ':' in name else f'{name}:latest'
+
+def _expires_at(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        # Ollama devuelve nanosegundos; fromisoformat solo admite microsegundos
+        text = str(value).replace('Z', '+00:00')
+        head, dot, tail = text.partition('.')
+        if dot:
+            digits = len(tail) - len(tail.lstrip('0123456789'))
+            tail = tail[:min(digits, 6)] + tail[digits:]
+        return datetime.fromisoformat(head + dot + tail)
+    except ValueError:
+        return None
+
+def loaded_models():
+    """Modelos cargados en Ollama y cuándo caduca su keep_alive (None si no se sabe)."""
+    loaded = {}
+    for model in llm.get_ollama_client().ps().get('models') or []:
+        loaded[_base_name(model.get('model') or model.get('name'))] = _expires_at(model.get('expires_at'))
+    return loaded
+
+def preload(model):
+    """Carga ``model`` (o renueva su keep_alive) con una generación vacía; devuelve los segundos de carga."""
+    # Ocupa el hueco de Ollama como una llamada más, detrás de las de los usuarios,
+    # pero sin contar para la duración media de la cola
+    with scheduler.context(priority='batch'):
+        ticket = scheduler.acquire('warmup')
+    start = time.perf_counter()
+    try:
+        response = llm.get_ollama_client().generate(model=model, prompt='', keep_alive=llm.KEEP_ALIVE)
+    finally:
+        scheduler.release(ticket, None)
+    seconds = time.perf_counter() - start
+    load = llm._load_seconds(response)
+    _state['models'][model] = {'warmed_at': datetime.now().isoformat(), 'seconds': round(seconds, 3),
+                               'load_seconds': round(load, 3) if load is not None else None}
+    return load
+
+def warm(models=None, force=False):
+    """Precarga los modelos que no están cargados o cuyo keep_alive caduca antes de la próxima pasada."""
+    models = models or MODELS
+    loaded = loaded_models()
+    now = datetime.now(timezone.utc)
+    warmed = {}
+    for model in models:
+        expires = loaded.get(_base_name(model), False)
+        if not force and expires is not False and expires is not None \
+                and (expires - now).total_seconds() > INTERVAL * 1.5:
+            continue
+        warmed[model] = preload(model)
+    _state['last_check'] = datetime.now().isoformat()
+    return warmed
+
+def _keeper():
+    first = True
+    while True:
+        # Al arrancar se precarga siempre; después, solo en horario laboral
+        if first or in_business_hours():
+            try:
+                warmed = warm()
+                if warmed:
+                    print(f"Modelos locales precargados: {', '.join(f'{m} ({s or 0:.1f}s de carga)' for m, s in warmed.items())}")
+                _state['last_error'] = None
+            except Exception as e:
+                # Ollama parado o sin el modelo: se avisa una vez y se reintenta en la siguiente pasada
+                if _state['last_error'] is None:
+                    print(f"Aviso: no se pudieron precargar los modelos locales: {e}")
+                _state['last_error'] = str(e)
+        first = False
+        time.sleep(INTERVAL)
+
+def _take_lease():
+    global _lease
+    try:
+        import fcntl
+    except ImportError:
+        return True  # sin flock (Windows): cada proceso hace de guardián
+    handle = open(f'{db.DB_NAME}.warmup.lock', 'w')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    _lease = handle
+    return True
+
+def start():
+    """Arranca el guardián en este proceso si nadie más lo tiene; devuelve si este proceso es el guardián.
+
+    Lo llaman post_worker_init (gunicorn.conf.py) y ``python app.py`` en el
+    proceso hijo del recargador, una vez por proceso. El worker que sustituye
+    al guardián muerto se queda con el cerrojo al arrancar.
+    """
+    global _keeper_pid, _last_attempt
+    if not ENABLED or not MODELS:
+        return False
+    with _lock:
+        if _keeper_pid == os.getpid():
+            return True
+        # Si otro proceso tiene el cerrojo se vuelve a intentar cada INTERVAL (puede haber terminado)
+        if _last_attempt is not None and time.monotonic() - _last_attempt < INTERVAL:
+            return False
+        _last_attempt = time.monotonic()
+        if not _take_lease():
+            return False
+        _keeper_pid = os.getpid()
+    threading.Thread(target=_keeper, name='phenoma-warmup', daemon=True).start()
+    return True
+
+def stats():
+    return {
+        'enabled': ENABLED,
+        'keeper': _keeper_pid == os.getpid(),
+        'models': MODELS,
+        'keep_alive': llm.KEEP_ALIVE,
+        'business_hours': in_business_hours(),
+        'last_check': _state['last_check'],
+        'last_error': _state['last_error'],
+        'warmed': dict(_state['models']),
+    }